@@ -4,11 +4,36 @@
 # 为python-telegram-bot添加缺失的imghdr模块替代品
 import sys
 import os
+import time
+
+# 启动耗时的起点：之后的模块导入都计入启动耗时
+IMPORT_START = time.perf_counter()
+
 import json  # 用于美化日志输出和数据持久化
 import datetime
 import pytz
 import re
 import logging
+import logging.handlers
+import math
+import operator
+import ast
+import atexit
+import concurrent.futures
+import contextlib
+import copy
+import csv
+import functools
+import gzip
+import hashlib
+import heapq
+import io
+import itertools
+import queue
+import shutil
+import tempfile
+import zipfile
+from collections import OrderedDict, deque
 
 # Create imghdr module replacement BEFORE importing telegram
 class ImghdrModule:
@@ -16,26 +41,94 @@ class ImghdrModule:
         return None
 sys.modules['imghdr'] = ImghdrModule()
 
-from telegram import Update, ParseMode, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import Updater, CommandHandler, MessageHandler, Filters, CallbackContext, CallbackQueryHandler
+from telegram import Bot, Update, ParseMode, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest
+from telegram.ext import Updater, CommandHandler, MessageHandler, Filters, CallbackContext, CallbackQueryHandler, TypeHandler
+from telegram.utils.request import Request
 import signal
 import threading
 from http.server import HTTPServer, BaseHTTPRequestHandler
 
 # 导入配置文件
 from config import BOT_TOKEN, ADMIN_USER_ID, INITIAL_OPERATORS, TIMEZONE, RESET_CHECK_INTERVAL
+# 可选配置项：旧版config.py中可能没有，使用getattr读取默认值
+import config
 
-# 设置详细的日志记录
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', 
-    level=logging.DEBUG,  # 将日志级别改为DEBUG以获取更多信息
-    handlers=[
-        logging.FileHandler("bot.log"),
-        logging.StreamHandler()
-    ]
-)
+# 日志配置：处理线程只把日志记录放入队列，格式化输出和写文件由后台监听线程完成
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+LOG_LEVEL = getattr(config, 'LOG_LEVEL', 'INFO')
+# 按logger名称单独设置级别，默认屏蔽每次轮询产生的连接池调试日志
+LOG_LEVELS = getattr(config, 'LOG_LEVELS', {
+    'telegram.vendor.ptb_urllib3.urllib3': 'WARNING',
+    'urllib3': 'WARNING',
+    'apscheduler': 'WARNING',
+})
+LOG_FILE = getattr(config, 'LOG_FILE', 'bot.log')
+LOG_MAX_MB = getattr(config, 'LOG_MAX_MB', 10)
+LOG_BACKUP_COUNT = getattr(config, 'LOG_BACKUP_COUNT', 5)
+
+# 匹配Bot API令牌（如请求URL中的 /bot123456:ABC.../getUpdates）
+TOKEN_PATTERN = re.compile(r'\d{5,}:[A-Za-z0-9_-]{30,}')
+
+class RedactingFormatter(logging.Formatter):
+    """输出前把日志中的机器人令牌替换掉，包括异常堆栈"""
+    def format(self, record):
+        text = super().format(record)
+        if BOT_TOKEN:
+            text = text.replace(BOT_TOKEN, '<BOT_TOKEN>')
+        return TOKEN_PATTERN.sub('<BOT_TOKEN>', text)
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """把日志记录原样放入队列，参数插值和异常堆栈的格式化都在QueueListener线程中进行
+
+    标准QueueHandler的prepare会在调用线程中先格式化一次；这里的队列只在进程内使用，不需要预先转成字符串
+    """
+    def prepare(self, record):
+        return record
+
+def compress_rotated_log(source, dest):
+    """日志轮转时把旧文件压缩为.gz"""
+    with open(source, 'rb') as src, gzip.open(dest, 'wb') as dst:
+        shutil.copyfileobj(src, dst)
+    os.remove(source)
+
+def setup_logging():
+    """根logger只挂QueueHandler，由QueueListener在后台线程写控制台和按大小轮转的日志文件"""
+    formatter = RedactingFormatter(LOG_FORMAT)
+    file_handler = logging.handlers.RotatingFileHandler(
+        LOG_FILE, maxBytes=int(LOG_MAX_MB * 1024 * 1024), backupCount=LOG_BACKUP_COUNT, encoding='utf-8')
+    file_handler.namer = lambda name: name + '.gz'
+    file_handler.rotator = compress_rotated_log
+    stream_handler = logging.StreamHandler()
+    for handler in (file_handler, stream_handler):
+        handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    root.setLevel(LOG_LEVEL)
+    root.addHandler(DeferredQueueHandler(log_queue))
+    for name, level in LOG_LEVELS.items():
+        logging.getLogger(name).setLevel(level)
+
+    listener = logging.handlers.QueueListener(log_queue, file_handler, stream_handler)
+    listener.start()
+    # 退出时停止监听线程，确保队列中剩余的日志写完
+    atexit.register(listener.stop)
+    return listener
+
+log_listener = setup_logging()
 logger = logging.getLogger(__name__)
 
+class LazyJSON:
+    """日志参数：只有日志级别启用、真正格式化时才序列化为JSON"""
+    __slots__ = ('obj',)
+
+    def __init__(self, obj):
+        self.obj = obj
+
+    def __str__(self):
+        return json.dumps(self.obj)
+
 # 将全局单一账单改为按聊天ID存储的多账单
 # 全局数据结构改为字典，键为聊天ID
 chat_accounting = {}
@@ -47,6 +140,404 @@ authorized_groups = set()
 processed_message_ids = set()  # 已处理过的消息ID缓存
 MAX_PROCESSED_MESSAGES = 100  # 最大缓存消息数量
 
+# 数据文件
+DATA_FILE = 'bot_data.json'
+
+# 结账时间（按TIMEZONE的小时），到点时归档账单并开始新账单；GROUP_CUTOFF_HOURS可按群组单独设置
+DAILY_CUTOFF_HOUR = getattr(config, 'DAILY_CUTOFF_HOUR', 0)
+GROUP_CUTOFF_HOURS = {int(chat_id): int(hour) for chat_id, hour in getattr(config, 'GROUP_CUTOFF_HOURS', {}).items()}
+last_reset_date = None  # 上次清理旧记录的日期，随账单数据一起保存
+ledger_lock = threading.Lock()  # 结账时交换账单
+rollover_lock = threading.Lock()  # 同一时间只进行一次结账检查
+# 已结账、等待写入历史存储的旧账单 (chat_id, 账单)，随账单数据一起保存
+pending_archives = deque()
+
+# 启动时批量处理停机期间积压的更新，为False时与之前一样丢弃
+CATCH_UP_PENDING_UPDATES = getattr(config, 'CATCH_UP_PENDING_UPDATES', True)
+ALLOWED_UPDATES = ['message', 'edited_message', 'channel_post', 'edited_channel_post', 'callback_query']
+# 最后处理的update_id和处理时间（秒），随账单数据一起保存，重启后从下一个更新继续
+last_update_id = None
+last_update_time = None
+# 超过一周没有新更新时Telegram会随机选择新的update_id，之前保存的位置不再可用
+UPDATE_ID_RESET_SECONDS = 7 * 86400
+# 批量处理积压更新期间的状态：{'dirty': 是否需要保存, 'summaries': chat_id -> 最后一条需要回复账单摘要的 (update, context)}
+catch_up_state = None
+
+# Bot API地址（以/bot结尾，令牌拼接在后面），为空时使用官方接口；性能测试时可指向benchmarks/fake_bot_api.py
+BOT_API_BASE_URL = getattr(config, 'BOT_API_BASE_URL', None) or None
+
+# 历史账单按 聊天/日期 单独存储在HISTORY_DIR下，首次访问时才加载
+HISTORY_DIR = getattr(config, 'HISTORY_DIR', 'history')
+HISTORY_CACHE_SIZE = getattr(config, 'HISTORY_CACHE_SIZE', 64)  # 内存中最多缓存的历史账单(聊天+日期)数量
+history_cache = OrderedDict()  # (chat_id, date_str) -> 历史账单数据，按LRU淘汰
+history_lock = threading.Lock()
+
+# 分级保留：原始记录保留RAW_HISTORY_DAYS天，之后压缩为每日每群汇总，汇总保留ROLLUP_RETENTION_DAYS天
+RAW_HISTORY_DAYS = getattr(config, 'RAW_HISTORY_DAYS', 7)
+ROLLUP_RETENTION_DAYS = getattr(config, 'ROLLUP_RETENTION_DAYS', 400)
+ROLLUP_DIR = getattr(config, 'ROLLUP_DIR', 'rollups')  # 每个日期一个文件，包含当天所有群组的汇总和跨群统计
+rollup_lock = threading.Lock()
+
+# 当日跨群统计，记账时增量更新，"所有群组当日统计"直接读取
+live_daily_stats = {'date': None, 'chats': {}, 'summary': None}
+live_stats_lock = threading.Lock()
+
+# 账单摘要中显示的最新入款笔数
+LATEST_DEPOSITS_SHOWN = 6
+
+# 报表按行生成，每攒够这么多行拼接编码后写入一次（每行通常不到100字节，一批约几十KB）
+EXPORT_BATCH_LINES = 1024
+
+# 导出的报表在内存中生成后直接发送，超过EXPORT_SPOOL_MAX_SIZE字节时转存到临时文件
+EXPORT_SPOOL_MAX_SIZE = getattr(config, 'EXPORT_SPOOL_MAX_SIZE', 4 * 1024 * 1024)
+# 可选：发送后另存一份到EXPORT_ARCHIVE_DIR，超过保留天数或总大小上限的旧文件会被清理
+EXPORT_ARCHIVE = getattr(config, 'EXPORT_ARCHIVE', False)
+EXPORT_ARCHIVE_DIR = getattr(config, 'EXPORT_ARCHIVE_DIR', 'exports')
+EXPORT_ARCHIVE_MAX_DAYS = getattr(config, 'EXPORT_ARCHIVE_MAX_DAYS', 30)
+EXPORT_ARCHIVE_MAX_MB = getattr(config, 'EXPORT_ARCHIVE_MAX_MB', 200)
+
+# 已结束日期的导出内容不会再变化，按 (群组, 日期, 数据版本, 格式, 标题) 缓存，按LRU淘汰
+EXPORT_CACHE_SIZE = getattr(config, 'EXPORT_CACHE_SIZE', 32)
+export_cache = OrderedDict()  # 缓存键 -> (内容摘要, 内容)
+# 同样内容再次发送时直接使用Telegram返回的file_id，不重新上传
+export_file_ids = OrderedDict()  # 内容摘要 -> file_id
+export_cache_lock = threading.Lock()
+
+# 打包导出所有群组账单时的工作池：EXPORT_ZIP_EXECUTOR为 'thread' 或 'process'，工作数为0时使用CPU核数
+EXPORT_ZIP_EXECUTOR = getattr(config, 'EXPORT_ZIP_EXECUTOR', 'thread')
+EXPORT_ZIP_WORKERS = getattr(config, 'EXPORT_ZIP_WORKERS', 0)
+export_executor = None  # 第一次打包导出时创建，之后的导出共用
+export_executor_lock = threading.Lock()
+EXPORT_PROGRESS_INTERVAL = 1.0  # 打包进度消息的最短更新间隔（秒），避免触发Telegram限流
+
+# 对账用的机器可读导出格式：逐笔记录和群组统计的列定义（列名, 列存类型）
+RECORD_COLUMNS = [
+    ('type', 's'), ('time', 't'), ('chat_id', 'q'), ('user', 's'),
+    ('responder', 's'), ('amount', 'd'), ('usd_equivalent', 'd'),
+]
+GROUP_STATS_COLUMNS = [
+    ('date', 's'), ('chat_id', 'q'), ('chat_title', 's'),
+    ('deposit_count', 'q'), ('deposit_total', 'd'),
+    ('withdrawal_count', 'q'), ('withdrawal_total', 'd'), ('withdrawal_usdt', 'd'),
+    ('rate', 'd'), ('fixed_rate', 'd'),
+]
+DATA_FORMAT_NAMES = {'csv': 'CSV', 'col': '列存二进制'}
+
+# 运行指标：健康检查服务器的 /metrics 以Prometheus文本格式输出
+METRIC_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+METRIC_DEFINITIONS = {
+    'bot_updates_received_total': ('counter', '收到的更新数'),
+    'bot_updates_handled_total': ('counter', '处理完的更新数（包括处理出错的）'),
+    'bot_update_errors_total': ('counter', '处理出错的更新数'),
+    'bot_handler_duration_seconds': ('histogram', '处理函数耗时'),
+    'bot_save_duration_seconds': ('histogram', '保存账单数据耗时'),
+    'bot_save_bytes': ('gauge', '最近一次保存的账单数据文件大小'),
+    'bot_startup_seconds': ('gauge', '从导入模块到开始轮询的耗时'),
+    'bot_first_update_seconds': ('gauge', '从导入模块到收到第一个更新的耗时'),
+    'bot_rollover_duration_seconds': ('histogram', '结账耗时（phase=swap 交换账单，archive 写入历史存储）'),
+    'bot_rollover_chats': ('gauge', '最近一次结账的群组数'),
+    'bot_telegram_api_duration_seconds': ('histogram', 'Telegram Bot API调用耗时'),
+    'bot_telegram_api_errors_total': ('counter', 'Telegram Bot API调用出错次数'),
+    'bot_provider_duration_seconds': ('histogram', 'USDT余额查询接口耗时'),
+    'bot_provider_errors_total': ('counter', 'USDT余额查询接口出错次数'),
+    'bot_chat_records': ('gauge', '当前账单中的记录数'),
+    'bot_cache_entries': ('gauge', '内存缓存中的条目数'),
+    'process_resident_memory_bytes': ('gauge', '进程常驻内存'),
+    'process_max_resident_memory_bytes': ('gauge', '进程常驻内存峰值'),
+}
+metric_values = {}  # (指标名, 标签) -> 计数器/仪表的值；直方图为 [各桶计数, 总和, 次数]
+metrics_lock = threading.Lock()
+
+# 按更新的耗时分解：热点路径记录为span，整个更新超过SLOW_UPDATE_THRESHOLD秒时记录日志
+SLOW_UPDATE_THRESHOLD = getattr(config, 'SLOW_UPDATE_THRESHOLD', 1.0)
+trace_local = threading.local()  # 当前线程正在处理的更新的span列表
+span_stats = {}  # span名称 -> [次数, 总耗时, 最大耗时]，健康检查服务器的 /traces 输出
+slow_updates = deque(maxlen=20)  # 最近的慢更新及其耗时分解
+trace_lock = threading.Lock()
+
+# 按需性能分析：管理员命令 /profile 或信号 SIGUSR1(CPU)/SIGUSR2(内存) 触发，限时采集后把结果发给管理员
+PROFILE_DEFAULT_SECONDS = getattr(config, 'PROFILE_DEFAULT_SECONDS', 30)
+PROFILE_MAX_SECONDS = 300
+PROFILE_TOP_COUNT = 40  # 报告中列出的函数/分配位置数量
+profile_state = {'kind': None, 'chat_ids': None, 'profiler': None, 'snapshot': None, 'started': None}
+profile_lock = threading.Lock()
+bot_updater = None  # main()中创建的Updater，信号处理函数通过它把分析请求交给消息处理线程
+
+def metric_key(name, labels):
+    """指标的存储键：指标名加排序后的标签"""
+    return (name, tuple(sorted(labels.items())) if labels else ())
+
+def inc_metric(name, labels=None, value=1):
+    """计数器加value"""
+    key = metric_key(name, labels)
+    with metrics_lock:
+        metric_values[key] = metric_values.get(key, 0) + value
+
+def set_metric(name, value, labels=None):
+    """设置仪表的值"""
+    with metrics_lock:
+        metric_values[metric_key(name, labels)] = value
+
+def observe_metric(name, value, labels=None):
+    """直方图记录一次观测值"""
+    key = metric_key(name, labels)
+    with metrics_lock:
+        histogram = metric_values.get(key)
+        if histogram is None:
+            histogram = metric_values[key] = [[0] * len(METRIC_BUCKETS), 0.0, 0]
+        for i, bound in enumerate(METRIC_BUCKETS):
+            if value <= bound:
+                histogram[0][i] += 1
+                break
+        histogram[1] += value
+        histogram[2] += 1
+
+def timed_route(func):
+    """装饰器：按函数名记录处理函数的耗时，同时记为span"""
+    name = func.__name__
+    labels = {'route': name}
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            with span(name):
+                return func(*args, **kwargs)
+        finally:
+            observe_metric('bot_handler_duration_seconds', time.perf_counter() - start, labels)
+    return wrapper
+
+@contextlib.contextmanager
+def span(name):
+    """记录一段代码的耗时：计入span_stats，处理更新时另外计入该更新的耗时分解"""
+    trace = getattr(trace_local, 'trace', None)
+    start = time.perf_counter()
+    if trace is not None:
+        trace['depth'] += 1
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        if trace is not None:
+            trace['depth'] -= 1
+            trace['spans'].append((start - trace['start'], trace['depth'], name, elapsed))
+        with trace_lock:
+            stats = span_stats.get(name)
+            if stats is None:
+                stats = span_stats[name] = [0, 0.0, 0.0]
+            stats[0] += 1
+            stats[1] += elapsed
+            stats[2] = max(stats[2], elapsed)
+
+def traced(func):
+    """装饰器：把整个函数记为一个span"""
+    name = func.__name__
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with span(name):
+            return func(*args, **kwargs)
+    return wrapper
+
+def start_update_trace(update_type):
+    """开始记录当前线程正在处理的更新"""
+    trace_local.trace = {'type': update_type, 'start': time.perf_counter(), 'depth': 0, 'spans': []}
+
+def finish_update_trace():
+    """结束当前更新的记录，超过SLOW_UPDATE_THRESHOLD时记录耗时分解"""
+    trace = getattr(trace_local, 'trace', None)
+    if trace is None:
+        return
+    trace_local.trace = None
+    total = time.perf_counter() - trace['start']
+    
+    with trace_lock:
+        stats = span_stats.get(f"update.{trace['type']}")
+        if stats is None:
+            stats = span_stats[f"update.{trace['type']}"] = [0, 0.0, 0.0]
+        stats[0] += 1
+        stats[1] += total
+        stats[2] = max(stats[2], total)
+    
+    if total < SLOW_UPDATE_THRESHOLD:
+        return
+    
+    # 按开始时间排列，缩进表示嵌套
+    breakdown = "\n".join(f"  {'  ' * depth}{name} {elapsed * 1000:.1f}ms (+{offset * 1000:.1f}ms)"
+                          for offset, depth, name, elapsed in sorted(trace['spans']))
+    logger.warning(f"慢更新 {trace['type']} 耗时 {total * 1000:.1f}ms:\n{breakdown}")
+    with trace_lock:
+        slow_updates.append((get_current_timestamp(), trace['type'], total, breakdown))
+
+def render_trace_report():
+    """span耗时汇总和最近的慢更新，纯文本"""
+    with trace_lock:
+        stats = sorted(span_stats.items(), key=lambda item: item[1][1], reverse=True)
+        recent = list(slow_updates)
+    
+    lines = [f"{'span':<40} {'次数':>8} {'总耗时(ms)':>12} {'平均(ms)':>10} {'最大(ms)':>10}"]
+    for name, (count, total, longest) in stats:
+        lines.append(f"{name:<40} {count:>8} {total * 1000:>12.1f} {total / count * 1000:>10.2f} {longest * 1000:>10.1f}")
+    
+    lines.append("")
+    lines.append(f"最近的慢更新（超过 {SLOW_UPDATE_THRESHOLD}s）:")
+    for timestamp, update_type, total, breakdown in reversed(recent):
+        lines.append(f"{timestamp} {update_type} {total * 1000:.1f}ms")
+        lines.append(breakdown)
+    return "\n".join(lines) + "\n"
+
+def get_update_type(update):
+    """更新的类型，用作指标标签"""
+    for update_type in ('message', 'edited_message', 'channel_post', 'edited_channel_post', 'callback_query'):
+        if getattr(update, update_type, None) is not None:
+            return update_type
+    return 'other'
+
+# 是否已经收到启动后的第一个更新
+first_update_received = False
+
+def get_update_time(update):
+    """更新发生的时间：消息、频道消息取发送时间，编辑过的消息取编辑时间，按钮回调取按钮所在消息的时间；没有消息时返回None"""
+    message = update.effective_message
+    if message is None:
+        return None
+    return message.edit_date or message.date
+
+def count_received_update(update, context):
+    """最先执行的处理器：统计收到的更新，记录处理位置，开始记录耗时分解
+    
+    处理位置的时间取当前时钟，批量处理积压的更新时即为更新发生的时间
+    """
+    global first_update_received, last_update_id, last_update_time
+    last_update_id = update.update_id
+    last_update_time = int(get_now().timestamp())
+    if not first_update_received:
+        first_update_received = True
+        seconds = time.perf_counter() - IMPORT_START
+        set_metric('bot_first_update_seconds', seconds)
+        logger.info("启动后 %.3fs 收到第一个更新", seconds)
+    update_type = get_update_type(update)
+    inc_metric('bot_updates_received_total', {'type': update_type})
+    start_update_trace(update_type)
+
+def count_handled_update(update, context):
+    """最后执行的处理器：统计处理完的更新，结束耗时分解"""
+    inc_metric('bot_updates_handled_total', {'type': get_update_type(update)})
+    finish_update_trace()
+
+def handle_update_error(update, context):
+    """处理器抛出异常时记录日志和指标"""
+    inc_metric('bot_update_errors_total', {'type': get_update_type(update)})
+    logger.error(f"处理更新时出错: {context.error}", exc_info=context.error)
+
+class InstrumentedBot(Bot):
+    """记录每次Bot API调用的耗时和错误"""
+    def _post(self, endpoint, data=None, timeout=None, api_kwargs=None):
+        start = time.perf_counter()
+        try:
+            with span(f"api.{endpoint}"):
+                return super()._post(endpoint, data, timeout, api_kwargs)
+        except Exception as e:
+            inc_metric('bot_telegram_api_errors_total', {'method': endpoint, 'error': type(e).__name__})
+            raise
+        finally:
+            observe_metric('bot_telegram_api_duration_seconds', time.perf_counter() - start, {'method': endpoint})
+
+def provider_get(provider, url, **kwargs):
+    """调用USDT余额查询接口，记录耗时和错误"""
+    import requests
+    
+    start = time.perf_counter()
+    try:
+        response = requests.get(url, **kwargs)
+    except Exception as e:
+        inc_metric('bot_provider_errors_total', {'provider': provider, 'error': type(e).__name__})
+        raise
+    finally:
+        observe_metric('bot_provider_duration_seconds', time.perf_counter() - start, {'provider': provider})
+    if response.status_code != 200:
+        inc_metric('bot_provider_errors_total', {'provider': provider, 'error': f"http_{response.status_code}"})
+    return response
+
+def get_process_memory():
+    """返回 (当前常驻内存, 常驻内存峰值)，单位字节，不支持的平台为None"""
+    current = None
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    current = int(line.split()[1]) * 1024
+                    break
+    except OSError:
+        pass
+    
+    peak = None
+    try:
+        import resource
+        # Linux上ru_maxrss的单位是KB，macOS上是字节
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        peak = peak if sys.platform == 'darwin' else peak * 1024
+    except ImportError:
+        pass
+    return current, peak
+
+def collect_runtime_metrics():
+    """抓取时才计算的仪表：各群组记录数、缓存条目数和进程内存，返回 [(指标名, 标签, 值)]"""
+    samples = []
+    for chat_id, chat_data in list(chat_accounting.items()):
+        samples.append(('bot_chat_records', {'chat_id': str(chat_id), 'kind': 'deposit'}, len(chat_data.get('deposits', []))))
+        samples.append(('bot_chat_records', {'chat_id': str(chat_id), 'kind': 'withdrawal'}, len(chat_data.get('withdrawals', []))))
+    
+    samples.append(('bot_cache_entries', {'cache': 'history'}, len(history_cache)))
+    samples.append(('bot_cache_entries', {'cache': 'export'}, len(export_cache)))
+    samples.append(('bot_cache_entries', {'cache': 'calculator'}, len(calculator_cache)))
+    
+    current, peak = get_process_memory()
+    if current is not None:
+        samples.append(('process_resident_memory_bytes', {}, current))
+    if peak is not None:
+        samples.append(('process_max_resident_memory_bytes', {}, peak))
+    return samples
+
+def format_metric_labels(labels):
+    """标签转为 {name="value",...}，转义反斜杠、引号和换行"""
+    if not labels:
+        return ""
+    escaped = []
+    for name, value in labels:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        escaped.append(f'{name}="{value}"')
+    return "{" + ",".join(escaped) + "}"
+
+def render_metrics():
+    """按Prometheus文本格式输出所有指标"""
+    with metrics_lock:
+        samples = {key: (copy.deepcopy(value) if isinstance(value, list) else value) for key, value in metric_values.items()}
+    for name, labels, value in collect_runtime_metrics():
+        samples[metric_key(name, labels)] = value
+    
+    by_name = {}
+    for (name, labels), value in samples.items():
+        by_name.setdefault(name, []).append((labels, value))
+    
+    lines = []
+    for name, (metric_type, help_text) in METRIC_DEFINITIONS.items():
+        if name not in by_name:
+            continue
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        for labels, value in sorted(by_name[name], key=lambda sample: sample[0]):
+            if metric_type != 'histogram':
+                lines.append(f"{name}{format_metric_labels(labels)} {value}")
+                continue
+            bucket_counts, total, count = value
+            cumulative = 0
+            for bound, bucket_count in zip(METRIC_BUCKETS, bucket_counts):
+                cumulative += bucket_count
+                lines.append(f"{name}_bucket{format_metric_labels(labels + (('le', bound),))} {cumulative}")
+            lines.append(f"{name}_bucket{format_metric_labels(labels + (('le', '+Inf'),))} {count}")
+            lines.append(f"{name}_sum{format_metric_labels(labels)} {total}")
+            lines.append(f"{name}_count{format_metric_labels(labels)} {count}")
+    return "\n".join(lines) + "\n"
+
 def get_chat_accounting(chat_id):
     """获取或创建聊天的账单记录"""
     global chat_accounting
@@ -60,9 +551,19 @@ def get_chat_accounting(chat_id):
             'rate': 0.0,  # 默认费率0%
             'fixed_rate': 0.0,  # 默认汇率0
             'users': {},  # 用户分类
+            'date': get_business_date(chat_id),  # 账单所属的结账日，用于判断是否需要结账
         }
     
-    return chat_accounting[chat_id]
+    chat_data = chat_accounting[chat_id]
+    
+    # 已过结账时间但结账任务还没处理到这个群组时在这里结账，新记录不会记入前一天的账单
+    ledger_date = chat_data.get('date')
+    if ledger_date is not None:
+        business_date = get_business_date(chat_id)
+        if ledger_date < business_date:
+            chat_data = rollover_chat_ledger(chat_id, business_date)
+    
+    return chat_data
 
 def reset_chat_accounting(chat_id):
     """重置指定聊天的账单数据"""
@@ -73,118 +574,1030 @@ def reset_chat_accounting(chat_id):
         'withdrawals': [],
         'rate': 0.0,
         'fixed_rate': 1.0,
+        'date': get_business_date(chat_id),
     }
     logger.info(f"聊天 {chat_id} 的账单数据已重置")
+    invalidate_live_daily_stats()
     save_data()
 
-def check_date_change(context: CallbackContext):
-    """检查日期变更，执行每日重置和清理旧记录"""
-    logger.info("检查日期变更...")
-    global chat_accounting
+def infer_ledger_date(chat_id, chat_data, default):
+    """旧版本保存的账单没有所属日期，取最早一条记录所在的结账日，没有记录时使用default"""
+    times = [record['time'] for record in chat_data.get('deposits', []) + chat_data.get('withdrawals', []) if record.get('time')]
+    if not times:
+        return default
+    earliest = timezone.localize(datetime.datetime.strptime(min(times), '%Y-%m-%d %H:%M:%S'))
+    return get_business_date(chat_id, earliest)
+
+def rollover_chat_ledger(chat_id, business_date):
+    """把群组的账单换成business_date的新账单（保留费率和汇率），旧账单原样放入待归档队列，返回当前账单
     
-    # 获取当前时间和日期
-    current_time = get_current_time()
-    current_date = get_current_date()
+    只交换引用，耗时与记录数无关；旧账单由结账任务写入历史存储
+    """
+    with ledger_lock:
+        chat_data = chat_accounting[chat_id]
+        # 其他线程可能已经完成了这个群组的结账
+        if chat_data['date'] >= business_date:
+            return chat_data
+        
+        new_data = {
+            'deposits': [],
+            'withdrawals': [],
+            'users': {},
+            'rate': chat_data.get('rate', 0.0),
+            'fixed_rate': chat_data.get('fixed_rate', 0.0),
+            'date': business_date,
+        }
+        chat_accounting[chat_id] = new_data
+        pending_archives.append((chat_id, chat_data))
     
-    # 检查上次重置的日期
-    last_reset_date = context.bot_data.get('last_reset_date', None)
+    invalidate_live_daily_stats()
+    logger.info(f"已结账群组 {chat_id}: {chat_data['date']} -> {business_date}，保留费率={new_data['rate']}%和汇率={new_data['fixed_rate']}")
+    return new_data
+
+def append_chat_record(chat_id, kind, record):
+    """把记录追加到群组当前账单的kind（'deposits'或'withdrawals'）列表，返回该账单
+    
+    在ledger_lock中重新取当前账单再追加：取得账单之后结账任务可能已经把它换下并开始归档，
+    记录不能追加到已移出的旧账单上
+    """
+    get_chat_accounting(chat_id)
+    with ledger_lock:
+        chat_data = chat_accounting[chat_id]
+        chat_data[kind].append(record)
+    return chat_data
+
+def archive_pending_ledgers():
+    """把待归档队列中的旧账单逐个写入历史存储，同一日期的汇总合并后一次写入汇总文件，返回归档的账单数
+    
+    写入失败的账单留在队列中，下次结账检查时重试
+    """
+    archived_rollups = {}  # 日期 -> {chat_id: 汇总}
+    archived_count = 0
+    for _ in range(len(pending_archives)):
+        chat_id, chat_data = pending_archives[0]
+        rollups = archive_chat_accounting_history(chat_id, chat_data)
+        if rollups is None:
+            pending_archives.rotate(-1)
+            continue
+        pending_archives.popleft()
+        archived_count += 1
+        for date_str, rollup in rollups.items():
+            if rollup['deposit_count'] or rollup['withdrawal_count']:
+                archived_rollups.setdefault(date_str, {})[chat_id] = rollup
+    
+    # 结账时一次性生成跨群统计，之后查询该日期不再扫描原始记录；结账时间较晚的群组结账后更新其中该群组的汇总
+    for date_str, rollups in archived_rollups.items():
+        try:
+            save_daily_rollups(date_str, rollups)
+            logger.info(f"已更新 {date_str} 的跨群统计: {len(rollups)} 个群组")
+        except Exception as e:
+            logger.error(f"生成 {date_str} 的跨群统计时出错: {e}", exc_info=True)
     
-    if last_reset_date != current_date:
-        logger.info(f"检测到日期变更: {last_reset_date} -> {current_date}")
-        
-        # 更新上次重置日期
-        context.bot_data['last_reset_date'] = current_date
-        
-        # 为每个群组归档当天数据并重置当前账单
-        for chat_id, chat_data in list(chat_accounting.items()):
-            try:
-                # 归档当天的数据
-                archive_chat_accounting_history(chat_id, last_reset_date)
-                
-                # 保存当前的费率和汇率设置
-                current_rate = chat_data.get('rate', 0.0)
-                current_fixed_rate = chat_data.get('fixed_rate', 0.0)
-                
-                # 重置当前群组的账单，但保留汇率和费率设置
-                chat_accounting[chat_id] = {
-                    'deposits': [],
-                    'withdrawals': [],
-                    'users': {},
-                    'rate': current_rate,
-                    'fixed_rate': current_fixed_rate
-                }
-                
-                logger.info(f"已重置群组 {chat_id} 的当日账单，保留费率={current_rate}%和汇率={current_fixed_rate}")
-            except Exception as e:
-                logger.error(f"重置群组 {chat_id} 账单时出错: {e}", exc_info=True)
-        
-        # 清理超过7天的记录
-        clean_old_records()
-    else:
-        logger.info(f"日期未变更，当前日期: {current_date}")
+    return archived_count
+
+def get_pending_ledgers(chat_id=None):
+    """待归档队列的快照 [(chat_id, 账单)]，chat_id不为空时只返回该群组的账单
     
-    logger.info(f"下次检查将在 {RESET_CHECK_INTERVAL} 秒后进行")
+    读取方应先取快照再读历史账单：快照之后才归档完成的账单会出现在历史账单的'ledgers'中，用is_ledger_archived跳过
+    """
+    return [(pending_chat_id, ledger) for pending_chat_id, ledger in list(pending_archives)
+            if chat_id is None or pending_chat_id == chat_id]
 
-def archive_chat_accounting_history(chat_id, date_str):
-    """将当天的账单数据归档到历史记录中"""
-    global chat_accounting
+def is_ledger_archived(chat_id, ledger, date_str):
+    """待归档账单在date_str的记录是否已经写入历史账单"""
+    day_data = get_chat_history(chat_id, date_str)
+    return day_data is not None and ledger.get('date') in day_data.get('ledgers', [])
+
+def get_pending_rollups(date_str, pending=None):
+    """待归档账单中时间在date_str、尚未写入历史账单的记录按群组汇总，返回 chat_id -> 汇总"""
+    rollups = {}
+    for chat_id, ledger in get_pending_ledgers() if pending is None else pending:
+        if is_ledger_archived(chat_id, ledger, date_str):
+            continue
+        rollup = build_daily_rollup(ledger, date_str)
+        if not (rollup['deposit_count'] or rollup['withdrawal_count']):
+            continue
+        if chat_id in rollups:
+            merge_daily_rollup(rollups[chat_id], rollup)
+        else:
+            rollups[chat_id] = rollup
+    return rollups
+
+def check_date_change(context: CallbackContext):
+    """结账检查：账单所属日期早于当前结账日的群组换成新账单，旧账单写入历史存储，日期变更后清理旧记录
     
-    if not date_str:
-        logger.warning(f"无法归档群组 {chat_id} 的账单，日期为空")
-        return
+    交换账单只需替换引用，处理消息的线程不会被归档阻塞；停机期间错过的结账会在启动后的第一次检查中按原日期补做
+    """
+    global last_reset_date
     
+    if not rollover_lock.acquire(blocking=False):
+        logger.info("另一个结账检查正在进行，跳过本次检查")
+        return
     try:
-        # 确保该群组的数据存在
-        if chat_id not in chat_accounting:
-            logger.info(f"群组 {chat_id} 没有账单数据，无需归档")
-            return
+        now = get_now()
+        current_date = now.strftime("%Y-%m-%d")
         
-        chat_data = chat_accounting[chat_id]
-        
-        # 初始化历史记录存储
-        if 'history' not in chat_data:
-            chat_data['history'] = {}
+        # 先交换所有到期的账单
+        swap_start = time.perf_counter()
+        swapped_count = 0
+        for chat_id, chat_data in list(chat_accounting.items()):
+            business_date = get_business_date(chat_id, now)
+            if chat_data.get('date') is None:
+                chat_data['date'] = infer_ledger_date(chat_id, chat_data, business_date)
+            if chat_data['date'] < business_date:
+                rollover_chat_ledger(chat_id, business_date)
+                swapped_count += 1
+        swap_seconds = time.perf_counter() - swap_start
+        
+        # 再把旧账单（包括处理消息时已经交换的）写入历史存储
+        archive_start = time.perf_counter()
+        archived_count = archive_pending_ledgers() if pending_archives else 0
+        archive_seconds = time.perf_counter() - archive_start
+        
+        if swapped_count or archived_count:
+            observe_metric('bot_rollover_duration_seconds', swap_seconds, {'phase': 'swap'})
+            observe_metric('bot_rollover_duration_seconds', archive_seconds, {'phase': 'archive'})
+            set_metric('bot_rollover_chats', archived_count)
+            logger.info("结账完成: 交换 %d 个账单耗时 %.1fms，归档 %d 个账单耗时 %.1fms，待归档 %d 个",
+                        swapped_count, swap_seconds * 1000, archived_count, archive_seconds * 1000, len(pending_archives))
+        
+        date_changed = last_reset_date != current_date
+        if date_changed:
+            logger.info(f"检测到日期变更: {last_reset_date} -> {current_date}")
+            last_reset_date = current_date
+        
+        if swapped_count or archived_count or date_changed:
+            save_data()
         
-        # 把当天的存取款记录复制到历史记录中
-        chat_data['history'][date_str] = {
-            'deposits': chat_data['deposits'].copy(),
-            'withdrawals': chat_data['withdrawals'].copy(),
-            'rate': chat_data.get('rate', 0.0),
-            'fixed_rate': chat_data.get('fixed_rate', 0.0)
-        }
+        # 清理过期的记录
+        if date_changed:
+            clean_old_records()
+    finally:
+        rollover_lock.release()
+
+def schedule_next_rollover(job_queue):
+    """在下一个结账时间点安排一次结账检查"""
+    when = get_next_rollover_time()
+    # 系统挂起等原因错过时间点时仍然执行，否则后续的结账不会再被安排
+    job_queue.run_once(run_scheduled_rollover, when, name='daily_rollover', job_kwargs={'misfire_grace_time': None})
+    logger.info(f"下次结账时间: {when.strftime('%Y-%m-%d %H:%M:%S %Z')}")
+
+def run_scheduled_rollover(context: CallbackContext):
+    """结账时间到达时执行结账检查，并安排下一次"""
+    try:
+        check_date_change(context)
+    finally:
+        schedule_next_rollover(context.job_queue)
+
+def archive_chat_accounting_history(chat_id, chat_data):
+    """将已结账的账单写入历史存储，返回 日期 -> 该日的汇总，出错时返回None
+    
+    记录按自身时间所在的日期写入历史账单，与报表按记录时间筛选日期一致；结账时间不在午夜的群组，
+    一份账单的记录会分到两个日期。历史账单中记下已合并的账单（按账单所属日期），重试或重启后重复归档时跳过
+    """
+    ledger_date = chat_data['date']
+    try:
+        records = {'deposits': chat_data['deposits'], 'withdrawals': chat_data['withdrawals']}
+        dates = {record['time'][:10] for kind in records for record in records[kind]} or {ledger_date}
+        
+        rollups = {}
+        for date_str in sorted(dates):
+            existing = get_chat_history(chat_id, date_str)
+            merged = existing.get('ledgers', []) if existing else []
+            if ledger_date in merged:
+                rollups[date_str] = build_daily_rollup(existing)
+                continue
+            
+            if len(dates) == 1:
+                # 账单已经从chat_accounting中移出，记录都在同一天时直接写入原列表，不需要复制
+                day_records = records
+            else:
+                day_records = {kind: [record for record in records[kind] if record['time'][:10] == date_str] for kind in records}
+            if existing:
+                day_records = {kind: existing.get(kind, []) + day_records[kind] for kind in records}
+            
+            day_data = {
+                'deposits': day_records['deposits'],
+                'withdrawals': day_records['withdrawals'],
+                'rate': chat_data.get('rate', 0.0),
+                'fixed_rate': chat_data.get('fixed_rate', 0.0),
+                'ledgers': merged + [ledger_date],
+            }
+            save_chat_history(chat_id, date_str, day_data)
+            rollups[date_str] = build_daily_rollup(day_data)
+            
+            logger.info(f"已归档群组 {chat_id} 在 {date_str} 的账单数据: {len(day_data['deposits'])} 笔入款, {len(day_data['withdrawals'])} 笔出款")
         
-        logger.info(f"已归档群组 {chat_id} 在 {date_str} 的账单数据: {len(chat_data['deposits'])} 笔入款, {len(chat_data['withdrawals'])} 笔出款")
+        return rollups
         
     except Exception as e:
         logger.error(f"归档群组 {chat_id} 的账单历史时出错: {e}", exc_info=True)
+        return None
 
 def clean_old_records():
-    """清理超过7天的历史记录"""
-    global chat_accounting
-    
+    """分级清理历史记录：超过原始保留期的记录压缩为每日汇总，超过汇总保留期的汇总删除"""
     try:
-        # 获取7天前的日期
-        seven_days_ago = (datetime.datetime.now(timezone) - datetime.timedelta(days=7)).strftime('%Y-%m-%d')
+        raw_cutoff = get_date_days_ago(RAW_HISTORY_DAYS)
+        rollup_cutoff = get_date_days_ago(ROLLUP_RETENTION_DAYS)
         
-        logger.info(f"开始清理7天前 ({seven_days_ago}) 的历史记录")
+        logger.info(f"开始压缩 {raw_cutoff} 之前的原始记录，清理 {rollup_cutoff} 之前的汇总")
         
-        # 遍历所有群组
-        for chat_id, chat_data in chat_accounting.items():
-            if 'history' in chat_data:
-                # 统计要删除的记录数量
-                records_to_delete = [date for date in chat_data['history'] if date < seven_days_ago]
-                
-                # 删除超过7天的记录
-                for date in records_to_delete:
-                    if date in chat_data['history']:
-                        del chat_data['history'][date]
-                        logger.info(f"已删除群组 {chat_id} 在 {date} 的历史记录")
+        # 遍历历史存储中的所有群组（包括当前不在内存中的群组）
+        for chat_id in get_history_chat_ids():
+            # 超出原始保留期的日期
+            records_to_compact = [date for date in get_chat_history_dates(chat_id) if date < raw_cutoff]
+            
+            for date in records_to_compact:
+                # 先写入汇总再删除原始记录，已经有汇总的日期不重复压缩
+                if date >= rollup_cutoff and chat_id not in get_daily_rollups(date):
+                    day_data = get_chat_history(chat_id, date)
+                    if day_data is not None:
+                        save_daily_rollup(chat_id, date, build_daily_rollup(day_data))
+                delete_chat_history(chat_id, date)
+                logger.info(f"已将群组 {chat_id} 在 {date} 的原始记录压缩为汇总")
+        
+        # 删除超出汇总保留期的汇总文件
+        for date in get_rollup_dates():
+            if date < rollup_cutoff:
+                os.remove(get_rollup_path(date))
+                logger.info(f"已删除 {date} 的每日汇总")
+        
+        # 清理导出归档（包括旧版本留在导出目录中的文件）
+        clean_export_archive()
         
         logger.info("历史记录清理完成")
         
     except Exception as e:
         logger.error(f"清理历史记录时出错: {e}", exc_info=True)
 
+def new_daily_rollup(rate=0.0, fixed_rate=1.0):
+    """创建空的每日汇总"""
+    return {
+        'rate': rate,
+        'fixed_rate': fixed_rate,
+        'deposit_total': 0,
+        'deposit_count': 0,
+        'withdrawal_total': 0,  # 本地货币
+        'withdrawal_usdt': 0,
+        'withdrawal_count': 0,
+        'operators': {},  # 操作人 -> 入款金额
+        'responders': {},  # 回复人 -> 入款金额
+    }
+
+def add_deposit_to_rollup(rollup, deposit):
+    """把一笔入款计入每日汇总"""
+    amount = deposit['amount']
+    rollup['deposit_total'] += amount
+    rollup['deposit_count'] += 1
+    
+    operator = deposit.get('user', '未知操作人')
+    rollup['operators'][operator] = rollup['operators'].get(operator, 0) + amount
+    
+    # 没有回复人的记录归入"None"，与统计报表的显示一致
+    responder = str(deposit.get('responder', 'None'))
+    rollup['responders'][responder] = rollup['responders'].get(responder, 0) + amount
+
+def add_withdrawal_to_rollup(rollup, withdrawal):
+    """把一笔出款计入每日汇总"""
+    rollup['withdrawal_total'] += withdrawal['amount']
+    rollup['withdrawal_usdt'] += withdrawal.get('usd_equivalent', 0)
+    rollup['withdrawal_count'] += 1
+
+def build_daily_rollup(day_data, date_str=None):
+    """将一天的原始账单压缩为汇总：总额、笔数、按操作人和回复人的入款金额
+    
+    date_str不为空时只统计时间在该日期的记录（用于当前账单）
+    """
+    rollup = new_daily_rollup(day_data.get('rate', 0.0), day_data.get('fixed_rate', 1.0))
+    
+    for deposit in day_data.get('deposits', []):
+        if date_str and deposit['time'].split(' ')[0] != date_str:
+            continue
+        add_deposit_to_rollup(rollup, deposit)
+    
+    for withdrawal in day_data.get('withdrawals', []):
+        if date_str and withdrawal['time'].split(' ')[0] != date_str:
+            continue
+        add_withdrawal_to_rollup(rollup, withdrawal)
+    
+    return rollup
+
+def merge_daily_rollup(rollup, other):
+    """把另一份同一日期的汇总合并到rollup中，汇率和费率保留rollup的设置"""
+    for key in ('deposit_total', 'deposit_count', 'withdrawal_total', 'withdrawal_usdt', 'withdrawal_count'):
+        rollup[key] += other[key]
+    for key in ('operators', 'responders'):
+        for name, amount in other[key].items():
+            rollup[key][name] = rollup[key].get(name, 0) + amount
+    return rollup
+
+def new_aggregate():
+    """创建空的账单聚合结果，包含每日汇总的全部字段以及报表需要的明细统计"""
+    aggregate = new_daily_rollup()
+    del aggregate['rate'], aggregate['fixed_rate']
+    aggregate.update({
+        'responder_deposits': {},  # 有回复人的入款：回复人 -> {'total': 金额, 'users': {操作人: 金额}}
+        'user_withdrawals': {},  # 操作人 -> 出款金额（本地货币）
+        'user_withdrawals_usdt': {},  # 操作人 -> 出款金额（USDT）
+        'deposits': [],  # 符合条件的入款记录，保持原有顺序
+        'withdrawals': [],  # 符合条件的出款记录，保持原有顺序
+    })
+    return aggregate
+
+def add_deposit_to_aggregate(aggregate, deposit):
+    """把一笔入款计入聚合结果"""
+    add_deposit_to_rollup(aggregate, deposit)
+    aggregate['deposits'].append(deposit)
+
+    # 只有带回复人的入款参与分类统计
+    responder = deposit.get('responder')
+    if responder:
+        amount = deposit['amount']
+        username = deposit['user']
+        responder_data = aggregate['responder_deposits'].get(responder)
+        if responder_data is None:
+            responder_data = aggregate['responder_deposits'][responder] = {'total': 0, 'users': {}}
+        responder_data['total'] += amount
+        responder_data['users'][username] = responder_data['users'].get(username, 0) + amount
+
+def add_withdrawal_to_aggregate(aggregate, withdrawal):
+    """把一笔出款计入聚合结果"""
+    add_withdrawal_to_rollup(aggregate, withdrawal)
+    aggregate['withdrawals'].append(withdrawal)
+
+    username = withdrawal['user']
+    user_withdrawals = aggregate['user_withdrawals']
+    user_withdrawals[username] = user_withdrawals.get(username, 0) + withdrawal['amount']
+    user_withdrawals_usdt = aggregate['user_withdrawals_usdt']
+    user_withdrawals_usdt[username] = user_withdrawals_usdt.get(username, 0) + withdrawal.get('usd_equivalent', 0)
+
+@traced
+def aggregate_records(ledgers, dates=None, by_date=False):
+    """账单聚合引擎：一次遍历多份账单的全部记录，计算各类报表需要的统计数据
+
+    ledgers为账单列表（当前账单或历史账单），dates为需要统计的日期集合（None表示不按日期筛选），
+    by_date为True时另外按记录日期分组聚合，结果放在'by_date'中
+    """
+    aggregate = new_aggregate()
+    date_groups = {}
+    need_date = dates is not None or by_date
+
+    for ledger in ledgers:
+        for deposit in ledger.get('deposits', []):
+            if need_date:
+                # 时间格式为 YYYY-MM-DD HH:MM:SS，前10位即日期
+                record_date = deposit['time'][:10]
+                if dates is not None and record_date not in dates:
+                    continue
+                if by_date:
+                    day_aggregate = date_groups.get(record_date)
+                    if day_aggregate is None:
+                        day_aggregate = date_groups[record_date] = new_aggregate()
+                    add_deposit_to_aggregate(day_aggregate, deposit)
+            add_deposit_to_aggregate(aggregate, deposit)
+
+        for withdrawal in ledger.get('withdrawals', []):
+            if need_date:
+                record_date = withdrawal['time'][:10]
+                if dates is not None and record_date not in dates:
+                    continue
+                if by_date:
+                    day_aggregate = date_groups.get(record_date)
+                    if day_aggregate is None:
+                        day_aggregate = date_groups[record_date] = new_aggregate()
+                    add_withdrawal_to_aggregate(day_aggregate, withdrawal)
+            add_withdrawal_to_aggregate(aggregate, withdrawal)
+
+    # 最新的几笔入款，等价于按时间倒序排序后取前几笔，但不需要对全部记录排序
+    aggregate['latest_deposits'] = heapq.nlargest(LATEST_DEPOSITS_SHOWN, aggregate['deposits'], key=lambda x: x.get('time', ''))
+    if by_date:
+        aggregate['by_date'] = date_groups
+    return aggregate
+
+def get_chat_ledgers(chat_id, dates):
+    """获取群组在指定日期范围内的账单来源：当前账单，这些日期已归档的历史账单（如有），以及已结账、尚未归档的旧账单
+    
+    旧账单中已经写入历史账单的日期的记录不再重复计入
+    """
+    ledgers = [get_chat_accounting(chat_id)]
+    pending = get_pending_ledgers(chat_id)
+    for date_str in dates:
+        day_data = get_chat_history(chat_id, date_str)
+        if day_data is not None:
+            ledgers.append(day_data)
+    for _, ledger in pending:
+        archived_dates = {date_str for date_str in dates if is_ledger_archived(chat_id, ledger, date_str)}
+        if archived_dates:
+            ledger = dict(ledger)
+            for kind in ('deposits', 'withdrawals'):
+                ledger[kind] = [record for record in ledger.get(kind, []) if record['time'][:10] not in archived_dates]
+        ledgers.append(ledger)
+    return ledgers
+
+def iter_bill_summary_lines(title, aggregate, rate, fee_rate, user_withdrawals_usdt=None):
+    """按账单模板逐行生成摘要：最新入款、回复人分类、下发和下发情况
+    
+    user_withdrawals_usdt为下发部分每个操作人的USDT金额，为空时使用aggregate中的统计
+    """
+    if user_withdrawals_usdt is None:
+        user_withdrawals_usdt = aggregate['user_withdrawals_usdt']
+    deposit_total = aggregate['deposit_total']
+    deposit_count = aggregate['deposit_count']
+    withdrawal_total_local = aggregate['withdrawal_total']
+    withdrawal_count = aggregate['withdrawal_count']
+    responder_deposits = aggregate['responder_deposits']
+    responder_count = len(responder_deposits)
+
+    # 计算应下发金额（USDT）
+    to_be_withdrawn = deposit_total / rate if rate != 0 else 0
+    already_withdrawn = aggregate['withdrawal_usdt']
+    not_yet_withdrawn = to_be_withdrawn - already_withdrawn
+
+    yield f"====== {title} ======\n\n"
+
+    yield f"入款（{deposit_count}笔）：\n"
+    if deposit_count > 0:
+        # 显示最新的几笔入款记录及其回复人
+        for deposit in aggregate['latest_deposits']:
+            amount = deposit['amount']
+            # 计算美元等值：金额除以汇率
+            usd_equivalent = amount / rate if rate != 0 else 0
+            responder = deposit.get('responder', '无回复人')
+
+            # 提取时间戳中的小时和分钟
+            time_str = deposit.get('time', '')
+            time_parts = time_str.split(' ')
+            if len(time_parts) > 1:
+                time_part = time_parts[1]  # 获取时间部分 (HH:MM:SS)
+                hour_min = ':'.join(time_part.split(':')[:2])  # 只保留小时和分钟
+            else:
+                hour_min = "00:00"  # 默认时间
+
+            # 使用新的格式: HH:MM 金额/汇率 =美元等值 回复人
+            responder_display = "" if responder is None or responder == "None" else responder
+            yield f"  {hour_min} {amount:.0f}/{rate} ={usd_equivalent:.2f} {responder_display}\n"
+    else:
+        yield "  暂无入金\n"
+
+    yield f"\n分类（{responder_count}人）：\n"
+    if responder_count > 0:
+        for responder, data in responder_deposits.items():
+            # 只显示回复者和总金额
+            yield f"  {responder} {data['total']:.2f}\n"
+    else:
+        yield "  暂无分类\n"
+
+    yield f"\n下发（{withdrawal_count}笔）：\n"
+    if withdrawal_count > 0:
+        # 使用USDT金额而不是本地货币
+        for username, amount in user_withdrawals_usdt.items():
+            yield f"  {username}: {amount:.2f}\n"
+    else:
+        yield "  暂无下发\n"
+
+    yield f"\n费率：{fee_rate}%\n"
+    yield f"固定汇率：{rate}\n"
+    yield f"总入款：{deposit_total:.2f}\n"
+    yield f"应下发：{deposit_total:.2f}｜{to_be_withdrawn:.2f}U\n"
+    yield f"已下发：{withdrawal_total_local:.2f}｜{already_withdrawn:.2f}U\n"
+    yield f"未下发：{deposit_total-withdrawal_total_local:.2f}｜{not_yet_withdrawn:.2f}U\n"
+
+def format_bill_summary(title, aggregate, rate, fee_rate):
+    """按账单模板生成摘要文本"""
+    return "".join(iter_bill_summary_lines(title, aggregate, rate, fee_rate))
+
+@traced
+def render_report(lines):
+    """把报表生成器产生的文本每EXPORT_BATCH_LINES行编码写入一次有界内存缓冲，超过EXPORT_SPOOL_MAX_SIZE时自动转存到临时文件
+    
+    返回已回到开头的缓冲，用完后需要关闭
+    """
+    buffer = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_MAX_SIZE)
+    lines = iter(lines)
+    # 按固定行数分批，不需要逐行累计长度；写入部分比一次拼接整份报表还快，内存只占一批
+    while True:
+        batch = list(itertools.islice(lines, EXPORT_BATCH_LINES))
+        if not batch:
+            break
+        buffer.write("".join(batch).encode('utf-8'))
+    buffer.seek(0)
+    return buffer
+
+def send_report_document(bot, chat_id, lines, filename, caption, cache_key=None):
+    """生成报表并直接从内存缓冲发送，不经过导出目录；开启归档时另存一份
+    
+    cache_key不为空时，命中缓存则直接发送缓存的内容，lines不会被遍历（报表生成器中的统计也不会执行）；
+    同样的内容之前发送过时按file_id重发，不再上传文件
+    """
+    digest = None
+    cached = get_cached_export(cache_key) if cache_key else None
+    if cached is not None:
+        logger.info(f"导出 {filename} 命中缓存")
+        digest, content = cached
+        file_id = get_export_file_id(digest)
+        if file_id:
+            try:
+                message = bot.send_document(chat_id=chat_id, document=file_id, caption=caption)
+                if EXPORT_ARCHIVE:
+                    with io.BytesIO(content) as buffer:
+                        archive_report(buffer, filename)
+                return message
+            except BadRequest as e:
+                # file_id失效时忘记它，重新上传
+                logger.warning(f"按file_id发送 {filename} 失败，重新上传: {e}")
+                forget_export_file_id(digest)
+        buffer = io.BytesIO(content)
+    else:
+        buffer = render_report(lines)
+        if cache_key:
+            # 只缓存没有转存到磁盘的报表
+            content = buffer.read(EXPORT_SPOOL_MAX_SIZE + 1)
+            if len(content) <= EXPORT_SPOOL_MAX_SIZE:
+                digest = put_cached_export(cache_key, content)
+            buffer.seek(0)
+    
+    message = send_buffer_document(bot, chat_id, buffer, filename, caption)
+    
+    document = getattr(message, 'document', None)
+    if digest and document is not None:
+        remember_export_file_id(digest, document.file_id)
+    return message
+
+def send_buffer_document(bot, chat_id, buffer, filename, caption):
+    """发送已生成的文件缓冲，发送后关闭缓冲；开启归档时另存一份"""
+    with buffer:
+        message = bot.send_document(chat_id=chat_id, document=buffer, filename=filename, caption=caption)
+        if EXPORT_ARCHIVE:
+            archive_report(buffer, filename)
+    return message
+
+def iter_csv_lines(columns, rows):
+    """逐行生成CSV文本：表头加每行记录"""
+    line = io.StringIO()
+    writer = csv.writer(line, lineterminator='\n')
+    for row in itertools.chain([[name for name, _ in columns]], rows):
+        writer.writerow(row)
+        yield line.getvalue()
+        line.seek(0)
+        line.truncate()
+
+def send_data_document(bot, chat_id, data_format, columns, rows, filename, caption, metadata=None):
+    """按数据格式直接从记录生成CSV或列存文件并发送，不经过文本报表；filename不带扩展名"""
+    if data_format == 'csv':
+        return send_report_document(bot, chat_id, iter_csv_lines(columns, rows), f"{filename}.csv", caption)
+    
+    import columnar
+    
+    buffer = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_MAX_SIZE)
+    try:
+        columnar.write_columnar(buffer, columns, rows, metadata)
+        buffer.seek(0)
+    except Exception:
+        buffer.close()
+        raise
+    return send_buffer_document(bot, chat_id, buffer, f"{filename}.ldgc", caption)
+
+def iter_record_rows(chat_id, ledgers, dates):
+    """群组在指定日期的逐笔记录，按时间排序，列顺序与RECORD_COLUMNS一致
+    
+    每个账单的入款和下发都是按时间追加的，逐个账单生成后用heapq.merge归并，不需要先收集全部记录再排序
+    """
+    def iter_deposit_rows(deposits):
+        for deposit in deposits:
+            if deposit['time'][:10] in dates:
+                responder = deposit.get('responder')
+                yield ('deposit', deposit['time'], chat_id, deposit['user'],
+                       None if responder in (None, 'None') else responder,
+                       deposit['amount'], deposit.get('usd_equivalent', 0))
+    
+    def iter_withdrawal_rows(withdrawals):
+        for withdrawal in withdrawals:
+            if withdrawal['time'][:10] in dates:
+                yield ('withdrawal', withdrawal['time'], chat_id, withdrawal['user'], None,
+                       withdrawal['amount'], withdrawal.get('usd_equivalent', 0))
+    
+    sources = []
+    for ledger in ledgers:
+        sources.append(iter_deposit_rows(ledger.get('deposits', [])))
+        sources.append(iter_withdrawal_rows(ledger.get('withdrawals', [])))
+    return heapq.merge(*sources, key=operator.itemgetter(1))
+
+def iter_group_stats_rows(date_str, groups_with_records):
+    """各群组的每日汇总，列顺序与GROUP_STATS_COLUMNS一致"""
+    for chat_id, chat_title, rollup in groups_with_records:
+        yield (date_str, chat_id, chat_title,
+               rollup['deposit_count'], rollup['deposit_total'],
+               rollup['withdrawal_count'], rollup['withdrawal_total'], rollup['withdrawal_usdt'],
+               rollup.get('rate', 0.0), rollup.get('fixed_rate', 1.0))
+
+def get_export_cache_key(chat_id, date_str, report_format, chat_title, live_records=True):
+    """已结束日期导出的缓存键
+    
+    只有日期已结束、记录已全部归档到历史账单时才缓存，数据版本取历史账单文件的版本；否则返回None。
+    是否还有未归档的记录按账单日期判断，不遍历记录。live_records为False表示报表只读取历史账单，不需要检查当前账单。
+    缓存的内容（包括其中的导出时间）是第一次生成时的内容
+    """
+    if date_str >= get_current_date():
+        return None
+    
+    # 账单只包含所属日期及之后的记录：当前账单的日期不晚于该日期，或待归档账单中可能还有该日期未写入历史账单的记录时，
+    # 报表内容（get_chat_ledgers）包含历史账单版本之外的数据，不能缓存
+    if live_records:
+        chat_data = chat_accounting.get(chat_id)
+        if chat_data and chat_data.get('date', date_str) <= date_str:
+            return None
+        if any(ledger.get('date', date_str) <= date_str and not is_ledger_archived(chat_id, ledger, date_str)
+               for _, ledger in get_pending_ledgers(chat_id)):
+            return None
+    
+    version = get_chat_history_version(chat_id, date_str)
+    if version is None:
+        return None
+    return (str(chat_id), date_str, version, report_format, chat_title)
+
+def get_cached_export(cache_key):
+    """读取导出缓存，返回 (内容摘要, 内容) 或None"""
+    with export_cache_lock:
+        cached = export_cache.get(cache_key)
+        if cached is not None:
+            export_cache.move_to_end(cache_key)
+        return cached
+
+def put_cached_export(cache_key, content):
+    """写入导出缓存，超过EXPORT_CACHE_SIZE时淘汰最久未使用的项"""
+    digest = hashlib.sha256(content).hexdigest()
+    with export_cache_lock:
+        export_cache[cache_key] = (digest, content)
+        export_cache.move_to_end(cache_key)
+        while len(export_cache) > EXPORT_CACHE_SIZE:
+            export_cache.popitem(last=False)
+    return digest
+
+def get_export_file_id(digest):
+    """获取该内容上次发送时Telegram返回的file_id"""
+    with export_cache_lock:
+        file_id = export_file_ids.get(digest)
+        if file_id is not None:
+            export_file_ids.move_to_end(digest)
+        return file_id
+
+def remember_export_file_id(digest, file_id):
+    """记录内容对应的file_id，数量上限与导出缓存相同"""
+    with export_cache_lock:
+        export_file_ids[digest] = file_id
+        export_file_ids.move_to_end(digest)
+        while len(export_file_ids) > EXPORT_CACHE_SIZE:
+            export_file_ids.popitem(last=False)
+
+def forget_export_file_id(digest):
+    """删除已失效的file_id"""
+    with export_cache_lock:
+        export_file_ids.pop(digest, None)
+
+def invalidate_export_cache(chat_id, date_str):
+    """群组某日期的记录被修改时，删除该日期的所有导出缓存"""
+    with export_cache_lock:
+        for cache_key in [key for key in export_cache if key[0] == str(chat_id) and key[1] == date_str]:
+            del export_cache[cache_key]
+
+def archive_report(buffer, filename):
+    """把已发送的报表另存到归档目录，并按保留天数和总大小清理旧文件"""
+    try:
+        os.makedirs(EXPORT_ARCHIVE_DIR, exist_ok=True)
+        timestamp = get_now().strftime("%Y%m%d_%H%M%S")
+        safe_name = "".join([c if c.isalnum() or c in '._-' else "_" for c in filename])
+        archive_path = os.path.join(EXPORT_ARCHIVE_DIR, f"{timestamp}_{safe_name}")
+        
+        buffer.seek(0)
+        with open(archive_path, 'wb') as f:
+            shutil.copyfileobj(buffer, f)
+        logger.info(f"已归档导出文件 {archive_path}")
+        
+        clean_export_archive()
+    except Exception as e:
+        logger.error(f"归档导出文件 {filename} 时出错: {e}", exc_info=True)
+
+def clean_export_archive():
+    """删除超过保留天数的归档文件，总大小超过上限时从最旧的文件开始删除"""
+    if not os.path.isdir(EXPORT_ARCHIVE_DIR):
+        return
+    
+    cutoff = time.time() - EXPORT_ARCHIVE_MAX_DAYS * 86400
+    max_bytes = EXPORT_ARCHIVE_MAX_MB * 1024 * 1024
+    
+    files = []
+    for name in os.listdir(EXPORT_ARCHIVE_DIR):
+        path = os.path.join(EXPORT_ARCHIVE_DIR, name)
+        if not os.path.isfile(path):
+            continue
+        stat = os.stat(path)
+        if stat.st_mtime < cutoff:
+            os.remove(path)
+            logger.info(f"已删除过期的归档文件 {path}")
+        else:
+            files.append((stat.st_mtime, stat.st_size, path))
+    
+    total_size = sum(size for _, size, _ in files)
+    for _, size, path in sorted(files):
+        if total_size <= max_bytes:
+            break
+        os.remove(path)
+        total_size -= size
+        logger.info(f"归档目录超过 {EXPORT_ARCHIVE_MAX_MB}MB，已删除 {path}")
+
+def add_rollup_to_summary(summary, chat_id, rollup):
+    """把一个群组的每日汇总合并到跨群统计中"""
+    for operator, amount in rollup['operators'].items():
+        summary['operators'][operator] = summary['operators'].get(operator, 0) + amount
+        by_group = summary['operators_by_group'].setdefault(operator, {})
+        by_group[chat_id] = by_group.get(chat_id, 0) + amount
+    
+    for responder, amount in rollup['responders'].items():
+        summary['responders'][responder] = summary['responders'].get(responder, 0) + amount
+
+def build_daily_stats(rollups):
+    """由各群组的每日汇总生成跨群统计：操作人总计、按群组的操作人金额、回复人总计"""
+    summary = {'operators': {}, 'operators_by_group': {}, 'responders': {}}
+    for chat_id, rollup in rollups.items():
+        add_rollup_to_summary(summary, chat_id, rollup)
+    return {'chats': rollups, 'summary': summary}
+
+def collect_daily_rollups(date_str):
+    """从原始记录收集所有群组在指定日期的汇总
+    
+    保留期内的日期从当前账单、原始历史记录和待归档的旧账单计算，更早的日期直接读取压缩汇总
+    """
+    rollups = {}
+    
+    raw_cutoff = get_date_days_ago(RAW_HISTORY_DAYS)
+    if date_str >= raw_cutoff:
+        pending = get_pending_ledgers()
+        
+        # 当前账单中时间在该日期的记录
+        for chat_id, chat_data in list(chat_accounting.items()):
+            rollup = build_daily_rollup(chat_data, date_str)
+            if rollup['deposit_count'] or rollup['withdrawal_count']:
+                rollups[chat_id] = rollup
+        
+        # 已归档的原始记录；当前账单中也有该日期记录的群组（结账时间不在零点）合并两部分
+        for chat_id in get_history_chat_ids():
+            day_data = get_chat_history(chat_id, date_str)
+            if day_data is not None:
+                rollup = build_daily_rollup(day_data)
+                if not (rollup['deposit_count'] or rollup['withdrawal_count']):
+                    continue
+                if chat_id in rollups:
+                    merge_daily_rollup(rollups[chat_id], rollup)
+                else:
+                    rollups[chat_id] = rollup
+        
+        # 已结账、尚未归档的旧账单
+        for chat_id, rollup in get_pending_rollups(date_str, pending).items():
+            if chat_id in rollups:
+                merge_daily_rollup(rollups[chat_id], rollup)
+            else:
+                rollups[chat_id] = rollup
+    
+    # 原始记录已压缩的群组使用汇总
+    for chat_id, rollup in get_daily_rollups(date_str).items():
+        rollups.setdefault(chat_id, rollup)
+    
+    return rollups
+
+def get_daily_stats(date_str):
+    """获取指定日期的跨群统计
+    
+    当日使用增量维护的统计；已结束的日期使用归档时生成的统计文件，合并还在待归档队列中的旧账单；
+    都没有时才从记录重新计算
+    """
+    if date_str == get_current_date():
+        return get_live_daily_stats()
+    
+    stats = load_daily_stats(date_str)
+    if stats is not None:
+        pending_rollups = get_pending_rollups(date_str)
+        if not pending_rollups:
+            return stats
+        rollups = stats['chats']
+        for chat_id, rollup in pending_rollups.items():
+            if chat_id in rollups:
+                merge_daily_rollup(rollups[chat_id], rollup)
+            else:
+                rollups[chat_id] = rollup
+        return build_daily_stats(rollups)
+    
+    return build_daily_stats(collect_daily_rollups(date_str))
+
+def get_live_daily_stats():
+    """获取当日跨群统计的快照，费率和汇率使用各群组当前设置"""
+    today = get_current_date()
+    with live_stats_lock:
+        if live_daily_stats['date'] != today:
+            rebuild_live_daily_stats(today)
+        stats = copy.deepcopy({'chats': live_daily_stats['chats'], 'summary': live_daily_stats['summary']})
+    
+    for chat_id, rollup in stats['chats'].items():
+        chat_data = chat_accounting.get(chat_id)
+        if chat_data:
+            rollup['rate'] = chat_data.get('rate', 0.0)
+            rollup['fixed_rate'] = chat_data.get('fixed_rate', 1.0)
+    
+    return stats
+
+def rebuild_live_daily_stats(date_str):
+    """重新计算当日跨群统计，调用方需持有live_stats_lock
+    
+    除当前账单外还包括结账时间不在零点的群组已结账的旧账单（待归档或已归档）中当日的记录
+    """
+    stats = build_daily_stats(collect_daily_rollups(date_str))
+    live_daily_stats['date'] = date_str
+    live_daily_stats['chats'] = stats['chats']
+    live_daily_stats['summary'] = stats['summary']
+
+def record_live_daily_stats(chat_id, record, is_withdrawal=False):
+    """新记录入账后增量更新当日跨群统计"""
+    record_date = record['time'].split(' ')[0]
+    with live_stats_lock:
+        if live_daily_stats['date'] != record_date:
+            # 统计已过期（跨日或被重置），整体重算时会包含这条记录
+            rebuild_live_daily_stats(record_date)
+            return
+        
+        chat_data = chat_accounting.get(chat_id, {})
+        rollup = live_daily_stats['chats'].get(chat_id)
+        if rollup is None:
+            rollup = new_daily_rollup(chat_data.get('rate', 0.0), chat_data.get('fixed_rate', 1.0))
+            live_daily_stats['chats'][chat_id] = rollup
+        
+        if is_withdrawal:
+            add_withdrawal_to_rollup(rollup, record)
+            return
+        
+        add_deposit_to_rollup(rollup, record)
+        
+        # 只把这一笔入款合并进跨群统计
+        delta = new_daily_rollup()
+        add_deposit_to_rollup(delta, record)
+        add_rollup_to_summary(live_daily_stats['summary'], chat_id, delta)
+
+def invalidate_live_daily_stats():
+    """账单被重置或归档后使当日统计失效，下次访问时重新计算"""
+    with live_stats_lock:
+        live_daily_stats['date'] = None
+
+def get_rollup_path(date_str):
+    """获取指定日期的汇总文件路径"""
+    return os.path.join(ROLLUP_DIR, f"{date_str}.json")
+
+def get_rollup_dates():
+    """列出所有有汇总的日期，按日期倒序"""
+    if not os.path.isdir(ROLLUP_DIR):
+        return []
+    return sorted((name[:-len('.json')] for name in os.listdir(ROLLUP_DIR) if name.endswith('.json')), reverse=True)
+
+def load_daily_stats(date_str):
+    """读取指定日期的汇总文件，返回 {'chats': chat_id -> 汇总, 'summary': 跨群统计}，不存在时返回None"""
+    file_path = get_rollup_path(date_str)
+    if not os.path.exists(file_path):
+        return None
+    
+    try:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except Exception as e:
+        logger.error(f"读取 {date_str} 的每日汇总时出错: {e}", exc_info=True)
+        return None
+    
+    rollups = {normalize_chat_id(chat_id): rollup for chat_id, rollup in data['chats'].items()}
+    if 'summary' not in data:
+        return build_daily_stats(rollups)
+    
+    summary = data['summary']
+    summary['operators_by_group'] = {
+        operator: {normalize_chat_id(chat_id): amount for chat_id, amount in by_group.items()}
+        for operator, by_group in summary['operators_by_group'].items()
+    }
+    return {'chats': rollups, 'summary': summary}
+
+def get_daily_rollups(date_str):
+    """读取指定日期所有群组的汇总，返回 chat_id -> 汇总"""
+    stats = load_daily_stats(date_str)
+    return stats['chats'] if stats else {}
+
+def save_daily_stats(date_str, stats):
+    """将指定日期的汇总和跨群统计写入汇总文件"""
+    os.makedirs(ROLLUP_DIR, exist_ok=True)
+    
+    file_path = get_rollup_path(date_str)
+    tmp_path = f"{file_path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(stats, f, ensure_ascii=False, separators=(',', ':'))
+    os.replace(tmp_path, file_path)
+
+def save_daily_rollup(chat_id, date_str, rollup):
+    """将单个群组某日的汇总合并进该日期的汇总文件"""
+    save_daily_rollups(date_str, {chat_id: rollup})
+
+def save_daily_rollups(date_str, new_rollups):
+    """将多个群组某日的汇总合并进该日期的汇总文件，只读写一次"""
+    with rollup_lock:
+        rollups = get_daily_rollups(date_str)
+        rollups.update(new_rollups)
+        save_daily_stats(date_str, build_daily_stats(rollups))
+
+def get_chat_history_path(chat_id, date_str=None):
+    """获取群组历史账单目录，或指定日期的历史账单文件路径"""
+    chat_dir = os.path.join(HISTORY_DIR, str(chat_id))
+    if date_str is None:
+        return chat_dir
+    return os.path.join(chat_dir, f"{date_str}.json")
+
+def get_history_chat_ids():
+    """列出历史存储中所有群组的ID"""
+    if not os.path.isdir(HISTORY_DIR):
+        return []
+    return [normalize_chat_id(name) for name in os.listdir(HISTORY_DIR)
+            if os.path.isdir(os.path.join(HISTORY_DIR, name))]
+
+def get_chat_history_dates(chat_id):
+    """列出群组有历史账单的日期（只读取目录，不加载账单内容），按日期倒序"""
+    chat_dir = get_chat_history_path(chat_id)
+    if not os.path.isdir(chat_dir):
+        return []
+    return sorted((name[:-len('.json')] for name in os.listdir(chat_dir) if name.endswith('.json')), reverse=True)
+
+@traced
+def get_chat_history(chat_id, date_str):
+    """按需加载群组指定日期的历史账单，最近使用的保留在LRU缓存中"""
+    key = (str(chat_id), date_str)
+    with history_lock:
+        if key in history_cache:
+            history_cache.move_to_end(key)
+            return history_cache[key]
+    
+    file_path = get_chat_history_path(chat_id, date_str)
+    if not os.path.exists(file_path):
+        return None
+    
+    try:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            day_data = json.load(f)
+    except Exception as e:
+        logger.error(f"加载群组 {chat_id} 在 {date_str} 的历史账单时出错: {e}", exc_info=True)
+        return None
+    
+    with history_lock:
+        history_cache[key] = day_data
+        history_cache.move_to_end(key)
+        # 超出缓存上限时淘汰最久未使用的历史账单
+        while len(history_cache) > HISTORY_CACHE_SIZE:
+            history_cache.popitem(last=False)
+    
+    return day_data
+
+@traced
+def save_chat_history(chat_id, date_str, day_data):
+    """将群组指定日期的账单写入历史存储"""
+    chat_dir = get_chat_history_path(chat_id)
+    os.makedirs(chat_dir, exist_ok=True)
+    
+    # 先写临时文件再替换，避免写入中断导致历史文件损坏
+    file_path = get_chat_history_path(chat_id, date_str)
+    tmp_path = f"{file_path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(day_data, f, ensure_ascii=False)
+    os.replace(tmp_path, file_path)
+    
+    # 使缓存中的旧数据失效，下次访问时重新加载
+    with history_lock:
+        history_cache.pop((str(chat_id), date_str), None)
+    invalidate_export_cache(chat_id, date_str)
+
+def delete_chat_history(chat_id, date_str):
+    """删除群组指定日期的历史账单"""
+    file_path = get_chat_history_path(chat_id, date_str)
+    if os.path.exists(file_path):
+        os.remove(file_path)
+    
+    with history_lock:
+        history_cache.pop((str(chat_id), date_str), None)
+    invalidate_export_cache(chat_id, date_str)
+
+def get_chat_history_version(chat_id, date_str):
+    """历史账单的数据版本：文件修改时间和大小，文件不存在时返回None"""
+    try:
+        stat = os.stat(get_chat_history_path(chat_id, date_str))
+    except FileNotFoundError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+def normalize_chat_id(chat_id):
+    """将从JSON或文件名中读取的聊天ID还原为整数"""
+    try:
+        return int(chat_id)
+    except (TypeError, ValueError):
+        return chat_id
+
 # 将全局操作人集合改为按群组存储的字典
 # 键为chat_id，值为该群的操作人集合
 group_operators = {}  # 群组特定的操作人
@@ -193,15 +1606,117 @@ admin_user_id = ADMIN_USER_ID  # Admin user ID who can manage operators
 # Timezone setting (China timezone)
 timezone = pytz.timezone(TIMEZONE)
 
+class SystemClock:
+    """系统时钟（TIMEZONE时区），精确到秒；同一秒内的调用复用已转换好的时间、时间戳和日期字符串"""
+    def __init__(self, tz):
+        self.tz = tz
+        self.cache = (None, None, None, None)  # (整秒, 时间, 'YYYY-MM-DD HH:MM:SS', 'YYYY-MM-DD')
+
+    def current(self):
+        second = int(time.time())
+        cache = self.cache
+        if cache[0] != second:
+            now = datetime.datetime.fromtimestamp(second, self.tz)
+            # 整体替换元组，其他线程读到的总是同一秒的数据
+            cache = self.cache = (second, now, now.strftime('%Y-%m-%d %H:%M:%S'), now.strftime('%Y-%m-%d'))
+        return cache
+
+    def now(self):
+        return self.current()[1]
+
+    def timestamp(self):
+        return self.current()[2]
+
+    def today(self):
+        return self.current()[3]
+
+class FakeClock:
+    """手动控制的时钟，用于模拟和测试：只有调用set/advance时才前进，可以在几秒内模拟多天的运行"""
+    def __init__(self, start):
+        self.current = start
+
+    def set(self, when):
+        self.current = when
+
+    def advance(self, seconds=0, **kwargs):
+        """前进指定的时间，参数与datetime.timedelta相同"""
+        self.current = self.current.tzinfo.normalize(self.current + datetime.timedelta(seconds=seconds, **kwargs))
+
+    def now(self):
+        return self.current
+
+    def timestamp(self):
+        return self.current.strftime('%Y-%m-%d %H:%M:%S')
+
+    def today(self):
+        return self.current.strftime('%Y-%m-%d')
+
+# 所有读取当前时间的地方都经过clock，模拟和测试时用set_clock换成FakeClock
+clock = SystemClock(timezone)
+
+def set_clock(new_clock):
+    """替换时钟，返回原来的时钟"""
+    global clock
+    old_clock, clock = clock, new_clock
+    return old_clock
+
+def get_now():
+    """当前时间（带时区）"""
+    return clock.now()
+
+def get_current_timestamp():
+    """当前时间，格式为 YYYY-MM-DD HH:MM:SS（记录的time字段）"""
+    return clock.timestamp()
+
 def get_current_time():
     """Get the current time in HH:MM format."""
-    now = datetime.datetime.now(timezone)
-    return now.strftime("%H:%M")
+    return clock.timestamp()[11:16]
 
 def get_current_date():
     """Get the current date in YYYY-MM-DD format."""
-    now = datetime.datetime.now(timezone)
-    return now.strftime("%Y-%m-%d")
+    return clock.today()
+
+@functools.lru_cache(maxsize=256)
+def shift_date(date_str, days):
+    """date_str（YYYY-MM-DD）之后days天的日期，days为负数时为之前"""
+    return (datetime.date.fromisoformat(date_str) + datetime.timedelta(days=days)).isoformat()
+
+def get_date_days_ago(days):
+    """days天前的日期"""
+    return shift_date(get_current_date(), -days)
+
+def get_recent_dates(count):
+    """包括今天在内最近count天的日期，从新到旧"""
+    today = get_current_date()
+    return [shift_date(today, -i) for i in range(count)]
+
+def get_cutoff_hour(chat_id):
+    """群组的结账时间（小时）"""
+    return GROUP_CUTOFF_HOURS.get(chat_id, DAILY_CUTOFF_HOUR)
+
+def get_business_date(chat_id, now=None):
+    """群组当前账单所属的结账日（YYYY-MM-DD），结账时间之前仍属于前一天；只决定何时结账，记录的日期以记录时间为准"""
+    hour = get_cutoff_hour(chat_id)
+    if now is None:
+        # 午夜结账时就是当前日期，直接使用时钟缓存的日期字符串
+        if hour == 0:
+            return get_current_date()
+        now = get_now()
+    return (now - datetime.timedelta(hours=hour)).strftime("%Y-%m-%d")
+
+def get_next_rollover_time(now=None):
+    """now之后最近的一个结账时间点（所有群组的结账时间中最早的一个）"""
+    now = now or get_now()
+    hours = {DAILY_CUTOFF_HOUR, *GROUP_CUTOFF_HOURS.values()}
+    candidates = []
+    for days in (0, 1):
+        day = now.date() + datetime.timedelta(days=days)
+        for hour in hours:
+            # localize按该日期实际的UTC偏移计算，夏令时切换当天也准确
+            when = timezone.localize(datetime.datetime.combine(day, datetime.time(hour)))
+            if when > now:
+                candidates.append(when)
+    return min(candidates)
 
 def is_global_admin(user_id, username):
     """检查用户是否是全局管理员"""
@@ -279,6 +1794,7 @@ GROUP_LIST = [
 ]
 
 # 添加回之前删除的process_deposit函数
+@timed_route
 def process_deposit(update, context, text):
     """处理入款命令：+100 或 +100/7.2 格式"""
     chat_id = update.effective_chat.id
@@ -293,7 +1809,7 @@ def process_deposit(update, context, text):
         update.message.reply_text("❌ 此群组未授权，请联系管理员进行授权")
         return
     
-    logger.info(f"处理入款命令: {text}, 聊天: {chat_id} ({chat_title}), 用户: {user_id} (@{username})")
+    logger.info("处理入款命令: %s, 聊天: %s (%s), 用户: %s (@%s)", text, chat_id, chat_title, user_id, username)
     
     try:
         # 去掉+号
@@ -304,7 +1820,7 @@ def process_deposit(update, context, text):
             parts = amount_text.split('/', 1)
             amount = float(parts[0])
             rate = float(parts[1])
-            logger.info(f"入款带汇率: 金额={amount}, 汇率={rate}")
+            logger.info("入款带汇率: 金额=%s, 汇率=%s", amount, rate)
             
             # 设置汇率
             get_chat_accounting(chat_id)['fixed_rate'] = rate
@@ -316,7 +1832,7 @@ def process_deposit(update, context, text):
         else:
             # 普通入款
             amount = float(amount_text)
-            logger.info(f"普通入款: 金额={amount}")
+            logger.info("普通入款: 金额=%s", amount)
             
             # 添加入款记录
             add_deposit_record(update, amount)
@@ -324,7 +1840,7 @@ def process_deposit(update, context, text):
             # 不再发送确认消息，直接显示账单
         
         # 显示更新后的账单
-        logger.info(f"入款完成，显示账单摘要")
+        logger.info("入款完成，显示账单摘要")
         summary(update, context)
         
     except ValueError as e:
@@ -335,6 +1851,7 @@ def process_deposit(update, context, text):
         update.message.reply_text(f"❌ 处理入款时出错: {str(e)}")
 
 # 添加回之前删除的process_withdrawal函数
+@timed_route
 def process_withdrawal(update, context, text):
     """处理减款命令：-100 或 -100/7.2 格式"""
     chat_id = update.effective_chat.id
@@ -349,7 +1866,7 @@ def process_withdrawal(update, context, text):
         update.message.reply_text("❌ 此群组未授权，请联系管理员进行授权")
         return
     
-    logger.info(f"处理减款命令: {text}, 聊天: {chat_id} ({chat_title}), 用户: {user_id} (@{username})")
+    logger.info("处理减款命令: %s, 聊天: %s (%s), 用户: %s (@%s)", text, chat_id, chat_title, user_id, username)
     
     try:
         # 去掉-号
@@ -360,7 +1877,7 @@ def process_withdrawal(update, context, text):
             parts = amount_text.split('/', 1)
             amount = float(parts[0])
             rate = float(parts[1])
-            logger.info(f"减款带汇率: 金额={amount}, 汇率={rate}")
+            logger.info("减款带汇率: 金额=%s, 汇率=%s", amount, rate)
             
             # 设置汇率
             get_chat_accounting(chat_id)['fixed_rate'] = rate
@@ -372,7 +1889,7 @@ def process_withdrawal(update, context, text):
         else:
             # 普通减款
             amount = float(amount_text)
-            logger.info(f"普通减款: 金额={amount}")
+            logger.info("普通减款: 金额=%s", amount)
             
             # 添加负入款记录
             add_negative_deposit_record(update, amount)
@@ -380,7 +1897,7 @@ def process_withdrawal(update, context, text):
             # 不再发送确认消息，直接显示账单
         
         # 显示更新后的账单
-        logger.info(f"减款完成，显示账单摘要")
+        logger.info("减款完成，显示账单摘要")
         summary(update, context)
         
     except ValueError as e:
@@ -447,17 +1964,18 @@ def add_deposit_record(update, amount):
     deposit_record = {
         'amount': amount,
         'usd_equivalent': usd_equivalent,
-        'time': datetime.datetime.now(timezone).strftime('%Y-%m-%d %H:%M:%S'),
+        'time': get_current_timestamp(),
         'user': display_name,
         'responder': responder  # 添加回复者信息
     }
     
     # 添加到入款列表
-    chat_data['deposits'].append(deposit_record)
+    chat_data = append_chat_record(chat_id, 'deposits', deposit_record)
+    record_live_daily_stats(chat_id, deposit_record)
     
     # 记录详细日志
-    logger.info(f"聊天 {chat_id} 新增入款记录: {json.dumps(deposit_record)}")
-    logger.info(f"聊天 {chat_id} 当前入款总数: {len(chat_data['deposits'])}条")
+    logger.info("聊天 %s 新增入款记录: %s", chat_id, LazyJSON(deposit_record))
+    logger.info("聊天 %s 当前入款总数: %s条", chat_id, len(chat_data['deposits']))
     save_data()
 
 # 添加回之前删除的add_negative_deposit_record函数
@@ -488,22 +2006,23 @@ def add_negative_deposit_record(update, amount):
     deposit_record = {
         'amount': -amount,  # 负值
         'usd_equivalent': usd_equivalent,
-        'time': datetime.datetime.now(timezone).strftime('%Y-%m-%d %H:%M:%S'),
+        'time': get_current_timestamp(),
         'user': display_name
     }
     
     # 添加到入款列表
-    chat_data['deposits'].append(deposit_record)
+    chat_data = append_chat_record(chat_id, 'deposits', deposit_record)
+    record_live_daily_stats(chat_id, deposit_record)
     
     # 记录详细日志
-    logger.info(f"聊天 {chat_id} 新增减款记录: {json.dumps(deposit_record)}")
-    logger.info(f"聊天 {chat_id} 当前入款总数: {len(chat_data['deposits'])}条")
+    logger.info("聊天 %s 新增减款记录: %s", chat_id, LazyJSON(deposit_record))
+    logger.info("聊天 %s 当前入款总数: %s条", chat_id, len(chat_data['deposits']))
     save_data()
 
 # 添加回之前删除的handle_other_commands函数
 def handle_other_commands(update, context, text):
     """处理其他格式的命令，如"回100"、"下发100"等"""
-    logger.info(f"处理其他命令: {text}")
+    logger.info("处理其他命令: %s", text)
     
     # 获取聊天ID
     chat_id = update.effective_chat.id
@@ -518,7 +2037,7 @@ def handle_other_commands(update, context, text):
             
         try:
             amount = float(match.group(1))
-            logger.info(f"处理回款: {amount} USDT")
+            logger.info("处理回款: %s USDT", amount)
             
             # 记录出款
             add_withdrawal_record(update, amount)
@@ -530,7 +2049,8 @@ def handle_other_commands(update, context, text):
             local_amount = amount * rate
             
             # 发送确认消息 - 使用普通文本而不是emoji
-            update.message.reply_text("已回款")
+            if catch_up_state is None:
+                update.message.reply_text("已回款")
             
             # 显示更新后的账单
             summary(update, context)
@@ -562,7 +2082,8 @@ def handle_other_commands(update, context, text):
             local_amount = amount * rate
             
             # 发送确认消息 - 使用普通文本而不是emoji
-            update.message.reply_text("已下发")
+            if catch_up_state is None:
+                update.message.reply_text("已下发")
             
             # 显示更新后的账单
             summary(update, context)
@@ -783,18 +2304,20 @@ def add_withdrawal_record(update, amount):
     withdrawal_record = {
         'amount': local_amount,  # 存储本地货币金额
         'usd_equivalent': amount,  # 存储原始USDT金额
-        'time': datetime.datetime.now(timezone).strftime('%Y-%m-%d %H:%M:%S'),
+        'time': get_current_timestamp(),
         'user': display_name
     }
     
     # 添加到出款列表
-    chat_data['withdrawals'].append(withdrawal_record)
+    chat_data = append_chat_record(chat_id, 'withdrawals', withdrawal_record)
+    record_live_daily_stats(chat_id, withdrawal_record, is_withdrawal=True)
     
     # 记录详细日志
-    logger.info(f"聊天 {chat_id} 新增出款记录: {json.dumps(withdrawal_record)}")
-    logger.info(f"聊天 {chat_id} 当前出款总数: {len(chat_data['withdrawals'])}条")
+    logger.info("聊天 %s 新增出款记录: %s", chat_id, LazyJSON(withdrawal_record))
+    logger.info("聊天 %s 当前出款总数: %s条", chat_id, len(chat_data['withdrawals']))
     save_data()
 
+@traced
 def handle_text_message(update: Update, context: CallbackContext) -> None:
     """处理文本消息，检查特殊格式的命令"""
     global processed_message_ids
@@ -805,7 +2328,7 @@ def handle_text_message(update: Update, context: CallbackContext) -> None:
     # 检查消息ID是否已被处理过，如果是则跳过
     message_id = update.message.message_id
     if message_id in processed_message_ids:
-        logger.debug(f"跳过已处理的消息ID: {message_id}")
+        logger.debug("跳过已处理的消息ID: %s", message_id)
         return
     
     # 将当前消息ID添加到已处理集合中
@@ -822,7 +2345,7 @@ def handle_text_message(update: Update, context: CallbackContext) -> None:
     username = update.effective_user.username
     message_text = update.message.text
     
-    logger.debug(f"收到消息: '{message_text}' 来自 {chat_id} ({chat_title}), 用户: {user_id} (@{username})")
+    logger.debug("收到消息: '%s' 来自 %s (%s), 用户: %s (@%s)", message_text, chat_id, chat_title, user_id, username)
     
     # 检查是否是"授权群"指令，只有全局管理员可以执行
     if message_text.strip() == '授权群':
@@ -832,7 +2355,7 @@ def handle_text_message(update: Update, context: CallbackContext) -> None:
             if chat_type in ['group', 'supergroup']:
                 # 添加到授权群组列表
                 authorized_groups.add(chat_id)
-                logger.info(f"群组 {chat_id} ({chat_title}) 已授权")
+                logger.info("群组 %s (%s) 已授权", chat_id, chat_title)
                 update.message.reply_text(f"✅ 此群组已成功授权，可以开始使用机器人功能")
             else:
                 update.message.reply_text("❌ 此命令只能在群组中使用")
@@ -844,7 +2367,7 @@ def handle_text_message(update: Update, context: CallbackContext) -> None:
     if chat_type in ['group', 'supergroup'] and chat_id not in authorized_groups:
         # 如果是全局管理员发送的消息，允许处理
         if not is_global_admin(user_id, username):
-            logger.debug(f"忽略未授权群组 {chat_id} ({chat_title}) 的消息")
+            logger.debug("忽略未授权群组 %s (%s) 的消息", chat_id, chat_title)
             return
     
     # 处理快捷指令
@@ -862,9 +2385,12 @@ def handle_text_message(update: Update, context: CallbackContext) -> None:
         # 如果是对当前机器人的命令，去掉@部分
         message_text = command
     
+    # 预编译的词法分类，一次扫描区分入款/出款快捷指令、计算器命令和数学表达式，普通聊天文本在第一个字符就被排除
+    message_kind, message_body = classify_message(message_text)
+    
     # 处理USDT地址查询
     if message_text.strip() == "查询" and update.message.reply_to_message:
-        logger.info(f"检测到USDT查询请求")
+        logger.info("检测到USDT查询请求")
         handle_usdt_query(update, context)
         return
     
@@ -899,7 +2425,7 @@ def handle_text_message(update: Update, context: CallbackContext) -> None:
         return
     
     # 处理入款指令：+100 格式
-    if message_text.strip().startswith('+'):
+    if message_kind == 'sign' and message_body == '+':
         if is_authorized(update):
             process_deposit(update, context, message_text)
         else:
@@ -907,7 +2433,7 @@ def handle_text_message(update: Update, context: CallbackContext) -> None:
         return
     
     # 处理出款指令：-100 格式
-    if message_text.strip().startswith('-'):
+    if message_kind == 'sign' and message_body == '-':
         if is_authorized(update):
             process_withdrawal(update, context, message_text)
         else:
@@ -919,15 +2445,9 @@ def handle_text_message(update: Update, context: CallbackContext) -> None:
         handle_export_all_bills_command(update, context)
         return
     
-    # 处理计算器命令
-    if message_text.strip().startswith('计算') or message_text.strip().startswith('calc'):
-        calculation_result = handle_calculator(message_text)
-        update.message.reply_text(calculation_result)
-        return
-    
-    # 检查是否为数学表达式 (例如: 2+2, 5*3, etc.)
-    if is_mathematical_expression(message_text):
-        calculation_result = handle_calculator(message_text)
+    # 处理计算器命令和数学表达式 (例如: 计算 2+2, 5*3, etc.)，直接使用分类时得到的表达式
+    if message_kind in ('calc', 'math'):
+        calculation_result = handle_calculator(message_text, message_body)
         update.message.reply_text(calculation_result)
         return
         
@@ -941,7 +2461,7 @@ def handle_text_message(update: Update, context: CallbackContext) -> None:
     
     # 对于私聊，如果不是命令，提供帮助信息
     if chat_type == 'private':
-        logger.debug(f"收到非命令消息: '{message_text}'")
+        logger.debug("收到非命令消息: '%s'", message_text)
         help_command(update, context)
         return
 
@@ -967,39 +2487,11 @@ def handle_export_all_bills_command(update_or_query, context: CallbackContext) -
         chat_title = chat.title if chat.type in ['group', 'supergroup'] else "私聊"
         
         # 获取最近7天的日期列表
-        dates = []
-        for i in range(7):
-            date = (datetime.datetime.now(timezone) - datetime.timedelta(days=i)).strftime('%Y-%m-%d')
-            dates.append(date)
+        dates = get_recent_dates(7)
         
-        # 找出有记录的日期
-        dates_with_records = []
-        
-        # 获取该聊天的账单数据
-        chat_data = get_chat_accounting(chat_id)
-        
-        for date_str in dates:
-            # 检查是否有该日期的记录
-            has_records = False
-            
-            # 检查存款记录
-            for deposit in chat_data['deposits']:
-                record_date = deposit['time'].split(' ')[0]
-                if record_date == date_str:
-                    has_records = True
-                    break
-            
-            # 检查提款记录，如果还没有找到记录
-            if not has_records:
-                for withdrawal in chat_data['withdrawals']:
-                    record_date = withdrawal['time'].split(' ')[0]
-                    if record_date == date_str:
-                        has_records = True
-                        break
-            
-            # 如果有该日期的记录，添加到列表
-            if has_records:
-                dates_with_records.append(date_str)
+        # 找出有记录的日期：一次遍历当前账单和已归档的历史账单
+        by_date = aggregate_records(get_chat_ledgers(chat_id, dates), dates=set(dates), by_date=True)['by_date']
+        dates_with_records = [date_str for date_str in dates if date_str in by_date]
         
         # 如果没有找到任何有记录的日期
         if not dates_with_records:
@@ -1033,161 +2525,124 @@ def handle_export_all_bills_command(update_or_query, context: CallbackContext) -
         else:
             update_object.message.reply_text(f"显示日期选择界面时出错: {str(e)}")
 
-def export_chat_all_days_to_txt(chat_id, chat_title, summary_text, date_list):
-    """导出指定聊天在最近7天内的账单数据为TXT文件"""
-    try:
-        # 创建导出目录，如果不存在
-        export_dir = "exports"
-        if not os.path.exists(export_dir):
-            os.makedirs(export_dir)
-        
-        # 创建安全的文件名
-        safe_name = "".join([c if c.isalnum() else "_" for c in chat_title])
-        timestamp = datetime.datetime.now(timezone).strftime("%Y%m%d_%H%M%S")
-        file_path = os.path.join(export_dir, f"{safe_name}_7days_{timestamp}.txt")
-        
-        # 获取该聊天的账单数据
-        chat_data = get_chat_accounting(chat_id)
-        
-        # 准备文件内容
-        content = f"===== {chat_title} 财务账单 =====\n"
-        content += f"导出时间: {datetime.datetime.now(timezone).strftime('%Y-%m-%d %H:%M:%S')}\n\n"
-        
-        # 添加摘要部分
-        content += summary_text + "\n"
-        
-        # 添加明细部分 - 按日期组织
-        all_deposits = chat_data['deposits']
-        all_withdrawals = chat_data['withdrawals']
-        
-        # 汇率
-        rate = chat_data.get('fixed_rate', 1.0)
-        
-        # 按日期组织明细数据
-        content += "\n===== 按日期明细 =====\n"
-        for date_str in date_list:
-            # 筛选指定日期的记录
-            date_deposits = [d for d in all_deposits if d['time'].split(' ')[0] == date_str]
-            date_withdrawals = [w for w in all_withdrawals if w['time'].split(' ')[0] == date_str]
-            
-            if not date_deposits and not date_withdrawals:
-                continue  # 如果这一天没有记录，跳过
-            
-            # 添加日期标题
-            content += f"\n----- {date_str} -----\n"
-            
-            # 入款记录
-            content += "入款:\n"
-            if date_deposits:
-                for i, deposit in enumerate(sorted(date_deposits, key=lambda x: x.get('time', ''), reverse=True), 1):
-                    amount = deposit['amount']
-                    username = deposit['user']
-                    time_str = deposit.get('time', '')
-                    time_parts = time_str.split(' ')
-                    if len(time_parts) > 1:
-                        time_only = time_parts[1]
-                    else:
-                        time_only = "未知时间"
-                    usd_equivalent = amount / rate if rate != 0 else 0
-                    
-                    content += f"  {i}. {time_only}, {username}, {amount:.2f}, USD等值: {usd_equivalent:.2f}\n"
-            else:
-                content += "  暂无入款记录\n"
-            
-            # 出款记录
-            content += "出款:\n"
-            if date_withdrawals:
-                for i, withdrawal in enumerate(sorted(date_withdrawals, key=lambda x: x.get('time', ''), reverse=True), 1):
-                    amount = withdrawal['amount']
-                    username = withdrawal['user']
-                    time_str = withdrawal.get('time', '')
-                    time_parts = time_str.split(' ')
-                    if len(time_parts) > 1:
-                        time_only = time_parts[1]
-                    else:
-                        time_only = "未知时间"
-                    usd_equivalent = withdrawal['usd_equivalent']
-                    
-                    content += f"  {i}. {time_only}, {username}, {amount:.2f}, USD等值: {usd_equivalent:.2f}\n"
-            else:
-                content += "  暂无出款记录\n"
-        
-        # 写入文件
-        with open(file_path, 'w', encoding='utf-8') as f:
-            f.write(content)
-        
-        logger.info(f"已导出群组 {chat_id} 的账单数据到 {file_path}")
-        return file_path
-    except Exception as e:
-        logger.error(f"导出账单数据时出错: {e}", exc_info=True)
-        return None
+# 计算器：允许的函数、常量和运算符
+CALCULATOR_NAMES = {
+    'abs': abs, 'min': min, 'max': max,
+    'sum': sum, 'int': int, 'float': float,
+    'sin': math.sin, 'cos': math.cos, 'tan': math.tan,
+    'sqrt': math.sqrt, 'log': math.log, 'log10': math.log10,
+    'exp': math.exp, 'pi': math.pi, 'e': math.e,
+    'radians': math.radians, 'degrees': math.degrees,
+}
+CALCULATOR_OPERATORS = {
+    ast.Add: operator.add, ast.Sub: operator.sub,
+    ast.Mult: operator.mul, ast.Div: operator.truediv,
+    ast.BitXor: operator.xor, ast.Mod: operator.mod,
+    ast.FloorDiv: operator.floordiv,
+    ast.USub: operator.neg, ast.UAdd: operator.pos,
+}
+
+# 计算器的开销上限：表达式长度、语法树节点数、乘方结果的整数位数
+CALC_MAX_LENGTH = 200
+CALC_MAX_NODES = 100
+CALC_MAX_INT_BITS = 4096
+# 编译后的表达式按LRU缓存，重复的表达式不再解析
+CALC_CACHE_SIZE = 256
+calculator_cache = OrderedDict()  # 表达式 -> 编译后的求值函数
+calculator_lock = threading.Lock()
+
+def calculator_pow(base, exponent, modulus=None):
+    """有上限的乘方：预计结果超过CALC_MAX_INT_BITS位时在计算之前拒绝"""
+    if modulus is None and isinstance(base, int) and isinstance(exponent, int) and abs(base) > 1:
+        if exponent > 0 and math.log2(abs(base)) * exponent > CALC_MAX_INT_BITS:
+            raise ValueError("乘方结果过大")
+    return pow(base, exponent, modulus) if modulus is not None else pow(base, exponent)
+
+def calculator_round(number, ndigits=None):
+    """有上限的round：保留位数的绝对值过大时整数取整需要计算10的巨大次幂"""
+    if ndigits is not None and abs(ndigits) > 100:
+        raise ValueError("保留位数过大")
+    return round(number, ndigits)
+
+# 需要限制开销的函数使用带上限的版本
+CALCULATOR_GUARDED_FUNCTIONS = {'pow': calculator_pow, 'round': calculator_round}
 
-def handle_calculator(message_text):
-    """处理计算器功能"""
-    # 如果消息以"计算"或"calc"开头，去掉这个前缀
-    if message_text.startswith('计算'):
-        expression = message_text[2:].strip()
-    elif message_text.startswith('calc'):
-        expression = message_text[4:].strip()
+def compile_calculator_node(node):
+    """把语法树节点编译为求值函数，只允许白名单中的数字、名称、函数和运算符"""
+    if isinstance(node, ast.Constant) or type(node).__name__ == 'Num':
+        value = node.value if isinstance(node, ast.Constant) else node.n
+        # 只允许数字常量，字符串等常量可以构造出巨大的结果
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise TypeError(f"不支持的常量: {value!r}")
+        return lambda: value
+    elif isinstance(node, ast.BinOp):
+        left = compile_calculator_node(node.left)
+        right = compile_calculator_node(node.right)
+        if isinstance(node.op, ast.Pow):
+            return lambda: calculator_pow(left(), right())
+        op = CALCULATOR_OPERATORS.get(type(node.op))
+        if op is None:
+            raise TypeError(f"不支持的运算符: {type(node.op).__name__}")
+        return lambda: op(left(), right())
+    elif isinstance(node, ast.UnaryOp):
+        operand = compile_calculator_node(node.operand)
+        op = CALCULATOR_OPERATORS.get(type(node.op))
+        if op is None:
+            raise TypeError(f"不支持的运算符: {type(node.op).__name__}")
+        return lambda: op(operand())
+    elif isinstance(node, ast.Call):
+        func_name = getattr(node.func, 'id', None)
+        if func_name in CALCULATOR_GUARDED_FUNCTIONS:
+            func = CALCULATOR_GUARDED_FUNCTIONS[func_name]
+        elif func_name in CALCULATOR_NAMES and callable(CALCULATOR_NAMES[func_name]):
+            func = CALCULATOR_NAMES[func_name]
+        else:
+            raise ValueError(f"函数 '{func_name}' 不允许使用")
+        if node.keywords:
+            raise ValueError("不支持关键字参数")
+        args = [compile_calculator_node(arg) for arg in node.args]
+        return lambda: func(*[arg() for arg in args])
+    elif isinstance(node, ast.Name):
+        if node.id not in CALCULATOR_NAMES:
+            raise ValueError(f"变量 '{node.id}' 不允许使用")
+        value = CALCULATOR_NAMES[node.id]
+        return lambda: value
     else:
-        expression = message_text.strip()
+        raise TypeError(f"不支持的表达式类型: {type(node)}")
+
+def compile_expression(expression):
+    """解析并编译表达式，结果缓存在calculator_cache中；超过长度或节点数上限时拒绝"""
+    with calculator_lock:
+        compiled = calculator_cache.get(expression)
+        if compiled is not None:
+            calculator_cache.move_to_end(expression)
+            return compiled
+    
+    if len(expression) > CALC_MAX_LENGTH:
+        raise ValueError(f"表达式过长（最多{CALC_MAX_LENGTH}个字符）")
+    tree = ast.parse(expression, mode='eval')
+    if sum(1 for _ in ast.walk(tree)) > CALC_MAX_NODES:
+        raise ValueError("表达式过于复杂")
+    compiled = compile_calculator_node(tree.body)
+    
+    with calculator_lock:
+        calculator_cache[expression] = compiled
+        calculator_cache.move_to_end(expression)
+        while len(calculator_cache) > CALC_CACHE_SIZE:
+            calculator_cache.popitem(last=False)
+    return compiled
+
+@timed_route
+def handle_calculator(message_text, expression=None):
+    """处理计算器功能，expression为消息分类时已提取的表达式"""
+    if expression is None:
+        # 如果消息以"计算"或"calc"开头，去掉这个前缀
+        message_kind, message_body = classify_message(message_text)
+        expression = message_body if message_kind in ('calc', 'math') else message_text
+    expression = expression.strip()
 
     try:
-        # 安全地评估数学表达式
-        # 只允许安全的数学运算符和函数
-        allowed_names = {
-            'abs': abs, 'round': round, 'min': min, 'max': max,
-            'pow': pow, 'sum': sum, 'int': int, 'float': float,
-        }
-        
-        # 使用Python的ast模块确保表达式安全
-        import ast
-        import operator
-        import math
-        
-        # 添加常用数学函数
-        allowed_names.update({
-            'sin': math.sin, 'cos': math.cos, 'tan': math.tan,
-            'sqrt': math.sqrt, 'log': math.log, 'log10': math.log10,
-            'exp': math.exp, 'pi': math.pi, 'e': math.e,
-            'radians': math.radians, 'degrees': math.degrees,
-        })
-        
-        # 定义运算符映射
-        operators = {
-            ast.Add: operator.add, ast.Sub: operator.sub,
-            ast.Mult: operator.mul, ast.Div: operator.truediv,
-            ast.Pow: operator.pow, ast.BitXor: operator.xor,
-            ast.USub: operator.neg, ast.UAdd: operator.pos,
-            ast.Mod: operator.mod, ast.FloorDiv: operator.floordiv,
-        }
-        
-        # 定义安全的表达式计算函数
-        def safe_eval(node):
-            if isinstance(node, ast.Num):
-                return node.n
-            elif isinstance(node, ast.BinOp):
-                return operators[type(node.op)](safe_eval(node.left), safe_eval(node.right))
-            elif isinstance(node, ast.UnaryOp):
-                return operators[type(node.op)](safe_eval(node.operand))
-            elif isinstance(node, ast.Call):
-                func_name = node.func.id
-                if func_name not in allowed_names:
-                    raise ValueError(f"函数 '{func_name}' 不允许使用")
-                args = [safe_eval(arg) for arg in node.args]
-                return allowed_names[func_name](*args)
-            elif isinstance(node, ast.Name):
-                if node.id not in allowed_names:
-                    raise ValueError(f"变量 '{node.id}' 不允许使用")
-                return allowed_names[node.id]
-            elif isinstance(node, ast.Constant):  # Python 3.8+
-                return node.value
-            else:
-                raise TypeError(f"不支持的表达式类型: {type(node)}")
-        
-        # 解析表达式
-        parsed_expr = ast.parse(expression, mode='eval').body
-        result = safe_eval(parsed_expr)
+        result = compile_expression(expression)()
         
         # 格式化结果，避免显示过多小数位
         if isinstance(result, float):
@@ -1221,17 +2676,27 @@ def extract_usdt_address(text):
     
     return None
 
-def is_mathematical_expression(text):
-    """检查文本是否是一个数学表达式"""
-    import re
-    # 简单检查是否包含数字和运算符
-    text = text.strip()
-    # 匹配包含数字和至少一个运算符的表达式
-    pattern = r'^[\d\s\+\-\*\/\(\)\.\,\^\%]+$'
-    if re.match(pattern, text):
-        # 进一步检查是否至少包含一个运算符
-        return any(op in text for op in ['+', '-', '*', '/', '(', ')', '^', '%'])
-    return False
+# 消息的词法分类，按顺序匹配：
+#   sign  以+或-开头的入款/出款快捷指令
+#   calc  以"计算"或"calc"开头的计算器命令，分组内容为表达式
+#   math  只包含数字、空白和运算符且至少有一个运算符的数学表达式
+# 普通聊天文本在第一个字符就匹配失败，不产生任何对象
+MESSAGE_CLASSIFIER = re.compile(
+    r'\s*(?:'
+    r'(?P<sign>[+-])'
+    r'|(?:计算|calc)(?P<calc>.*)'
+    r'|(?P<math>(?=[\d.,()^%*/])(?=[^+\-*/()^%]*[+\-*/()^%])[\d\s.,()^%*/+-]+)$'
+    r')',
+    re.DOTALL
+)
+NOT_CLASSIFIED = (None, None)
+
+def classify_message(text):
+    """对消息做一次词法分类，返回 (类型, 内容)：类型为 'sign'/'calc'/'math'，不匹配时返回 (None, None)"""
+    match = MESSAGE_CLASSIFIER.match(text)
+    if match is None:
+        return NOT_CLASSIFIED
+    return match.lastgroup, match.group(match.lastgroup)
 
 def help_command(update: Update, context: CallbackContext) -> None:
     """发送帮助信息"""
@@ -1304,30 +2769,22 @@ def start(update: Update, context: CallbackContext) -> None:
         return
         
     update.message.reply_text('记账机器人已启动，使用 /help 查看命令.')
-
-def generate_chat_all_days_summary(chat_id, chat_title, date_list):
-    """生成指定聊天在最近7天内的账单摘要"""
-    logger.info(f"为聊天 {chat_id} ({chat_title}) 生成最近7天的账单摘要")
-    
-    # 获取该聊天的账单数据
-    chat_data = get_chat_accounting(chat_id)
+
+def iter_chat_all_days_summary_lines(chat_title, date_list, aggregate, rate, fee_rate):
+    """逐行生成指定聊天在最近7天内的账单摘要
     
+    aggregate为aggregate_records按日期分组的结果：总计统计包含aggregate中的全部记录，
+    按日期统计只列出date_list中的日期
+    """
     # 按照用户要求的模板格式生成账单摘要
-    summary_text = f"====== {chat_title} 最近7天账单 ======\n\n"
-    
-    # 计算总体统计数据
-    all_deposits = chat_data['deposits']
-    all_withdrawals = chat_data['withdrawals']
+    yield f"====== {chat_title} 最近7天账单 ======\n\n"
     
-    deposit_total = sum(deposit['amount'] for deposit in all_deposits)
-    deposit_count = len(all_deposits)
+    # 总体统计数据
+    deposit_total = aggregate['deposit_total']
+    deposit_count = aggregate['deposit_count']
     
-    withdrawal_total = sum(withdraw['amount'] for withdraw in all_withdrawals)
-    withdrawal_count = len(all_withdrawals)
-    
-    # 汇率和费率部分
-    rate = chat_data.get('fixed_rate', 1.0)
-    fee_rate = chat_data.get('rate', 0.0)
+    withdrawal_total = aggregate['withdrawal_total']
+    withdrawal_count = aggregate['withdrawal_count']
     
     # 计算实际金额 - 使用除法计算
     actual_amount = deposit_total / rate if rate != 0 else 0
@@ -1337,207 +2794,91 @@ def generate_chat_all_days_summary(chat_id, chat_title, date_list):
     already_withdrawn = withdrawal_total
     not_yet_withdrawn = to_be_withdrawn - already_withdrawn
     
-    # 添加总体统计
-    summary_text += f"总计统计：\n"
-    summary_text += f"总入款：{deposit_count}笔，共计 {deposit_total:.2f}\n"
-    summary_text += f"总下发：{withdrawal_count}笔，共计 {withdrawal_total:.2f}\n"
-    summary_text += f"费率：{fee_rate}%\n"
-    summary_text += f"固定汇率：{rate}\n"
-    summary_text += f"应下发：{to_be_withdrawn:.2f}\n"
-    summary_text += f"已下发：{already_withdrawn:.2f}\n"
-    summary_text += f"未下发：{not_yet_withdrawn:.2f}\n\n"
+    # 总体统计
+    yield f"总计统计：\n"
+    yield f"总入款：{deposit_count}笔，共计 {deposit_total:.2f}\n"
+    yield f"总下发：{withdrawal_count}笔，共计 {withdrawal_total:.2f}\n"
+    yield f"费率：{fee_rate}%\n"
+    yield f"固定汇率：{rate}\n"
+    yield f"应下发：{to_be_withdrawn:.2f}\n"
+    yield f"已下发：{already_withdrawn:.2f}\n"
+    yield f"未下发：{not_yet_withdrawn:.2f}\n\n"
     
     # 为每一天生成单独的统计
-    summary_text += f"按日期统计：\n"
+    yield f"按日期统计：\n"
     
     for date_str in date_list:
-        # 筛选指定日期的记录
-        date_deposits = [d for d in all_deposits if d['time'].split(' ')[0] == date_str]
-        date_withdrawals = [w for w in all_withdrawals if w['time'].split(' ')[0] == date_str]
-        
-        if not date_deposits and not date_withdrawals:
+        day = aggregate['by_date'].get(date_str)
+        if day is None:
             continue  # 如果这一天没有记录，跳过
         
-        # 该日期的统计数据
-        day_deposit_total = sum(deposit['amount'] for deposit in date_deposits)
-        day_deposit_count = len(date_deposits)
+        # 日期标题
+        yield f"\n----- {date_str} -----\n"
+        yield f"入款：{day['deposit_count']}笔，共计 {day['deposit_total']:.2f}\n"
         
-        day_withdrawal_total = sum(withdraw['amount'] for withdraw in date_withdrawals)
-        day_withdrawal_count = len(date_withdrawals)
+        # 每个用户在该日期的入款
+        for username, amount in day['operators'].items():
+            yield f"  {username}: {amount:.2f}\n"
         
-        # 添加日期标题
-        summary_text += f"\n----- {date_str} -----\n"
-        summary_text += f"入款：{day_deposit_count}笔，共计 {day_deposit_total:.2f}\n"
+        yield f"下发：{day['withdrawal_count']}笔，共计 {day['withdrawal_total']:.2f}\n"
         
-        # 统计每个用户在该日期的入款
-        if day_deposit_count > 0:
-            day_user_deposits = {}
-            for deposit in date_deposits:
-                username = deposit['user']
-                amount = deposit['amount']
-                if username not in day_user_deposits:
-                    day_user_deposits[username] = 0
-                day_user_deposits[username] += amount
-            
-            for username, amount in day_user_deposits.items():
-                summary_text += f"  {username}: {amount:.2f}\n"
-        
-        summary_text += f"下发：{day_withdrawal_count}笔，共计 {day_withdrawal_total:.2f}\n"
-        
-        # 统计每个用户在该日期的出款
-        if day_withdrawal_count > 0:
-            day_user_withdrawals = {}
-            for withdrawal in date_withdrawals:
-                username = withdrawal['user']
-                amount = withdrawal['amount']
-                if username not in day_user_withdrawals:
-                    day_user_withdrawals[username] = 0
-                day_user_withdrawals[username] += amount
-            
-            for username, amount in day_user_withdrawals.items():
-                summary_text += f"  {username}: {amount:.2f}\n"
+        # 每个用户在该日期的出款
+        for username, amount in day['user_withdrawals'].items():
+            yield f"  {username}: {amount:.2f}\n"
     
-    # 添加关于导出文件包含详细交易记录的提示
-    summary_text += f"\n注：导出的文件中将包含每笔交易的详细记录。\n"
-    
-    return summary_text
+    # 关于导出文件包含详细交易记录的提示
+    yield f"\n注：导出的文件中将包含每笔交易的详细记录。\n"
 
-def export_chat_all_days_to_txt(chat_id, chat_title, summary_text, date_list):
-    """导出指定聊天在最近7天内的账单数据为TXT文件"""
-    try:
-        # 创建导出目录，如果不存在
-        export_dir = "exports"
-        if not os.path.exists(export_dir):
-            os.makedirs(export_dir)
-        
-        # 创建安全的文件名
-        safe_name = "".join([c if c.isalnum() else "_" for c in chat_title])
-        timestamp = datetime.datetime.now(timezone).strftime("%Y%m%d_%H%M%S")
-        file_path = os.path.join(export_dir, f"{safe_name}_7days_{timestamp}.txt")
-        
-        # 获取该聊天的账单数据
-        chat_data = get_chat_accounting(chat_id)
-        
-        # 准备文件内容
-        content = f"===== {chat_title} 财务账单 =====\n"
-        content += f"导出时间: {datetime.datetime.now(timezone).strftime('%Y-%m-%d %H:%M:%S')}\n\n"
-        
-        # 添加摘要部分
-        content += summary_text + "\n"
-        
-        # 添加明细部分 - 按日期组织
-        all_deposits = chat_data['deposits']
-        all_withdrawals = chat_data['withdrawals']
-        
-        # 汇率
-        rate = chat_data.get('fixed_rate', 1.0)
-        
-        # 按日期组织明细数据
-        content += "\n===== 按日期明细 =====\n"
-        for date_str in date_list:
-            # 筛选指定日期的记录
-            date_deposits = [d for d in all_deposits if d['time'].split(' ')[0] == date_str]
-            date_withdrawals = [w for w in all_withdrawals if w['time'].split(' ')[0] == date_str]
-            
-            if not date_deposits and not date_withdrawals:
-                continue  # 如果这一天没有记录，跳过
-            
-            # 添加日期标题
-            content += f"\n----- {date_str} -----\n"
-            
-            # 入款记录
-            content += "入款:\n"
-            if date_deposits:
-                for i, deposit in enumerate(sorted(date_deposits, key=lambda x: x.get('time', ''), reverse=True), 1):
-                    amount = deposit['amount']
-                    username = deposit['user']
-                    time_str = deposit.get('time', '')
-                    time_parts = time_str.split(' ')
-                    if len(time_parts) > 1:
-                        time_only = time_parts[1]
-                    else:
-                        time_only = "未知时间"
-                    usd_equivalent = amount / rate if rate != 0 else 0
-                    
-                    content += f"  {i}. {time_only}, {username}, {amount:.2f}, USD等值: {usd_equivalent:.2f}\n"
-            else:
-                content += "  暂无入款记录\n"
-            
-            # 出款记录
-            content += "出款:\n"
-            if date_withdrawals:
-                for i, withdrawal in enumerate(sorted(date_withdrawals, key=lambda x: x.get('time', ''), reverse=True), 1):
-                    amount = withdrawal['amount']
-                    username = withdrawal['user']
-                    time_str = withdrawal.get('time', '')
-                    time_parts = time_str.split(' ')
-                    if len(time_parts) > 1:
-                        time_only = time_parts[1]
-                    else:
-                        time_only = "未知时间"
-                    usd_equivalent = withdrawal['usd_equivalent']
-                    
-                    content += f"  {i}. {time_only}, {username}, {amount:.2f}, USD等值: {usd_equivalent:.2f}\n"
-            else:
-                content += "  暂无出款记录\n"
+def iter_chat_all_days_export_lines(chat_title, date_list, aggregate, rate, fee_rate):
+    """逐行生成指定聊天最近7天的导出账单：摘要加按日期的明细"""
+    yield f"===== {chat_title} 财务账单 =====\n"
+    yield f"导出时间: {get_current_timestamp()}\n\n"
+    
+    # 摘要部分
+    yield from iter_chat_all_days_summary_lines(chat_title, date_list, aggregate, rate, fee_rate)
+    yield "\n"
+    
+    # 按日期组织明细数据
+    yield "\n===== 按日期明细 =====\n"
+    for date_str in date_list:
+        day = aggregate['by_date'].get(date_str)
+        if day is None:
+            continue  # 如果这一天没有记录，跳过
         
-        # 写入文件
-        with open(file_path, 'w', encoding='utf-8') as f:
-            f.write(content)
+        # 日期标题
+        yield f"\n----- {date_str} -----\n"
         
-        logger.info(f"已导出群组 {chat_id} 的账单数据到 {file_path}")
-        return file_path
-    except Exception as e:
-        logger.error(f"导出账单数据时出错: {e}", exc_info=True)
-        return None
+        # 入款记录
+        yield "入款:\n"
+        if day['deposits']:
+            for i, deposit in enumerate(sorted(day['deposits'], key=lambda x: x.get('time', ''), reverse=True), 1):
+                amount = deposit['amount']
+                time_parts = deposit.get('time', '').split(' ')
+                time_only = time_parts[1] if len(time_parts) > 1 else "未知时间"
+                usd_equivalent = amount / rate if rate != 0 else 0
+                
+                yield f"  {i}. {time_only}, {deposit['user']}, {amount:.2f}, USD等值: {usd_equivalent:.2f}\n"
+        else:
+            yield "  暂无入款记录\n"
+        
+        # 出款记录
+        yield "出款:\n"
+        if day['withdrawals']:
+            for i, withdrawal in enumerate(sorted(day['withdrawals'], key=lambda x: x.get('time', ''), reverse=True), 1):
+                time_parts = withdrawal.get('time', '').split(' ')
+                time_only = time_parts[1] if len(time_parts) > 1 else "未知时间"
+                
+                yield f"  {i}. {time_only}, {withdrawal['user']}, {withdrawal['amount']:.2f}, USD等值: {withdrawal['usd_equivalent']:.2f}\n"
+        else:
+            yield "  暂无出款记录\n"
 
 # 导出指定日期所有群组的统计数据
-def export_all_groups_statistics(query, context, date_str):
-    """导出指定日期所有群组的统计数据"""
-    logger.info(f"导出 {date_str} 所有群组统计数据")
-    
-    # 创建返回按钮
-    keyboard = [[InlineKeyboardButton("返回", callback_data="first_page")]]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    # 更新消息，表示正在导出
-    query.edit_message_text(f"正在导出 {date_str} 所有群组的统计数据...", reply_markup=reply_markup)
-    
-    # 查找所有在该日期有记录的群组
-    groups_with_records = []
-    for chat_id, chat_data in chat_accounting.items():
-        try:
-            chat = context.bot.get_chat(chat_id)
-            chat_title = chat.title if chat.type in ['group', 'supergroup'] else f"私聊_{chat_id}"
-            
-            # 检查是否有该日期的记录
-            has_records = False
-            
-            # 检查存款记录
-            for deposit in chat_data['deposits']:
-                record_date = deposit['time'].split(' ')[0]
-                if record_date == date_str:
-                    has_records = True
-                    break
-            
-            # 检查提款记录，如果还没有找到记录
-            if not has_records:
-                for withdrawal in chat_data['withdrawals']:
-                    record_date = withdrawal['time'].split(' ')[0]
-                    if record_date == date_str:
-                        has_records = True
-                        break
-            
-            # 如果有该日期的记录，添加到列表
-            if has_records:
-                groups_with_records.append((chat_id, chat_title, chat_data))
-        except Exception as e:
-            logger.error(f"获取群组 {chat_id} 信息时出错: {e}")
+def iter_all_groups_statistics_lines(date_str, groups_with_records, summary):
+    """逐行生成指定日期所有群组的统计报表
     
-    # 如果没有找到任何记录，显示提示消息
-    if not groups_with_records:
-        query.edit_message_text(f"在 {date_str} 没有找到任何群组的记账记录。", reply_markup=reply_markup)
-        return
+    groups_with_records为(群组ID, 群组名称, 每日汇总)列表，summary为跨群统计
+    """
+    chat_titles = {chat_id: chat_title for chat_id, chat_title, _ in groups_with_records}
     
     # 总计统计数据
     total_deposit_amount = 0
@@ -1549,80 +2890,34 @@ def export_all_groups_statistics(query, context, date_str):
     total_not_yet_withdrawn = 0
     
     # 所有用户的总计数据
-    all_operators = {}  # 所有操作人统计
-    all_operators_by_group = {}  # 按群组分类的操作人统计
-    
-    all_responders = {}  # 所有回复人统计
-    all_responders_by_group = {}  # 按群组分类的回复人统计
-    
-    # 生成报表内容
-    timestamp = datetime.datetime.now(timezone).strftime('%Y-%m-%d %H:%M:%S')
-    summary_text = f"📊 {date_str} 所有群组财务统计 📊\n"
-    summary_text += f"导出时间: {timestamp}\n\n"
-    
-    # 确保处理数据和显示都按照用户期望的顺序
-    for chat_id, chat_title, chat_data in groups_with_records:
-        # 筛选该日期的记录
-        date_deposits = [d for d in chat_data['deposits'] if d['time'].split(' ')[0] == date_str]
-        date_withdrawals = [w for w in chat_data['withdrawals'] if w['time'].split(' ')[0] == date_str]
-        
-        # 收集回复人统计数据
-        deposit_by_group = 0  # 该群组的总入款
-        for deposit in date_deposits:
-            # 处理操作人
-            operator = deposit.get('user', '未知操作人')
-            amount = deposit['amount']
-            deposit_by_group += amount
-            
-            # 按群组统计操作人
-            if operator not in all_operators_by_group:
-                all_operators_by_group[operator] = {}
-            if chat_title not in all_operators_by_group[operator]:
-                all_operators_by_group[operator][chat_title] = 0
-            all_operators_by_group[operator][chat_title] += amount
-            
-            # 操作人总计
-            if operator not in all_operators:
-                all_operators[operator] = 0
-            all_operators[operator] += amount
-            
-            # 处理回复人
-            responder = deposit.get('responder', 'None')
-            
-            # 按群组统计回复人
-            if responder not in all_responders_by_group:
-                all_responders_by_group[responder] = {}
-            if chat_title not in all_responders_by_group[responder]:
-                all_responders_by_group[responder][chat_title] = 0
-            all_responders_by_group[responder][chat_title] += amount
-            
-            # 回复人总计
-            if responder not in all_responders:
-                all_responders[responder] = 0
-            all_responders[responder] += amount
+    all_operators = summary['operators']  # 所有操作人统计
+    all_responders = summary['responders']  # 所有回复人统计
     
-    # 按照用户期望的顺序显示群组信息
-    # 这里我们先收集所有群组的数据，然后再显示
-    group_summaries = []
+    # 按群组分类的操作人统计，群组ID换成群组名称（同名群组合并）
+    all_operators_by_group = {}
+    for operator, by_group in summary['operators_by_group'].items():
+        group_amounts = all_operators_by_group.setdefault(operator, {})
+        for chat_id, amount in by_group.items():
+            chat_title = chat_titles.get(chat_id, f"群组_{chat_id}")
+            group_amounts[chat_title] = group_amounts.get(chat_title, 0) + amount
     
-    for chat_id, chat_title, chat_data in groups_with_records:
-        group_summary = f"[{chat_title}]\n"
-        
-        # 筛选该日期的记录
-        date_deposits = [d for d in chat_data['deposits'] if d['time'].split(' ')[0] == date_str]
-        date_withdrawals = [w for w in chat_data['withdrawals'] if w['time'].split(' ')[0] == date_str]
-        
+    timestamp = get_current_timestamp()
+    yield f"📊 {date_str} 所有群组财务统计 📊\n"
+    yield f"导出时间: {timestamp}\n\n"
+    
+    # 按照用户期望的顺序显示群组信息
+    for chat_id, chat_title, rollup in groups_with_records:
         # 汇率和费率部分
-        rate = chat_data.get('fixed_rate', 1.0)
-        fee_rate = chat_data.get('rate', 0.0)
+        rate = rollup['fixed_rate']
+        fee_rate = rollup['rate']
         
-        # 计算统计数据
-        deposit_total = sum(deposit['amount'] for deposit in date_deposits)
-        deposit_count = len(date_deposits)
+        # 统计数据
+        deposit_total = rollup['deposit_total']
+        deposit_count = rollup['deposit_count']
         
-        withdrawal_total_local = sum(withdraw['amount'] for withdraw in date_withdrawals)
-        withdrawal_total_usdt = sum(withdraw['usd_equivalent'] for withdraw in date_withdrawals)
-        withdrawal_count = len(date_withdrawals)
+        withdrawal_total_local = rollup['withdrawal_total']
+        withdrawal_total_usdt = rollup['withdrawal_usdt']
+        withdrawal_count = rollup['withdrawal_count']
         
         # 计算实际金额
         actual_amount = deposit_total / rate if rate != 0 else 0
@@ -1642,164 +2937,221 @@ def export_all_groups_statistics(query, context, date_str):
         total_not_yet_withdrawn += not_yet_withdrawn
         
         # 简洁模式：只显示基本信息
-        group_summary += f"费率：{fee_rate}%\n"
-        group_summary += f"固定汇率：{rate}\n"
-        group_summary += f"总入款：{deposit_total:.1f}\n"
-        group_summary += f"应下发：{deposit_total:.1f}｜{to_be_withdrawn:.2f}U\n"
-        group_summary += f"已下发：{withdrawal_total_local:.1f}｜{already_withdrawn:.2f}U\n"
-        group_summary += f"未下发：{deposit_total-withdrawal_total_local:.1f}｜{not_yet_withdrawn:.2f}U\n\n"
-        
-        group_summaries.append(group_summary)
+        yield f"[{chat_title}]\n"
+        yield f"费率：{fee_rate}%\n"
+        yield f"固定汇率：{rate}\n"
+        yield f"总入款：{deposit_total:.1f}\n"
+        yield f"应下发：{deposit_total:.1f}｜{to_be_withdrawn:.2f}U\n"
+        yield f"已下发：{withdrawal_total_local:.1f}｜{already_withdrawn:.2f}U\n"
+        yield f"未下发：{deposit_total-withdrawal_total_local:.1f}｜{not_yet_withdrawn:.2f}U\n\n"
     
-    # 将所有群组信息添加到摘要中
-    for group_summary in group_summaries:
-        summary_text += group_summary
-    
-    # 添加所有群组的总计统计
-    summary_text += "\n📊 所有群组总计统计 📊\n\n"
+    # 所有群组的总计统计
+    yield "\n📊 所有群组总计统计 📊\n\n"
     
     # 按操作人统计
-    summary_text += "👨‍💼 操作人总统计\n"
-    summary_text += "━━━━━━━━━━━━━━━━━━━━━━━━━━━━\n"
+    yield "👨‍💼 操作人总统计\n"
+    yield "━━━━━━━━━━━━━━━━━━━━━━━━━━━━\n"
     if all_operators:
         for operator, total_amount in sorted(all_operators.items(), key=lambda x: x[1], reverse=True):
             # 先显示操作人的总金额
-            summary_text += f"• {operator}: {total_amount:.2f}\n"
+            yield f"• {operator}: {total_amount:.2f}\n"
             
             # 显示该操作人在每个群组的入款金额
             if operator in all_operators_by_group:
-                groups_with_amounts = []
-                for group_name, amount in all_operators_by_group[operator].items():
-                    groups_with_amounts.append(f"{group_name}: {amount:.2f}")
-                
-                group_amounts_str = ", ".join(groups_with_amounts)
-                summary_text += f"  📋 群组: {group_amounts_str}\n"
+                group_amounts_str = ", ".join(f"{group_name}: {amount:.2f}" for group_name, amount in all_operators_by_group[operator].items())
+                yield f"  📋 群组: {group_amounts_str}\n"
     else:
-        summary_text += "暂无操作记录\n"
+        yield "暂无操作记录\n"
     
     # 按回复人统计 - 这里按照用户的示例格式：每个回复人单独一行，不显示群组明细
-    summary_text += "\n👤 回复人总统计\n"
-    summary_text += "━━━━━━━━━━━━━━━━━━━━━━━━━━━━\n"
+    yield "\n👤 回复人总统计\n"
+    yield "━━━━━━━━━━━━━━━━━━━━━━━━━━━━\n"
     if all_responders:
         for responder, total_amount in sorted(all_responders.items(), key=lambda x: x[1], reverse=True):
             # 只显示回复人和总金额，不包含群组详情
-            summary_text += f"• {responder} {total_amount:.2f}\n"
+            yield f"• {responder} {total_amount:.2f}\n"
     else:
-        summary_text += "暂无回复记录\n"
+        yield "暂无回复记录\n"
     
     # 总计统计
-    summary_text += "\n📈 总计统计\n"
-    summary_text += "━━━━━━━━━━━━━━━━━━━━━━━━━━━━\n"
-    summary_text += f"• 群组数量: {len(groups_with_records)}\n"
-    summary_text += f"• 总入款: {total_deposit_count}笔，{total_deposit_amount:.2f}\n"
-    summary_text += f"• 总出款: {total_withdrawal_count}笔，{total_withdrawal_amount_local:.2f}\n"
-    summary_text += f"• 总应下发: {total_to_be_withdrawn:.2f}\n"
-    summary_text += f"• 总未下发: {total_not_yet_withdrawn:.2f}\n"
-    
-    # 导出为TXT文件
-    file_path = export_all_groups_statistics_to_txt(date_str, summary_text, groups_with_records)
-    
-    # 发送文件给用户
-    if file_path:
+    yield "\n📈 总计统计\n"
+    yield "━━━━━━━━━━━━━━━━━━━━━━━━━━━━\n"
+    yield f"• 群组数量: {len(groups_with_records)}\n"
+    yield f"• 总入款: {total_deposit_count}笔，{total_deposit_amount:.2f}\n"
+    yield f"• 总出款: {total_withdrawal_count}笔，{total_withdrawal_amount_local:.2f}\n"
+    yield f"• 总应下发: {total_to_be_withdrawn:.2f}\n"
+    yield f"• 总未下发: {total_not_yet_withdrawn:.2f}\n"
+
+@timed_route
+def export_all_groups_statistics(query, context, date_str, stats=None):
+    """导出指定日期所有群组的统计数据，stats为调用方已经取得的该日期统计"""
+    logger.info(f"导出 {date_str} 所有群组统计数据")
+    
+    # 创建返回按钮
+    keyboard = [[InlineKeyboardButton("返回", callback_data="first_page")]]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    
+    # 更新消息，表示正在导出
+    query.edit_message_text(f"正在导出 {date_str} 所有群组的统计数据...", reply_markup=reply_markup)
+    
+    # 使用预先生成的统计：当日为增量维护的统计，已结束的日期为归档时生成的统计
+    if stats is None:
+        stats = get_daily_stats(date_str)
+    
+    # 查找所有在该日期有记录的群组
+    groups_with_records = []
+    for chat_id, rollup in stats['chats'].items():
         try:
-            with open(file_path, 'rb') as file:
-                context.bot.send_document(
-                    chat_id=query.message.chat_id,
-                    document=file,
-                    filename=f"{date_str}_所有群组统计.txt",
-                    caption=f"{date_str} 所有群组财务统计导出文件"
-                )
-            logger.info(f"已导出 {date_str} 所有群组统计数据到 {file_path}")
-            
-            # 更新消息，表示导出成功
-            query.edit_message_text(f"已成功导出 {date_str} 所有群组的统计数据", reply_markup=reply_markup)
+            chat = context.bot.get_chat(chat_id)
+            chat_title = chat.title if chat.type in ['group', 'supergroup'] else f"私聊_{chat_id}"
         except Exception as e:
-            logger.error(f"发送文件时出错: {e}", exc_info=True)
-            query.edit_message_text(f"导出统计数据时出错: {str(e)}", reply_markup=reply_markup)
-    else:
-        # 更新消息，表示导出失败
-        query.edit_message_text(f"未能导出 {date_str} 所有群组的统计数据", reply_markup=reply_markup)
-
-# 导出所有群组统计数据为TXT文件
-def export_all_groups_statistics_to_txt(date_str, summary_text, groups_with_records):
-    """导出所有群组在指定日期的统计数据为TXT文件"""
+            # 机器人已不在该群组时仍保留其统计，避免总计缺失
+            logger.error(f"获取群组 {chat_id} 信息时出错: {e}")
+            chat_title = f"群组_{chat_id}"
+        groups_with_records.append((chat_id, chat_title, rollup))
+    
+    # 如果没有找到任何记录，显示提示消息
+    if not groups_with_records:
+        query.edit_message_text(f"在 {date_str} 没有找到任何群组的记账记录。", reply_markup=reply_markup)
+        return
+    
+    # 生成报表并发送给用户
     try:
-        # 创建导出目录，如果不存在
-        export_dir = "exports"
-        if not os.path.exists(export_dir):
-            os.makedirs(export_dir)
-        
-        # 创建文件名
-        timestamp = datetime.datetime.now(timezone).strftime("%Y%m%d_%H%M%S")
-        file_path = os.path.join(export_dir, f"all_groups_{date_str}_{timestamp}.txt")
-        
-        # 使用与在线视图完全相同的格式（直接使用已经格式化好的summary_text）
-        content = summary_text
-        
-        # 写入文件
-        with open(file_path, 'w', encoding='utf-8') as f:
-            f.write(content)
+        send_report_document(
+            context.bot,
+            query.message.chat_id,
+            iter_all_groups_statistics_lines(date_str, groups_with_records, stats['summary']),
+            filename=f"{date_str}_所有群组统计.txt",
+            caption=f"{date_str} 所有群组财务统计导出文件"
+        )
+        logger.info(f"已导出 {date_str} 所有群组统计数据")
         
-        return file_path
+        # 更新消息，表示导出成功，并提供对账用的数据格式
+        keyboard = [
+            [InlineKeyboardButton(f"导出{name}", callback_data=f"data_{data_format}_stats_{date_str}")
+             for data_format, name in DATA_FORMAT_NAMES.items()],
+            [InlineKeyboardButton("返回", callback_data="first_page")],
+        ]
+        query.edit_message_text(f"已成功导出 {date_str} 所有群组的统计数据", reply_markup=InlineKeyboardMarkup(keyboard))
     except Exception as e:
         logger.error(f"导出 {date_str} 所有群组统计数据时出错: {e}", exc_info=True)
-        return None
+        query.edit_message_text(f"导出统计数据时出错: {str(e)}", reply_markup=reply_markup)
 
-# 添加导出当前账单的函数
-def export_current_bill(query, context, chat_id):
-    """导出当前聊天的账单为txt文件"""
-    logger.info(f"导出聊天 {chat_id} 的账单")
+@timed_route
+def export_all_groups_statistics_data(query, context, date_str, data_format):
+    """以CSV或列存格式导出指定日期各群组的统计，直接使用每日汇总"""
+    logger.info(f"以 {data_format} 格式导出 {date_str} 所有群组统计数据")
+    
+    keyboard = [[InlineKeyboardButton("返回", callback_data="first_page")]]
+    reply_markup = InlineKeyboardMarkup(keyboard)
     
     try:
-        # 获取聊天信息
-        chat = context.bot.get_chat(chat_id)
-        chat_title = chat.title if chat.type in ['group', 'supergroup'] else "私聊"
-        
-        # 生成账单摘要
-        summary_text = generate_group_summary(chat_title)
-        
-        # 只答复点击，不修改原消息
-        query.answer("正在生成账单文件...")
-        
-        # 导出为TXT文件
-        file_path = export_group_data_to_txt(chat_title, summary_text)
-        
-        # 发送文件给用户
-        if file_path:
-            with open(file_path, 'rb') as file:
-                context.bot.send_document(
-                    chat_id=query.message.chat_id,
-                    document=file,
-                    filename=f"{chat_title}_账单.txt",
-                    caption=f"{chat_title} 财务账单导出文件"
-                )
-            logger.info(f"已导出 {chat_title} 的账单数据到 {file_path}")
-        else:
-            # 发送失败消息
-            context.bot.send_message(
-                chat_id=query.message.chat_id,
-                text=f"未能导出 {chat_title} 的账单数据"
-            )
+        groups_with_records = []
+        for chat_id, rollup in get_daily_stats(date_str)['chats'].items():
+            try:
+                chat = context.bot.get_chat(chat_id)
+                chat_title = chat.title if chat.type in ['group', 'supergroup'] else f"私聊_{chat_id}"
+            except Exception as e:
+                logger.error(f"获取群组 {chat_id} 信息时出错: {e}")
+                chat_title = f"群组_{chat_id}"
+            groups_with_records.append((chat_id, chat_title, rollup))
+        
+        send_data_document(
+            context.bot,
+            query.message.chat_id,
+            data_format,
+            GROUP_STATS_COLUMNS,
+            iter_group_stats_rows(date_str, groups_with_records),
+            filename=f"{date_str}_所有群组统计",
+            caption=f"{date_str} 所有群组统计（{DATA_FORMAT_NAMES[data_format]}）",
+            metadata={'date': date_str}
+        )
+        query.edit_message_text(f"已成功导出 {date_str} 所有群组的统计数据（{DATA_FORMAT_NAMES[data_format]}）", reply_markup=reply_markup)
     except Exception as e:
-        logger.error(f"导出账单时出错: {e}", exc_info=True)
-        context.bot.send_message(
-            chat_id=query.message.chat_id,
-            text=f"导出账单时出错: {str(e)}"
+        logger.error(f"导出 {date_str} 所有群组统计数据时出错: {e}", exc_info=True)
+        query.edit_message_text(f"导出统计数据时出错: {str(e)}", reply_markup=reply_markup)
+
+@timed_route
+def export_all_groups_zip(query, context, date_str):
+    """把指定日期所有群组的详细账单打包成一个ZIP导出，各群组的账单由工作池并行生成"""
+    logger.info(f"打包导出 {date_str} 所有群组账单")
+    
+    keyboard = [[InlineKeyboardButton("返回群组选择", callback_data=f"back_to_groups_for_date_{date_str}")]]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    
+    # 查找在该日期有记录的群组（包括已归档的记录）
+    groups = []
+    for chat_id in get_daily_stats(date_str)['chats']:
+        try:
+            chat = context.bot.get_chat(chat_id)
+            chat_title = chat.title if chat.type in ['group', 'supergroup'] else f"私聊_{chat_id}"
+        except Exception as e:
+            logger.error(f"获取群组 {chat_id} 信息时出错: {e}")
+            chat_title = f"群组_{chat_id}"
+        groups.append((chat_id, chat_title))
+    
+    if not groups:
+        query.edit_message_text(f"在 {date_str} 没有找到任何群组的记账记录。", reply_markup=reply_markup)
+        return
+    
+    query.edit_message_text(f"正在打包 {date_str} 所有群组的账单... 0/{len(groups)}", reply_markup=reply_markup)
+    
+    last_update = time.monotonic()
+    def report_progress(done, total):
+        nonlocal last_update
+        now = time.monotonic()
+        if done == total or now - last_update < EXPORT_PROGRESS_INTERVAL:
+            return
+        last_update = now
+        try:
+            query.edit_message_text(f"正在打包 {date_str} 所有群组的账单... {done}/{total}", reply_markup=reply_markup)
+        except Exception as e:
+            logger.warning(f"更新打包进度时出错: {e}")
+    
+    try:
+        start = time.perf_counter()
+        executor = get_export_executor()
+        buffer = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_MAX_SIZE)
+        try:
+            workers = EXPORT_ZIP_WORKERS or os.cpu_count() or 1
+            write_groups_zip(buffer, date_str, groups, executor, workers * 2, report_progress)
+            buffer.seek(0)
+        except Exception as e:
+            buffer.close()
+            if isinstance(e, concurrent.futures.BrokenExecutor):
+                discard_export_executor(executor)
+            raise
+        logger.info(f"已打包 {len(groups)} 个群组的 {date_str} 账单，耗时 {time.perf_counter() - start:.2f} 秒")
+        
+        send_buffer_document(
+            context.bot,
+            query.message.chat_id,
+            buffer,
+            filename=f"{date_str}_所有群组账单.zip",
+            caption=f"{date_str} 所有群组账单（{len(groups)}个群组）"
         )
+        
+        query.edit_message_text(f"已成功导出 {date_str} 所有群组的账单（{len(groups)}个群组）", reply_markup=reply_markup)
+    except Exception as e:
+        logger.error(f"打包导出 {date_str} 所有群组账单时出错: {e}", exc_info=True)
+        query.edit_message_text(f"打包导出账单时出错: {str(e)}", reply_markup=reply_markup)
 
-def generate_group_summary(group_name):
-    """生成指定群组的账单摘要"""
+def generate_group_summary(group_name, bot=None):
+    """生成指定群组的账单摘要，bot用于按群名查找聊天ID，处理更新时传入context.bot；
+    未提供时在第一次查询聊天信息时创建一个
+    """
     logger.info(f"为群组 '{group_name}' 生成账单摘要")
     
     # 查找对应的聊天ID
     chat_id = None
     chat_data = None
     for cid, data in chat_accounting.items():
+        # 所有聊天共用一个Bot（及其连接池），不再每个聊天创建一个
+        if bot is None:
+            bot = Bot(token=BOT_TOKEN, base_url=BOT_API_BASE_URL)
         try:
             chat = None
             try:
-                from telegram import Bot
-                bot = Bot(token=BOT_TOKEN)
                 chat = bot.get_chat(cid)
                 if chat.type in ['group', 'supergroup'] and chat.title == group_name:
                     chat_id = cid
@@ -1808,316 +3160,24 @@ def generate_group_summary(group_name):
             except:
                 # 如果无法获取聊天信息，则跳过
                 continue
-        except Exception as e:
-            logger.error(f"检查聊天ID {cid} 时出错: {e}")
-    
-    if chat_id is None or chat_data is None:
-        # 如果没有找到匹配的聊天ID，返回一个默认消息
-        return f"群组 '{group_name}' 尚无记账数据。"
-    
-    # 从这里开始生成实际的账单摘要
-    # 收款部分
-    deposit_total = sum(deposit['amount'] for deposit in chat_data['deposits'])
-    deposit_count = len(chat_data['deposits'])
-    
-    # 统计每个用户的入款
-    user_deposits = {}
-    for deposit in chat_data['deposits']:
-        username = deposit['user']
-        amount = deposit['amount']
-        if username not in user_deposits:
-            user_deposits[username] = 0
-        user_deposits[username] += amount
-    
-    # 统计以回复用户为分类的入款信息
-    responder_deposits = {}
-    for deposit in chat_data['deposits']:
-        # 只处理有回复者信息的记录
-        if 'responder' in deposit and deposit['responder']:
-            responder = deposit['responder']
-            username = deposit['user']
-            amount = deposit['amount']
-            
-            # 创建或更新此回复者的记录
-            if responder not in responder_deposits:
-                responder_deposits[responder] = {'total': 0, 'users': {}}
-            
-            responder_deposits[responder]['total'] += amount
-            
-            # 记录是哪个用户对这个回复者进行了入款
-            if username not in responder_deposits[responder]['users']:
-                responder_deposits[responder]['users'][username] = 0
-            responder_deposits[responder]['users'][username] += amount
-    
-    # 计算用户分类数量
-    user_count = len(chat_data['users'])
-    responder_count = len(responder_deposits)
-    
-    # 汇率和费率部分
-    rate = chat_data.get('fixed_rate', 1.0)
-    fee_rate = chat_data.get('rate', 0.0)
-    
-    # 计算实际金额 - 使用除法计算
-    actual_amount = deposit_total / rate if rate != 0 else 0
-    
-    # 出款部分 - 从withdrawals中提取USDT金额(usd_equivalent)
-    withdrawal_total_local = sum(withdraw['amount'] for withdraw in chat_data['withdrawals'])
-    withdrawal_total_usdt = sum(withdraw['usd_equivalent'] for withdraw in chat_data['withdrawals'])
-    withdrawal_count = len(chat_data['withdrawals'])
-    
-    # 计算应下发金额（USDT）
-    to_be_withdrawn = actual_amount
-    already_withdrawn = withdrawal_total_usdt
-    not_yet_withdrawn = to_be_withdrawn - already_withdrawn
-    
-    # 按照用户要求的模板格式生成账单摘要
-    summary_text = f"====== {group_name} ======\n\n"
-    
-    summary_text += f"入款（{deposit_count}笔）：\n"
-    if deposit_count > 0:
-        # 按时间排序，最新的在前面
-        sorted_deposits = sorted(chat_data['deposits'], key=lambda x: x.get('time', ''), reverse=True)
-        # 获取最新的6笔入款记录
-        latest_deposits = sorted_deposits[:6]
-        
-        # 显示每个入款记录及其回复人
-        for deposit in latest_deposits:
-            amount = deposit['amount']
-            # 计算美元等值：金额除以汇率
-            usd_equivalent = amount / rate if rate != 0 else 0
-            responder = deposit.get('responder', '无回复人')
-            
-            # 提取时间戳中的小时和分钟
-            time_str = deposit.get('time', '')
-            time_parts = time_str.split(' ')
-            if len(time_parts) > 1:
-                time_part = time_parts[1]  # 获取时间部分 (HH:MM:SS)
-                hour_min = ':'.join(time_part.split(':')[:2])  # 只保留小时和分钟
-            else:
-                hour_min = "00:00"  # 默认时间
-                
-            # 使用新的格式: HH:MM 金额/汇率 =美元等值 回复人
-            responder_display = "" if responder is None or responder == "None" else responder
-            summary_text += f"  {hour_min} {amount:.0f}/{rate} ={usd_equivalent:.2f} {responder_display}\n"
-    else:
-        summary_text += "  暂无入金\n"
-    
-    summary_text += f"\n分类（{responder_count}人）：\n"
-    if responder_count > 0:
-        for responder, data in responder_deposits.items():
-            total_amount = data['total']
-            # 对于每个回复者，只显示总金额，不显示来源
-            summary_text += f"  {responder} {total_amount:.2f}\n"
-    else:
-        summary_text += "  暂无分类\n"
-    
-    summary_text += f"\n下发（{withdrawal_count}笔）：\n"
-    if withdrawal_count > 0:
-        user_withdrawals = {}
-        for withdrawal in chat_data['withdrawals']:
-            username = withdrawal['user']
-            # 使用USDT金额而不是本地货币
-            amount = withdrawal['usd_equivalent']
-            if username not in user_withdrawals:
-                user_withdrawals[username] = 0
-            user_withdrawals[username] += amount
-        
-        for username, amount in user_withdrawals.items():
-            summary_text += f"  {username}: {amount:.2f}\n"
-    else:
-        summary_text += "  暂无下发\n"
-    
-    summary_text += f"\n费率：{fee_rate}%\n"
-    summary_text += f"固定汇率：{rate}\n"
-    summary_text += f"总入款：{deposit_total:.2f}\n"
-    summary_text += f"应下发：{deposit_total:.2f}｜{to_be_withdrawn:.2f}U\n"
-    summary_text += f"已下发：{withdrawal_total_local:.2f}｜{already_withdrawn:.2f}U\n"
-    summary_text += f"未下发：{deposit_total-withdrawal_total_local:.2f}｜{not_yet_withdrawn:.2f}U\n"
-    
-    # 添加提示信息，告知用户导出的账单中将包含明细
-    summary_text += f"\n点击 [详细账单] 按钮导出完整账单，包含所有交易明细。\n"
-    
-    return summary_text
-
-def export_group_data_to_txt(group_name, summary_text):
-    """导出群组账单数据为TXT文件"""
-    try:
-        # 创建导出目录，如果不存在
-        export_dir = "exports"
-        if not os.path.exists(export_dir):
-            os.makedirs(export_dir)
-        
-        # 创建安全的文件名
-        safe_name = "".join([c if c.isalnum() else "_" for c in group_name])
-        timestamp = datetime.datetime.now(timezone).strftime("%Y%m%d_%H%M%S")
-        file_path = os.path.join(export_dir, f"{safe_name}_{timestamp}.txt")
-        
-        # 准备文件内容
-        content = f"===== {group_name} 财务账单 =====\n"
-        content += f"导出时间: {datetime.datetime.now(timezone).strftime('%Y-%m-%d %H:%M:%S')}\n\n"
-        
-        # 添加摘要数据
-        content += summary_text
-        
-        # 写入文件
-        with open(file_path, 'w', encoding='utf-8') as f:
-            f.write(content)
-        
-        return file_path
-    except Exception as e:
-        logger.error(f"导出群组数据时出错: {e}", exc_info=True)
-        return None
-
-def summary(update: Update, context: CallbackContext) -> None:
-    """Show accounting summary."""
-    if not is_authorized(update):
-        return
-        
-    chat_id = update.effective_chat.id
-    chat_type = update.effective_chat.type
-    chat_title = getattr(update.effective_chat, 'title', 'Private Chat')
-    
-    logger.info(f"生成聊天 {chat_id} ({chat_title}) 账单摘要")
-    
-    # 获取该聊天的账单数据
-    chat_data = get_chat_accounting(chat_id)
-    
-    # 收款部分
-    deposit_total = sum(deposit['amount'] for deposit in chat_data['deposits'])
-    deposit_count = len(chat_data['deposits'])
-    
-    # 统计每个用户的入款
-    user_deposits = {}
-    for deposit in chat_data['deposits']:
-        username = deposit['user']
-        amount = deposit['amount']
-        if username not in user_deposits:
-            user_deposits[username] = 0
-        user_deposits[username] += amount
-    
-    # 统计以回复用户为分类的入款信息
-    responder_deposits = {}
-    for deposit in chat_data['deposits']:
-        # 只处理有回复者信息的记录
-        if 'responder' in deposit and deposit['responder']:
-            responder = deposit['responder']
-            username = deposit['user']
-            amount = deposit['amount']
-            
-            # 创建或更新此回复者的记录
-            if responder not in responder_deposits:
-                responder_deposits[responder] = {'total': 0, 'users': {}}
-            
-            responder_deposits[responder]['total'] += amount
-            
-            # 记录是哪个用户对这个回复者进行了入款
-            if username not in responder_deposits[responder]['users']:
-                responder_deposits[responder]['users'][username] = 0
-            responder_deposits[responder]['users'][username] += amount
+        except Exception as e:
+            logger.error(f"检查聊天ID {cid} 时出错: {e}")
     
-    # 计算用户分类数量
-    user_count = len(chat_data['users'])
-    responder_count = len(responder_deposits)
+    if chat_id is None or chat_data is None:
+        # 如果没有找到匹配的聊天ID，返回一个默认消息
+        return f"群组 '{group_name}' 尚无记账数据。"
     
     # 汇率和费率部分
     rate = chat_data.get('fixed_rate', 1.0)
     fee_rate = chat_data.get('rate', 0.0)
     
-    # 计算实际金额 - 使用除法计算
-    actual_amount = deposit_total / rate if rate != 0 else 0
-    
-    # 出款部分 - 从withdrawals中提取USDT金额(usd_equivalent)
-    withdrawal_total_local = sum(withdraw['amount'] for withdraw in chat_data['withdrawals'])
-    withdrawal_total_usdt = sum(withdraw['usd_equivalent'] for withdraw in chat_data['withdrawals'])
-    withdrawal_count = len(chat_data['withdrawals'])
-    
-    # 计算应下发金额（USDT）
-    to_be_withdrawn = actual_amount
-    already_withdrawn = withdrawal_total_usdt
-    not_yet_withdrawn = to_be_withdrawn - already_withdrawn
-    
     # 按照用户要求的模板格式生成账单摘要
-    summary_text = f"====== {chat_title} ======\n\n"
-    
-    summary_text += f"入款（{deposit_count}笔）：\n"
-    if deposit_count > 0:
-        # 按时间排序，最新的在前面
-        sorted_deposits = sorted(chat_data['deposits'], key=lambda x: x.get('time', ''), reverse=True)
-        # 获取最新的6笔入款记录
-        latest_deposits = sorted_deposits[:6]
-        
-        # 显示每个入款记录及其回复人
-        for deposit in latest_deposits:
-            amount = deposit['amount']
-            # 计算美元等值：金额除以汇率
-            usd_equivalent = amount / rate if rate != 0 else 0
-            responder = deposit.get('responder', '无回复人')
-            
-            # 提取时间戳中的小时和分钟
-            time_str = deposit.get('time', '')
-            time_parts = time_str.split(' ')
-            if len(time_parts) > 1:
-                time_part = time_parts[1]  # 获取时间部分 (HH:MM:SS)
-                hour_min = ':'.join(time_part.split(':')[:2])  # 只保留小时和分钟
-            else:
-                hour_min = "00:00"  # 默认时间
-                
-            # 使用新的格式: HH:MM 金额/汇率 =美元等值 回复人
-            responder_display = "" if responder is None or responder == "None" else responder
-            summary_text += f"  {hour_min} {amount:.0f}/{rate} ={usd_equivalent:.2f} {responder_display}\n"
-    else:
-        summary_text += "  暂无入金\n"
-    
-    summary_text += f"\n分类（{responder_count}人）：\n"
-    if responder_count > 0:
-        for responder, data in responder_deposits.items():
-            total_amount = data['total']
-            # 简化显示格式，只显示回复者和金额
-            summary_text += f"  {responder} {total_amount:.2f}\n"
-    else:
-        summary_text += "  暂无分类\n"
-    
-    summary_text += f"\n下发（{withdrawal_count}笔）：\n"
-    if withdrawal_count > 0:
-        user_withdrawals = {}
-        for withdrawal in chat_data['withdrawals']:
-            username = withdrawal['user']
-            # 使用USDT金额而不是本地货币
-            amount = withdrawal['usd_equivalent']
-            if username not in user_withdrawals:
-                user_withdrawals[username] = 0
-            user_withdrawals[username] += amount
-        
-        for username, amount in user_withdrawals.items():
-            summary_text += f"  {username}: {amount:.2f}\n"
-    else:
-        summary_text += "  暂无下发\n"
+    summary_text = format_bill_summary(group_name, aggregate_records([chat_data]), rate, fee_rate)
     
-    summary_text += f"\n费率：{fee_rate}%\n"
-    summary_text += f"固定汇率：{rate}\n"
-    summary_text += f"总入款：{deposit_total:.2f}\n"
-    summary_text += f"应下发：{deposit_total:.2f}｜{to_be_withdrawn:.2f}U\n"
-    summary_text += f"已下发：{withdrawal_total_local:.2f}｜{already_withdrawn:.2f}U\n"
-    summary_text += f"未下发：{deposit_total-withdrawal_total_local:.2f}｜{not_yet_withdrawn:.2f}U\n"
+    # 添加提示信息，告知用户导出的账单中将包含明细
+    summary_text += f"\n点击 [详细账单] 按钮导出完整账单，包含所有交易明细。\n"
     
-    try:
-        # 创建账单按钮
-        keyboard = [[InlineKeyboardButton("详细账单", callback_data=f"export_bill_{chat_id}")]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        # 使用reply_text确保消息总是发送，不管是否在群组中
-        update.message.reply_text(summary_text, reply_markup=reply_markup)
-        logger.info(f"已显示账单摘要，字符长度: {len(summary_text)}")
-    except Exception as e:
-        logger.error(f"发送账单摘要时出错: {e}", exc_info=True)
-        try:
-            # 尝试使用bot.send_message作为备选方案
-            keyboard = [[InlineKeyboardButton("详细账单", callback_data=f"export_bill_{chat_id}")]]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            context.bot.send_message(chat_id=chat_id, text=summary_text, reply_markup=reply_markup)
-            logger.info(f"使用备选方法发送账单摘要成功")
-        except Exception as e2:
-            logger.error(f"备选方法发送账单摘要也失败: {e2}", exc_info=True)
+    return summary_text
 
 def reset_command(update: Update, context: CallbackContext) -> None:
     """手动重置账单"""
@@ -2142,149 +3202,7 @@ def set_admin(update: Update, context: CallbackContext) -> None:
     else:
         update.message.reply_text('管理员已经设置，无法更改')
 
-def button_callback(update: Update, context: CallbackContext) -> None:
-    """Handle button callbacks from inline keyboards."""
-    query = update.callback_query
-    data = query.data
-    
-    logger.info(f"收到按钮回调: {data}")
-    
-    # 确保回调处理后通知Telegram
-    query.answer()
-    
-    # 处理导出当前账单按钮
-    if data.startswith("export_bill_"):
-        chat_id = int(data.split("_")[2])
-        export_current_bill(query, context, chat_id)
-        return
-    
-    # 处理特定日期导出按钮 ("导出全部账单"命令的日期选择)
-    if data.startswith("export_date_"):
-        parts = data.split("_")
-        # 处理返回到日期选择的情况
-        if parts[2] == "back":
-            chat_id = int(parts[3])
-            # 获取最近7天的日期列表，生成选择界面
-            dates = []
-            for i in range(7):
-                date = (datetime.datetime.now(timezone) - datetime.timedelta(days=i)).strftime('%Y-%m-%d')
-                dates.append(date)
-            
-            # 创建日期选择按钮
-            keyboard = []
-            row = []
-            for i, date in enumerate(dates):
-                row.append(InlineKeyboardButton(date, callback_data=f"export_date_{date}_{chat_id}"))
-                if (i + 1) % 2 == 0 or i == len(dates) - 1:  # 每两个日期一行，或者是最后一个日期
-                    keyboard.append(row)
-                    row = []
-            
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
-            # 更新消息，显示日期选择
-            query.edit_message_text("请选择要导出的日期:", reply_markup=reply_markup)
-            return
-        else:
-            # 正常处理导出指定日期数据
-            date_str = parts[2]
-            chat_id = int(parts[3])
-            export_specific_date_for_chat(query, context, date_str, chat_id)
-            return
-    
-    # 处理菜单的第一页
-    if data == "first_page":
-        keyboard = [
-            [InlineKeyboardButton("查看所有群组当日统计", callback_data="all_groups_today")],
-            [InlineKeyboardButton("按日期查看所有群组", callback_data="all_groups_by_date")],
-            [InlineKeyboardButton("查看当前群组7天账单", callback_data="current_group_7days")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        query.edit_message_text("请选择要查看的账单类型:", reply_markup=reply_markup)
-        return
-    
-    # 处理"查看所有群组当日统计"按钮
-    if data == "all_groups_today":
-        # 获取当前日期
-        current_date = get_current_date()
-        export_all_groups_statistics(query, context, current_date)
-        return
-    
-    # 处理"按日期查看所有群组"按钮
-    if data == "all_groups_by_date":
-        send_date_selection(query, context)
-        return
-    
-    # 处理"查看当前群组7天账单"按钮
-    if data == "current_group_7days":
-        # 获取当前聊天ID
-        chat_id = query.message.chat_id
-        export_current_group_all_bills(query, context)
-        return
-    
-    # 处理日期选择按钮
-    if data.startswith("date_"):
-        date_str = data.split("_")[1]
-        # 获取该日期的所有群组信息
-        send_group_selection_for_date(query, context, date_str)
-        return
-    
-    # 处理日期选择按钮 (来自财务查账命令)
-    if data.startswith("select_date_"):
-        date_str = data.split("_")[2]
-        handle_date_selection(query, context, date_str)
-        return
-    
-    # 处理群组选择按钮
-    if data.startswith("group_"):
-        parts = data.split("_")
-        group_id = int(parts[1])
-        date_str = parts[2] if len(parts) > 2 else None
-        
-        if date_str:
-            # 如果提供了日期，导出该日期的群组账单
-            export_group_by_selected_date(query, context, group_id)
-        else:
-            # 否则，导出当前群组账单
-            export_current_bill(query, context, group_id)
-        return
-    
-    # 处理返回按钮 (回到群组选择)
-    if data.startswith("back_to_groups_for_date_"):
-        date_str = data.split("_")[-1]
-        send_group_selection_for_date(query, context, date_str)
-        return
-    
-    # 处理返回按钮 (回到日期选择)
-    if data == "back_to_dates":
-        send_date_selection(query, context)
-        return
-    
-    # 处理返回按钮 (回到日期选择，用于财务查账命令)
-    if data == "back_to_dates_first":
-        send_date_selection_first(query, context)
-        return
-        
-    # 处理一键复制地址按钮
-    if data.startswith("copy_address_"):
-        # 提取USDT地址
-        usdt_address = data[len("copy_address_"):]
-        logger.info(f"用户请求复制地址: {usdt_address}")
-        
-        # 发送单独的消息，包含完整地址，方便用户复制
-        context.bot.send_message(
-            chat_id=query.message.chat_id,
-            text=f"<code>{usdt_address}</code>\n\n👆 点击上方地址可复制",
-            parse_mode=ParseMode.HTML
-        )
-        
-        # 通知用户操作已完成
-        query.answer("地址已发送，可直接复制")
-        return
-    
-    # 如果回调数据不匹配任何已知模式
-    logger.warning(f"未知的按钮回调数据: {data}")
-    query.edit_message_text("抱歉，无法处理此请求。")
-
+@timed_route
 def export_specific_date_for_chat(query, context, date_str, chat_id):
     """导出特定日期的群组账单"""
     logger.info(f"导出群组 {chat_id} 在 {date_str} 的账单")
@@ -2301,99 +3219,19 @@ def export_specific_date_for_chat(query, context, date_str, chat_id):
         # 更新消息，表示正在导出
         query.edit_message_text(f"正在导出 {chat_title} {date_str} 的账单数据...", reply_markup=reply_markup)
         
-        # 检查账单是否为空
-        if chat_id not in chat_accounting:
-            # 创建空账单
-            get_chat_accounting(chat_id)
-        
-        # 获取该聊天的账单数据
-        chat_data = get_chat_accounting(chat_id)
-        
-        # 筛选指定日期的记录
-        date_deposits = [d for d in chat_data['deposits'] if d['time'].split(' ')[0] == date_str]
-        date_withdrawals = [w for w in chat_data['withdrawals'] if w['time'].split(' ')[0] == date_str]
-        
-        # 计算统计数据
-        deposit_total = sum(deposit['amount'] for deposit in date_deposits)
-        deposit_count = len(date_deposits)
-        
-        withdrawal_total_local = sum(withdraw['amount'] for withdraw in date_withdrawals)
-        withdrawal_total_usdt = sum(withdraw['usd_equivalent'] for withdraw in date_withdrawals)
-        withdrawal_count = len(date_withdrawals)
-        
-        # 统计每个用户的入款
-        user_deposits = {}
-        for deposit in date_deposits:
-            username = deposit['user']
-            amount = deposit['amount']
-            if username not in user_deposits:
-                user_deposits[username] = 0
-            user_deposits[username] += amount
-        
-        # 统计每个用户的出款
-        user_withdrawals = {}
-        for withdrawal in date_withdrawals:
-            username = withdrawal['user']
-            amount = withdrawal['amount']
-            if username not in user_withdrawals:
-                user_withdrawals[username] = 0
-            user_withdrawals[username] += amount
-        
-        # 汇率和费率部分
-        rate = chat_data.get('fixed_rate', 1.0)
-        fee_rate = chat_data.get('rate', 0.0)
-        
-        # 计算实际金额
-        actual_amount = deposit_total / rate if rate != 0 else 0
-        
-        # 计算应下发金额
-        to_be_withdrawn = actual_amount
-        already_withdrawn = withdrawal_total_usdt
-        not_yet_withdrawn = to_be_withdrawn - already_withdrawn
-        
-        # 生成账单摘要
-        summary_text = f"====== {chat_title} {date_str} 账单 ======\n\n"
-        
-        summary_text += f"入款（{deposit_count}笔）：\n"
-        if deposit_count > 0:
-            for username, amount in user_deposits.items():
-                summary_text += f"  {username}: {amount:.2f}\n"
-        else:
-            summary_text += "  暂无入金\n"
+        # 生成账单并发送给用户，已结束的日期优先使用导出缓存
+        send_report_document(
+            context.bot,
+            query.message.chat_id,
+            iter_chat_date_export_lines(chat_id, chat_title, date_str),
+            filename=f"{chat_title}_{date_str}_账单.txt",
+            caption=f"{chat_title} {date_str} 财务账单导出文件",
+            cache_key=get_export_cache_key(chat_id, date_str, 'date_txt', chat_title)
+        )
+        logger.info(f"已导出 {chat_title} {date_str} 的账单数据")
         
-        summary_text += f"\n下发（{withdrawal_count}笔）：\n"
-        if withdrawal_count > 0:
-            for username, amount in user_withdrawals.items():
-                summary_text += f"  {username}: {amount:.2f}\n"
-        else:
-            summary_text += "  暂无下发\n"
-        
-        summary_text += f"\n费率：{fee_rate}%\n"
-        summary_text += f"固定汇率：{rate}\n"
-        summary_text += f"总入款：{deposit_total:.2f}\n"
-        summary_text += f"应下发：{deposit_total:.2f}｜{to_be_withdrawn:.2f}U\n"
-        summary_text += f"已下发：{withdrawal_total_local:.2f}｜{already_withdrawn:.2f}U\n"
-        summary_text += f"未下发：{deposit_total-withdrawal_total_local:.2f}｜{not_yet_withdrawn:.2f}U\n"
-        
-        # 导出为TXT文件
-        file_path = export_group_date_data_to_txt(chat_title, date_str, summary_text, date_deposits, date_withdrawals)
-        
-        # 发送文件给用户
-        if file_path:
-            with open(file_path, 'rb') as file:
-                context.bot.send_document(
-                    chat_id=query.message.chat_id,
-                    document=file,
-                    filename=f"{chat_title}_{date_str}_账单.txt",
-                    caption=f"{chat_title} {date_str} 财务账单导出文件"
-                )
-            logger.info(f"已导出 {chat_title} {date_str} 的账单数据到 {file_path}")
-            
-            # 更新消息，表示导出成功
-            query.edit_message_text(f"已成功导出 {chat_title} {date_str} 的账单数据", reply_markup=reply_markup)
-        else:
-            # 更新消息，表示导出失败
-            query.edit_message_text(f"未能导出 {chat_title} {date_str} 的账单数据", reply_markup=reply_markup)
+        # 更新消息，表示导出成功
+        query.edit_message_text(f"已成功导出 {chat_title} {date_str} 的账单数据", reply_markup=reply_markup)
     except Exception as e:
         logger.error(f"导出群组日期账单时出错: {e}", exc_info=True)
         keyboard = [[InlineKeyboardButton("返回", callback_data=f"export_date_back_{chat_id}")]]
@@ -2404,36 +3242,16 @@ def send_group_selection_for_date(query, context, date_str):
     """发送指定日期的群组选择界面"""
     logger.info(f"为日期 {date_str} 发送群组选择界面")
     
-    # 查找在该日期有记录的群组
+    # 查找在该日期有记录的群组（包括已归档的记录），只对这些群组查询群组信息
     groups_with_records = []
-    for chat_id, chat_data in chat_accounting.items():
+    for chat_id in get_daily_stats(date_str)['chats']:
         try:
             # 检查是否是群组
             chat = context.bot.get_chat(chat_id)
             if chat.type not in ['group', 'supergroup']:
                 continue
             
-            # 检查是否有该日期的记录
-            has_records = False
-            
-            # 检查存款记录
-            for deposit in chat_data['deposits']:
-                record_date = deposit['time'].split(' ')[0]
-                if record_date == date_str:
-                    has_records = True
-                    break
-            
-            # 检查提款记录，如果还没有找到记录
-            if not has_records:
-                for withdrawal in chat_data['withdrawals']:
-                    record_date = withdrawal['time'].split(' ')[0]
-                    if record_date == date_str:
-                        has_records = True
-                        break
-            
-            # 如果有该日期的记录，添加到列表
-            if has_records:
-                groups_with_records.append((chat_id, chat.title))
+            groups_with_records.append((chat_id, chat.title))
         except Exception as e:
             logger.error(f"获取群组 {chat_id} 信息时出错: {e}")
     
@@ -2449,6 +3267,9 @@ def send_group_selection_for_date(query, context, date_str):
     for chat_id, chat_title in groups_with_records:
         keyboard.append([InlineKeyboardButton(chat_title, callback_data=f"group_{chat_id}_{date_str}")])
     
+    # 一次导出所有群组的详细账单
+    keyboard.append([InlineKeyboardButton("打包导出所有群组", callback_data=f"zip_groups_{date_str}")])
+    
     # 添加返回按钮
     keyboard.append([InlineKeyboardButton("返回", callback_data="back_to_dates")])
     
@@ -2457,6 +3278,7 @@ def send_group_selection_for_date(query, context, date_str):
     # 更新消息
     query.edit_message_text(f"请选择要查看 {date_str} 账单的群组:", reply_markup=reply_markup)
 
+@timed_route
 def export_current_group_all_bills(query, context):
     """导出当前群组7天内的所有账单"""
     logger.info("导出当前群组7天账单")
@@ -2470,10 +3292,7 @@ def export_current_group_all_bills(query, context):
         chat_title = chat.title if chat.type in ['group', 'supergroup'] else "私聊"
         
         # 获取最近7天的日期列表
-        dates = []
-        for i in range(7):
-            date = (datetime.datetime.now(timezone) - datetime.timedelta(days=i)).strftime('%Y-%m-%d')
-            dates.append(date)
+        dates = get_recent_dates(7)
         
         # 创建回调查询对象
         keyboard = [[InlineKeyboardButton("返回", callback_data="first_page")]]
@@ -2482,39 +3301,76 @@ def export_current_group_all_bills(query, context):
         # 更新消息，表示正在导出
         query.edit_message_text(f"正在导出 {chat_title} 最近7天的账单数据...", reply_markup=reply_markup)
         
-        # 检查账单是否为空
-        if chat_id not in chat_accounting:
-            # 创建空账单
-            get_chat_accounting(chat_id)
-        
-        # 生成摘要
-        summary_text = generate_chat_all_days_summary(chat_id, chat_title, dates)
-        
-        # 导出为TXT文件
-        file_path = export_chat_all_days_to_txt(chat_id, chat_title, summary_text, dates)
-        
-        # 发送文件给用户
-        if file_path:
-            with open(file_path, 'rb') as file:
-                context.bot.send_document(
-                    chat_id=query.message.chat_id,
-                    document=file,
-                    filename=f"{chat_title}_7天账单.txt",
-                    caption=f"{chat_title} 最近7天财务账单导出文件"
-                )
-            logger.info(f"已导出 {chat_title} 最近7天的账单数据到 {file_path}")
-            
-            # 更新消息，表示导出成功
-            query.edit_message_text(f"已成功导出 {chat_title} 最近7天的账单数据", reply_markup=reply_markup)
-        else:
-            # 更新消息，表示导出失败
-            query.edit_message_text(f"未能导出 {chat_title} 最近7天的账单数据", reply_markup=reply_markup)
+        # 一次遍历当前账单和7天内的历史账单，摘要和明细共用聚合结果；
+        # 总计统计包含当前账单的全部记录，按日期统计只列出这7天
+        aggregate = aggregate_records(get_chat_ledgers(chat_id, dates), by_date=True)
+        
+        # 汇率和费率
+        chat_data = get_chat_accounting(chat_id)
+        rate = chat_data.get('fixed_rate', 1.0)
+        fee_rate = chat_data.get('rate', 0.0)
+        
+        # 生成账单并发送给用户
+        send_report_document(
+            context.bot,
+            query.message.chat_id,
+            iter_chat_all_days_export_lines(chat_title, dates, aggregate, rate, fee_rate),
+            filename=f"{chat_title}_7天账单.txt",
+            caption=f"{chat_title} 最近7天财务账单导出文件"
+        )
+        logger.info(f"已导出 {chat_title} 最近7天的账单数据")
+        
+        # 更新消息，表示导出成功，并提供对账用的数据格式
+        keyboard = [
+            [InlineKeyboardButton(f"导出{name}", callback_data=f"data_{data_format}_days_{chat_id}")
+             for data_format, name in DATA_FORMAT_NAMES.items()],
+            [InlineKeyboardButton("返回", callback_data="first_page")],
+        ]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        query.edit_message_text(f"已成功导出 {chat_title} 最近7天的账单数据", reply_markup=reply_markup)
     except Exception as e:
         logger.error(f"导出群组7天账单时出错: {e}", exc_info=True)
         keyboard = [[InlineKeyboardButton("返回", callback_data="first_page")]]
         reply_markup = InlineKeyboardMarkup(keyboard)
         query.edit_message_text(f"导出账单时出错: {str(e)}", reply_markup=reply_markup)
 
+@timed_route
+def export_current_group_records_data(query, context, chat_id, data_format):
+    """以CSV或列存格式导出群组最近7天的逐笔记录，直接读取账单记录"""
+    logger.info(f"以 {data_format} 格式导出群组 {chat_id} 最近7天的记录")
+    
+    keyboard = [[InlineKeyboardButton("返回", callback_data="first_page")]]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    
+    try:
+        chat = context.bot.get_chat(chat_id)
+        chat_title = chat.title if chat.type in ['group', 'supergroup'] else "私聊"
+        
+        dates = get_recent_dates(7)
+        chat_data = get_chat_accounting(chat_id)
+        
+        send_data_document(
+            context.bot,
+            query.message.chat_id,
+            data_format,
+            RECORD_COLUMNS,
+            iter_record_rows(chat_id, get_chat_ledgers(chat_id, dates), set(dates)),
+            filename=f"{chat_title}_7天记录",
+            caption=f"{chat_title} 最近7天记录（{DATA_FORMAT_NAMES[data_format]}）",
+            metadata={
+                'chat_id': chat_id,
+                'chat_title': chat_title,
+                'dates': sorted(dates),
+                'timezone': TIMEZONE,
+                'rate': chat_data.get('rate', 0.0),
+                'fixed_rate': chat_data.get('fixed_rate', 1.0),
+            }
+        )
+        query.edit_message_text(f"已成功导出 {chat_title} 最近7天的记录（{DATA_FORMAT_NAMES[data_format]}）", reply_markup=reply_markup)
+    except Exception as e:
+        logger.error(f"导出群组7天记录时出错: {e}", exc_info=True)
+        query.edit_message_text(f"导出记录时出错: {str(e)}", reply_markup=reply_markup)
+
 def show_all_bills_menu(update: Update, context: CallbackContext) -> None:
     """显示所有账单菜单"""
     if not is_authorized(update):
@@ -2538,42 +3394,16 @@ def send_date_selection(query, context):
     logger.info("发送日期选择界面")
     
     # 获取最近7天的日期列表
-    dates = []
-    for i in range(7):
-        date = (datetime.datetime.now(timezone) - datetime.timedelta(days=i)).strftime('%Y-%m-%d')
-        dates.append(date)
+    dates = get_recent_dates(7)
     
-    # 找出有记录的日期
+    # 找出有记录的日期：当天使用增量维护的统计，之前的日期包括已归档的记录
     dates_with_records = []
     for date_str in dates:
-        # 检查所有群组在该日期是否有记录
-        has_records = False
-        for chat_id, chat_data in chat_accounting.items():
-            try:
-                # 检查存款记录
-                for deposit in chat_data['deposits']:
-                    record_date = deposit['time'].split(' ')[0]
-                    if record_date == date_str:
-                        has_records = True
-                        break
-                
-                if has_records:
-                    break
-                
-                # 检查提款记录
-                for withdrawal in chat_data['withdrawals']:
-                    record_date = withdrawal['time'].split(' ')[0]
-                    if record_date == date_str:
-                        has_records = True
-                        break
-                
-                if has_records:
-                    break
-            except Exception as e:
-                logger.error(f"检查聊天 {chat_id} 的记录时出错: {e}")
-        
-        if has_records:
-            dates_with_records.append(date_str)
+        try:
+            if get_daily_stats(date_str)['chats']:
+                dates_with_records.append(date_str)
+        except Exception as e:
+            logger.error(f"检查 {date_str} 的记录时出错: {e}")
     
     # 如果没有找到任何有记录的日期
     if not dates_with_records:
@@ -2612,25 +3442,25 @@ def show_financial_summary(update: Update, context: CallbackContext) -> None:
     chat_data = get_chat_accounting(chat_id)
     
     # 收款部分 - 计算今日和总计
-    today = datetime.datetime.now(timezone).strftime('%Y-%m-%d')
+    today = get_current_date()
     
-    # 筛选今日记录
-    today_deposits = [d for d in chat_data['deposits'] if d['time'].split(' ')[0] == today]
-    today_withdrawals = [w for w in chat_data['withdrawals'] if w['time'].split(' ')[0] == today]
+    # 一次遍历同时得到总计和按日期的统计
+    aggregate = aggregate_records([chat_data], by_date=True)
+    today_aggregate = aggregate['by_date'].get(today) or new_aggregate()
     
     # 今日统计
-    today_deposit_total = sum(deposit['amount'] for deposit in today_deposits)
-    today_deposit_count = len(today_deposits)
+    today_deposit_total = today_aggregate['deposit_total']
+    today_deposit_count = today_aggregate['deposit_count']
     
-    today_withdrawal_total = sum(withdraw['amount'] for withdraw in today_withdrawals)
-    today_withdrawal_count = len(today_withdrawals)
+    today_withdrawal_total = today_aggregate['withdrawal_total']
+    today_withdrawal_count = today_aggregate['withdrawal_count']
     
     # 总计统计
-    total_deposit_total = sum(deposit['amount'] for deposit in chat_data['deposits'])
-    total_deposit_count = len(chat_data['deposits'])
+    total_deposit_total = aggregate['deposit_total']
+    total_deposit_count = aggregate['deposit_count']
     
-    total_withdrawal_total = sum(withdraw['amount'] for withdraw in chat_data['withdrawals'])
-    total_withdrawal_count = len(chat_data['withdrawals'])
+    total_withdrawal_total = aggregate['withdrawal_total']
+    total_withdrawal_count = aggregate['withdrawal_count']
     
     # 汇率和费率部分
     rate = chat_data.get('fixed_rate', 1.0)
@@ -2652,30 +3482,14 @@ def show_financial_summary(update: Update, context: CallbackContext) -> None:
     
     # 统计每个用户今日的入款
     if today_deposit_count > 0:
-        today_user_deposits = {}
-        for deposit in today_deposits:
-            username = deposit['user']
-            amount = deposit['amount']
-            if username not in today_user_deposits:
-                today_user_deposits[username] = 0
-            today_user_deposits[username] += amount
-        
-        for username, amount in today_user_deposits.items():
+        for username, amount in today_aggregate['operators'].items():
             summary_text += f"  {username}: {amount:.2f}\n"
     
     summary_text += f"出款: {today_withdrawal_count}笔，共计 {today_withdrawal_total:.2f}\n"
     
     # 统计每个用户今日的出款
     if today_withdrawal_count > 0:
-        today_user_withdrawals = {}
-        for withdrawal in today_withdrawals:
-            username = withdrawal['user']
-            amount = withdrawal['amount']
-            if username not in today_user_withdrawals:
-                today_user_withdrawals[username] = 0
-            today_user_withdrawals[username] += amount
-        
-        for username, amount in today_user_withdrawals.items():
+        for username, amount in today_aggregate['user_withdrawals'].items():
             summary_text += f"  {username}: {amount:.2f}\n"
     
     summary_text += f"\n===== 总计 =====\n"
@@ -2789,28 +3603,107 @@ def user(update: Update, context: CallbackContext) -> None:
     except ValueError:
         update.message.reply_text('金额必须是数字')
 
+def defer_catch_up_summary(update, context):
+    """批量处理积压的更新期间记下该群组最后一条需要回复账单摘要的消息并返回True，其他时候返回False"""
+    if catch_up_state is None:
+        return False
+    catch_up_state['summaries'][update.effective_chat.id] = (update, context)
+    return True
+
+def catch_up_pending_updates(updater):
+    """启动时批量处理停机期间积压的更新
+    
+    从保存的位置之后开始获取，已处理过的更新不会重复记账。处理期间时钟按每条更新的时间（get_update_time）走，
+    记录时间和结账与更新当时就被处理一样（停机前一天发出的入款仍计入前一天）。处理期间不保存数据、
+    不回复账单摘要，全部处理完后保存一次，每个群组回复一次账单摘要。出错时剩余的更新交给正常轮询逐条处理
+    """
+    global catch_up_state
+    
+    offset = None
+    if last_update_id is not None and time.time() - (last_update_time or 0) < UPDATE_ID_RESET_SECONDS:
+        offset = last_update_id + 1
+    
+    start = time.perf_counter()
+    count = 0
+    catch_up_state = {'dirty': False, 'summaries': OrderedDict()}
+    catch_up_clock = FakeClock(get_now())
+    replay_time = None
+    previous_clock = set_clock(catch_up_clock)
+    try:
+        # 设置了webhook时getUpdates会失败；轮询开始前本来也会删除webhook，这里提前删除，不丢弃积压的更新
+        updater.bot.delete_webhook()
+        while True:
+            updates = updater.bot.get_updates(offset=offset, timeout=0, allowed_updates=ALLOWED_UPDATES)
+            if not updates:
+                break
+            for update in updates:
+                # 时钟只前进：按钮回调取到的是按钮所在消息的发送时间，早于点击时间
+                update_time = get_update_time(update)
+                if update_time is not None and (replay_time is None or update_time > replay_time):
+                    replay_time = update_time
+                    catch_up_clock.set(update_time.astimezone(timezone))
+                updater.dispatcher.process_update(update)
+            count += len(updates)
+            offset = updates[-1].update_id + 1
+    except Exception as e:
+        logger.warning(f"获取积压的更新时出错，剩余的更新将逐条处理: {e}")
+    finally:
+        set_clock(previous_clock)
+        state, catch_up_state = catch_up_state, None
+    
+    if state['dirty']:
+        save_data()
+    for update, context in state['summaries'].values():
+        try:
+            summary(update, context)
+        except Exception as e:
+            logger.error(f"回复群组 {update.effective_chat.id} 的账单摘要时出错: {e}", exc_info=True)
+    
+    # 轮询的第一次getUpdates从这里开始，同时向Telegram确认已处理的更新
+    if offset is not None:
+        updater.last_update_id = offset
+    logger.info("已批量处理 %d 条积压的更新，回复 %d 个群组的账单摘要，耗时 %.3fs",
+                count, len(state['summaries']), time.perf_counter() - start)
+
 def main() -> None:
     """Start the bot."""
     # 清除历史数据，确保每次启动时都使用新数据
     # 不需要重置特定聊天ID的数据，让系统在收到消息时自动创建
-    global group_operators, authorized_groups
+    global group_operators, authorized_groups, bot_updater
     
     logger.info("启动机器人...")
+    # 启动耗时分解：(步骤, 秒)
+    startup_timings = [('导入模块', time.perf_counter() - IMPORT_START)]
     
-    # 加载保存的数据
-    load_data()
+    # 先启动健康检查服务器，部署平台可以尽早检测到端口
+    threading.Thread(target=start_health_server, daemon=True).start()
     
     # 注册信号处理
     signal.signal(signal.SIGINT, shutdown_handler)
     signal.signal(signal.SIGTERM, shutdown_handler)
     
-    # Create the Updater and pass it your bot's token
-    updater = Updater(BOT_TOKEN)
+    # Create the Updater with a bot that records Bot API latency and errors
+    # 连接池大小与Updater默认的一致：工作线程数+4
+    updater = Updater(bot=InstrumentedBot(BOT_TOKEN, base_url=BOT_API_BASE_URL, request=Request(con_pool_size=8)))
+    bot_updater = updater
     
-    # 输出机器人信息
-    bot_info = updater.bot.get_me()
-    logger.info(f"机器人信息: ID={bot_info.id}, 用户名=@{bot_info.username}, 名称={bot_info.first_name}")
-    logger.info(f"机器人配置: can_join_groups={bot_info.can_join_groups}, can_read_all_group_messages={bot_info.can_read_all_group_messages}")
+    # 查询机器人信息需要一次网络往返，与加载数据同时进行
+    bot_info_result = {}
+    def fetch_bot_info():
+        step_start = time.perf_counter()
+        try:
+            bot_info_result['info'] = updater.bot.get_me()
+        except Exception as e:
+            bot_info_result['error'] = e
+        bot_info_result['seconds'] = time.perf_counter() - step_start
+    bot_info_thread = threading.Thread(target=fetch_bot_info, daemon=True)
+    bot_info_thread.start()
+    
+    # 加载保存的数据
+    step_start = time.perf_counter()
+    load_data()
+    startup_timings.append(('加载数据', time.perf_counter() - step_start))
+    step_start = time.perf_counter()
 
     # Get the dispatcher to register handlers
     dispatcher = updater.dispatcher
@@ -2827,6 +3720,17 @@ def main() -> None:
             group_operators[chat_id] = set(INITIAL_OPERATORS)
             logger.info(f"为已有账单的群组 {chat_id} 初始化操作人列表: {group_operators[chat_id]}")
 
+    # 更新计数：group -1 最先执行，group 99 在所有处理器之后执行
+    dispatcher.add_handler(TypeHandler(Update, count_received_update), group=-1)
+    dispatcher.add_handler(TypeHandler(Update, count_handled_update), group=99)
+    dispatcher.add_error_handler(handle_update_error)
+    
+    # 性能分析控制消息（来自信号处理函数和定时任务）
+    dispatcher.add_handler(TypeHandler(ProfileControl, handle_profile_control))
+    if hasattr(signal, 'SIGUSR1'):
+        signal.signal(signal.SIGUSR1, profile_signal_handler)
+        signal.signal(signal.SIGUSR2, profile_signal_handler)
+    
     # Register command handlers
     dispatcher.add_handler(CommandHandler("start", start))
     dispatcher.add_handler(CommandHandler("help", help_command))
@@ -2853,42 +3757,63 @@ def main() -> None:
     # Allow anyone to set admin initially
     dispatcher.add_handler(CommandHandler("set_admin", set_admin))
     
+    # 性能分析命令，仅全局管理员
+    dispatcher.add_handler(CommandHandler("profile", profile_command))
+    
     # 处理群聊中的所有消息，注意配置优先级
     dispatcher.add_handler(MessageHandler(Filters.text & ~Filters.command, handle_text_message), group=1)
     
-    # 在启动前尝试删除任何可能存在的webhook
-    updater.bot.delete_webhook()
-    
     # 记录日志
     logger.info(f"已注册消息处理器")
 
-    # Start a job to check date change every hour
+    # 启动时立即检查一次（补做停机期间错过的结账），之后在每个结账时间点准时检查；
+    # 按RESET_CHECK_INTERVAL的定期检查只作为兜底
     job_queue = updater.job_queue
     job_queue.run_repeating(check_date_change, interval=RESET_CHECK_INTERVAL, first=0)
+    schedule_next_rollover(job_queue)
     
     # 设置定时保存数据的任务
     job_queue.run_repeating(lambda context: save_data(), interval=300, first=60)  # 每5分钟保存一次
     logger.info("已设置每5分钟保存一次数据")
     
-    logger.info(f"已设置每 {RESET_CHECK_INTERVAL} 秒检查日期变更")
+    logger.info(f"已设置每 {RESET_CHECK_INTERVAL} 秒兜底检查日期变更")
     
     # 记录已加载的配置
     logger.info(f"管理员ID: {admin_user_id}")
     logger.info(f"初始操作人: {group_operators}")
-    
-    # 启动健康检查服务器，防止Render休眠
-    threading.Thread(target=start_health_server, daemon=True).start()
+    startup_timings.append(('注册处理器', time.perf_counter() - step_start))
+    
+    # 等待机器人信息；令牌无效等错误与之前一样直接终止启动
+    bot_info_thread.join()
+    if 'error' in bot_info_result:
+        raise bot_info_result['error']
+    bot_info = bot_info_result['info']
+    startup_timings.append(('获取机器人信息(与加载数据并行)', bot_info_result['seconds']))
+    logger.info(f"机器人信息: ID={bot_info.id}, 用户名=@{bot_info.username}, 名称={bot_info.first_name}")
+    logger.info(f"机器人配置: can_join_groups={bot_info.can_join_groups}, can_read_all_group_messages={bot_info.can_read_all_group_messages}")
     
     # 启动机器人，并设置使其处理群组中的所有消息
     logger.info("开始运行机器人...")
     
+    # 先批量处理停机期间积压的更新，轮询从处理完的位置继续
+    if CATCH_UP_PENDING_UPDATES:
+        step_start = time.perf_counter()
+        catch_up_pending_updates(updater)
+        startup_timings.append(('处理积压更新', time.perf_counter() - step_start))
+    
     # 确保使用所有可能的更新类型，特别是文本消息
+    # 轮询线程开始前会先调用delete_webhook（失败时自动重试），不需要在这里单独调用
+    step_start = time.perf_counter()
     updater.start_polling(
         timeout=30,
-        drop_pending_updates=True,
-        allowed_updates=['message', 'edited_message', 'channel_post', 'edited_channel_post', 'callback_query']
+        drop_pending_updates=not CATCH_UP_PENDING_UPDATES,
+        allowed_updates=ALLOWED_UPDATES
     )
-    logger.info("机器人已成功启动并正在监听消息...")
+    startup_timings.append(('开始轮询', time.perf_counter() - step_start))
+    startup_seconds = time.perf_counter() - IMPORT_START
+    set_metric('bot_startup_seconds', startup_seconds)
+    logger.info("机器人已成功启动并正在监听消息，启动耗时 %.3fs: %s", startup_seconds,
+                ", ".join(f"{name} {seconds * 1000:.0f}ms" for name, seconds in startup_timings))
     updater.idle()
 
 def set_rate(update: Update, context: CallbackContext) -> None:
@@ -2957,42 +3882,16 @@ def send_date_selection_first(update_or_query, context):
     is_query = hasattr(update_or_query, 'edit_message_text')
     
     # 获取最近7天的日期列表
-    dates = []
-    for i in range(7):
-        date = (datetime.datetime.now(timezone) - datetime.timedelta(days=i)).strftime('%Y-%m-%d')
-        dates.append(date)
+    dates = get_recent_dates(7)
     
-    # 找出有记录的日期
+    # 找出有记录的日期：当天使用增量维护的统计，之前的日期包括已归档的记录
     dates_with_records = []
     for date_str in dates:
-        # 检查所有群组在该日期是否有记录
-        has_records = False
-        for chat_id, chat_data in chat_accounting.items():
-            try:
-                # 检查存款记录
-                for deposit in chat_data['deposits']:
-                    record_date = deposit['time'].split(' ')[0]
-                    if record_date == date_str:
-                        has_records = True
-                        break
-                
-                if has_records:
-                    break
-                
-                # 检查提款记录
-                for withdrawal in chat_data['withdrawals']:
-                    record_date = withdrawal['time'].split(' ')[0]
-                    if record_date == date_str:
-                        has_records = True
-                        break
-                
-                if has_records:
-                    break
-            except Exception as e:
-                logger.error(f"检查聊天 {chat_id} 的记录时出错: {e}")
-        
-        if has_records:
-            dates_with_records.append(date_str)
+        try:
+            if get_daily_stats(date_str)['chats']:
+                dates_with_records.append(date_str)
+        except Exception as e:
+            logger.error(f"检查 {date_str} 的记录时出错: {e}")
     
     # 如果没有找到任何有记录的日期
     if not dates_with_records:
@@ -3027,48 +3926,16 @@ def handle_date_selection(query, context, date_str):
     context.user_data['selected_date'] = date_str
     logger.info(f"已将日期 {date_str} 保存到用户数据中")
     
-    # 查找在该日期有记录的群组
-    groups_with_records = []
-    for chat_id, chat_data in chat_accounting.items():
-        try:
-            # 检查是否是群组
-            chat = context.bot.get_chat(chat_id)
-            if chat.type not in ['group', 'supergroup']:
-                continue
-            
-            # 检查是否有该日期的记录
-            has_records = False
-            
-            # 检查存款记录
-            for deposit in chat_data['deposits']:
-                record_date = deposit['time'].split(' ')[0]
-                if record_date == date_str:
-                    has_records = True
-                    break
-            
-            # 检查提款记录，如果还没有找到记录
-            if not has_records:
-                for withdrawal in chat_data['withdrawals']:
-                    record_date = withdrawal['time'].split(' ')[0]
-                    if record_date == date_str:
-                        has_records = True
-                        break
-            
-            # 如果有该日期的记录，添加到列表
-            if has_records:
-                groups_with_records.append((chat_id, chat.title))
-                logger.info(f"找到群组 {chat.title} ({chat_id}) 在日期 {date_str} 有记录")
-        except Exception as e:
-            logger.error(f"获取群组 {chat_id} 信息时出错: {e}")
-    
-    # 如果没有找到任何有记录的群组
-    if not groups_with_records:
+    # 该日期有记录的群组：与统计报表使用同一份每日统计（已结束的日期来自汇总和历史账单，不只是当前账单）
+    stats = get_daily_stats(date_str)
+    if not stats['chats']:
         query.edit_message_text(f"在 {date_str} 没有找到任何群组的记账记录")
         return
     
     # 直接显示所有群组统计数据
-    export_all_groups_statistics(query, context, date_str)
+    export_all_groups_statistics(query, context, date_str, stats)
 
+@timed_route
 def export_group_by_selected_date(query, context, chat_id):
     """根据选择的日期导出指定群组的账单"""
     date_str = context.user_data.get('selected_date')
@@ -3085,292 +3952,164 @@ def export_group_by_selected_date(query, context, chat_id):
         
         logger.info(f"导出群组 {chat_title} ({chat_id}) 在 {date_str} 的账单")
         
-        # 获取该聊天的账单数据
-        chat_data = get_chat_accounting(chat_id)
-        
-        # 筛选指定日期的记录
-        date_deposits = [d for d in chat_data['deposits'] if d['time'].split(' ')[0] == date_str]
-        date_withdrawals = [w for w in chat_data['withdrawals'] if w['time'].split(' ')[0] == date_str]
-        
-        logger.info(f"群组 {chat_title} 在 {date_str} 有 {len(date_deposits)} 笔存款和 {len(date_withdrawals)} 笔提款")
-        
-        # 计算统计数据
-        deposit_total = sum(deposit['amount'] for deposit in date_deposits)
-        deposit_count = len(date_deposits)
-        
-        withdrawal_total_local = sum(withdraw['amount'] for withdraw in date_withdrawals)
-        withdrawal_total_usdt = sum(withdraw['usd_equivalent'] for withdraw in date_withdrawals)
-        withdrawal_count = len(date_withdrawals)
-        
-        # 统计每个用户的入款
-        user_deposits = {}
-        for deposit in date_deposits:
-            username = deposit['user']
-            amount = deposit['amount']
-            if username not in user_deposits:
-                user_deposits[username] = 0
-            user_deposits[username] += amount
-        
-        # 统计每个用户的出款 (使用USDT金额)
-        user_withdrawals = {}
-        for withdrawal in date_withdrawals:
-            username = withdrawal['user']
-            # 使用USDT金额而不是本地货币
-            amount = withdrawal['usd_equivalent']
-            if username not in user_withdrawals:
-                user_withdrawals[username] = 0
-            user_withdrawals[username] += amount
-        
-        # 汇率和费率部分
-        rate = chat_data.get('fixed_rate', 1.0)
-        fee_rate = chat_data.get('rate', 0.0)
-        
-        # 计算实际金额
-        actual_amount = deposit_total / rate if rate != 0 else 0
-        
-        # 计算应下发金额
-        to_be_withdrawn = actual_amount
-        already_withdrawn = withdrawal_total_usdt
-        not_yet_withdrawn = to_be_withdrawn - already_withdrawn
-        
-        # 生成账单摘要
-        summary_text = f"====== {chat_title} {date_str} 财务账单 ======\n\n"
-        
-        summary_text += f"入款（{deposit_count}笔）：\n"
-        if deposit_count > 0:
-            for username, amount in user_deposits.items():
-                summary_text += f"  {username}: {amount:.2f}\n"
-        else:
-            summary_text += "  暂无入金\n"
+        # 生成账单并发送给用户，已结束的日期优先使用导出缓存
+        send_report_document(
+            context.bot,
+            query.message.chat_id,
+            iter_chat_date_export_lines(chat_id, chat_title, date_str),
+            filename=f"{chat_title}_{date_str}_账单.txt",
+            caption=f"{chat_title} {date_str} 财务账单导出文件",
+            cache_key=get_export_cache_key(chat_id, date_str, 'date_txt', chat_title)
+        )
+        logger.info(f"已导出 {chat_title} 在 {date_str} 的账单数据")
         
-        summary_text += f"\n下发（{withdrawal_count}笔）：\n"
-        if withdrawal_count > 0:
-            for username, amount in user_withdrawals.items():
-                summary_text += f"  {username}: {amount:.2f}\n"
-        else:
-            summary_text += "  暂无下发\n"
-        
-        summary_text += f"\n费率：{fee_rate}%\n"
-        summary_text += f"固定汇率：{rate}\n"
-        summary_text += f"总入款：{deposit_total:.2f}\n"
-        summary_text += f"应下发：{deposit_total:.2f}｜{to_be_withdrawn:.2f}U\n"
-        summary_text += f"已下发：{withdrawal_total_local:.2f}｜{already_withdrawn:.2f}U\n"
-        summary_text += f"未下发：{deposit_total-withdrawal_total_local:.2f}｜{not_yet_withdrawn:.2f}U\n"
-        
-        # 导出为TXT文件
-        file_path = export_group_date_data_to_txt(chat_title, date_str, summary_text, date_deposits, date_withdrawals)
-        
-        # 发送文件给用户
-        if file_path:
-            with open(file_path, 'rb') as file:
-                context.bot.send_document(
-                    chat_id=query.message.chat_id,
-                    document=file,
-                    filename=f"{chat_title}_{date_str}_账单.txt",
-                    caption=f"{chat_title} {date_str} 财务账单导出文件"
-                )
-            logger.info(f"已导出 {chat_title} 在 {date_str} 的账单数据到 {file_path}")
-            
-            # 更新消息，表示导出成功
-            keyboard = [
-                [InlineKeyboardButton("返回群组选择", callback_data=f"back_to_groups_for_date_{date_str}")],
-                [InlineKeyboardButton("返回日期选择", callback_data="back_to_dates_first")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            query.edit_message_text(f"已成功导出 {chat_title} 在 {date_str} 的账单数据", reply_markup=reply_markup)
-        else:
-            # 更新消息，表示导出失败
-            keyboard = [[InlineKeyboardButton("返回", callback_data=f"back_to_groups_for_date_{date_str}")]]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            query.edit_message_text(f"未能导出 {chat_title} 在 {date_str} 的账单数据", reply_markup=reply_markup)
+        # 更新消息，表示导出成功
+        keyboard = [
+            [InlineKeyboardButton("返回群组选择", callback_data=f"back_to_groups_for_date_{date_str}")],
+            [InlineKeyboardButton("返回日期选择", callback_data="back_to_dates_first")]
+        ]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        query.edit_message_text(f"已成功导出 {chat_title} 在 {date_str} 的账单数据", reply_markup=reply_markup)
     except Exception as e:
         logger.error(f"导出群组日期账单时出错: {e}", exc_info=True)
         keyboard = [[InlineKeyboardButton("返回", callback_data="back_to_dates_first")]]
         reply_markup = InlineKeyboardMarkup(keyboard)
         query.edit_message_text(f"导出账单时出错: {str(e)}", reply_markup=reply_markup)
 
-def export_group_date_data_to_txt(chat_title, date_str, summary_text, deposits, withdrawals):
-    """将群组指定日期的账单数据导出为TXT文件"""
-    try:
-        # 创建导出文件夹
-        export_dir = "exports"
-        os.makedirs(export_dir, exist_ok=True)
-        
-        # 创建文件名
-        timestamp = datetime.datetime.now(timezone).strftime("%Y%m%d%H%M%S")
-        file_name = f"{chat_title}_{date_str}_{timestamp}.txt"
-        file_path = os.path.join(export_dir, file_name)
-        
-        # 统计数据
-        deposit_total = sum(deposit['amount'] for deposit in deposits)
-        deposit_count = len(deposits)
-        
-        withdrawal_total_local = sum(withdraw['amount'] for withdraw in withdrawals)
-        withdrawal_total_usdt = sum(withdraw.get('usd_equivalent', 0) for withdraw in withdrawals if 'usd_equivalent' in withdraw)
-        withdrawal_count = len(withdrawals)
-        
-        # 查找对应的聊天数据以获取汇率和费率
-        chat_id = None
-        chat_data = None
-        for cid, data in chat_accounting.items():
-            try:
-                chat = None
-                try:
-                    from telegram import Bot
-                    bot = Bot(token=BOT_TOKEN)
-                    chat = bot.get_chat(cid)
-                    if chat.type in ['group', 'supergroup'] and chat.title == chat_title:
-                        chat_id = cid
-                        chat_data = data
-                        break
-                except:
-                    # 如果无法获取聊天信息，则跳过
-                    continue
-            except Exception as e:
-                logger.error(f"检查聊天ID {cid} 时出错: {e}")
-        
-        # 获取汇率和费率
-        rate = chat_data.get('fixed_rate', 1.0) if chat_data else 1.0
-        fee_rate = chat_data.get('rate', 0.0) if chat_data else 0.0
-        
-        with open(file_path, 'w', encoding='utf-8') as file:
-            # 写入标题和导出时间
-            now = datetime.datetime.now(timezone).strftime('%Y-%m-%d %H:%M:%S')
-            file.write(f"===== {chat_title} {date_str} 财务账单 =====\n")
-            file.write(f"导出时间: {now}\n\n")
-            
-            # 写入账单摘要 - 使用与详细账单相同的格式
-            file.write(f"====== {chat_title} ======\n\n")
-            
-            # 显示入款部分
-            file.write(f"入款（{deposit_count}笔）：\n")
-            if deposit_count > 0:
-                # 按时间排序，最新的在前面
-                sorted_deposits = sorted(deposits, key=lambda x: x.get('time', ''), reverse=True)
-                # 获取最新的6笔入款记录，如果不到6笔就显示全部
-                latest_deposits = sorted_deposits[:min(6, len(sorted_deposits))]
-                
-                # 显示每个入款记录及其回复人
-                for deposit in latest_deposits:
-                    amount = deposit['amount']
-                    # 计算美元等值：金额除以汇率
-                    usd_equivalent = amount / rate if rate != 0 else 0
-                    responder = deposit.get('responder', '无回复人')
-                    
-                    # 提取时间戳中的小时和分钟
-                    time_str = deposit.get('time', '')
-                    time_parts = time_str.split(' ')
-                    if len(time_parts) > 1:
-                        time_part = time_parts[1]  # 获取时间部分 (HH:MM:SS)
-                        hour_min = ':'.join(time_part.split(':')[:2])  # 只保留小时和分钟
-                    else:
-                        hour_min = "00:00"  # 默认时间
-                        
-                    # 使用新的格式: HH:MM 金额/汇率 =美元等值 回复人
-                    responder_display = "" if responder is None or responder == "None" else responder
-                    file.write(f"  {hour_min} {amount:.0f}/{rate} ={usd_equivalent:.2f} {responder_display}\n")
-            else:
-                file.write("  暂无入金\n")
-            
-            # 统计以回复用户为分类的入款信息
-            responder_deposits = {}
-            for deposit in deposits:
-                # 只处理有回复者信息的记录
-                if 'responder' in deposit and deposit['responder']:
-                    responder = deposit['responder']
-                    username = deposit['user']
-                    amount = deposit['amount']
-                    
-                    # 创建或更新此回复者的记录
-                    if responder not in responder_deposits:
-                        responder_deposits[responder] = {'total': 0, 'users': {}}
-                    
-                    responder_deposits[responder]['total'] += amount
-                    
-                    # 记录是哪个用户对这个回复者进行了入款
-                    if username not in responder_deposits[responder]['users']:
-                        responder_deposits[responder]['users'][username] = 0
-                    responder_deposits[responder]['users'][username] += amount
-            
-            # 计算分类人数
-            responder_count = len(responder_deposits)
-            
-            # 写入用户分类信息
-            file.write(f"\n分类（{responder_count}人）：\n")
-            if responder_count > 0:
-                for responder, data in responder_deposits.items():
-                    total_amount = data['total']
-                    # 对于每个回复者，只显示总金额，不显示来源
-                    file.write(f"  {responder} {total_amount:.2f}\n")
-            else:
-                file.write("  暂无分类\n")
-            
-            # 写入下发信息
-            file.write(f"\n下发（{withdrawal_count}笔）：\n")
-            if withdrawal_count > 0:
-                # 统计每个用户的出款
-                user_withdrawals = {}
-                for withdrawal in withdrawals:
-                    username = withdrawal['user']
-                    # 使用USDT金额而不是本地货币
-                    amount = withdrawal.get('usd_equivalent', withdrawal['amount'])
-                    if username not in user_withdrawals:
-                        user_withdrawals[username] = 0
-                    user_withdrawals[username] += amount
-                
-                for username, amount in user_withdrawals.items():
-                    file.write(f"  {username}: {amount:.2f}\n")
-            else:
-                file.write("  暂无下发\n")
-            
-            # 计算应下发金额（USDT）
-            actual_amount = deposit_total / rate if rate != 0 else 0
-            to_be_withdrawn = actual_amount
-            already_withdrawn = withdrawal_total_usdt
-            not_yet_withdrawn = to_be_withdrawn - already_withdrawn
-            
-            # 写入费率和汇率信息
-            file.write(f"\n费率：{fee_rate}%\n")
-            file.write(f"固定汇率：{rate}\n")
-            file.write(f"总入款：{deposit_total:.2f}\n")
-            file.write(f"应下发：{deposit_total:.2f}｜{to_be_withdrawn:.2f}U\n")
-            file.write(f"已下发：{withdrawal_total_local:.2f}｜{already_withdrawn:.2f}U\n")
-            file.write(f"未下发：{deposit_total-withdrawal_total_local:.2f}｜{not_yet_withdrawn:.2f}U\n\n")
-            
-            # 写入入款明细部分
-            file.write("===== 入款明细 =====\n")
-            if deposits:
-                for i, deposit in enumerate(deposits, 1):
-                    file.write(f"{i}. 时间: {deposit['time']}, 金额: {deposit['amount']:.2f}, 用户: {deposit['user']}")
-                    if 'responder' in deposit and deposit['responder']:
-                        responder_display = deposit['responder']
-                        if responder_display and responder_display != "None":
-                            file.write(f", 回复人: {responder_display}")
-                    file.write(f", USD等值: {deposit.get('usd_equivalent', 0):.2f}\n")
-            else:
-                file.write("暂无入款记录\n")
+def iter_chat_date_export_lines(chat_id, chat_title, date_str):
+    """逐行生成群组指定日期的导出账单，数据来自当前账单和该日期已归档的历史账单"""
+    ledgers = get_chat_ledgers(chat_id, [date_str])
+    aggregate = aggregate_records(ledgers, dates={date_str})
+    
+    # 汇率和费率部分：已归档时使用当天的设置
+    rate = ledgers[-1].get('fixed_rate', 1.0)
+    fee_rate = ledgers[-1].get('rate', 0.0)
+    
+    yield from iter_group_date_export_lines(chat_title, date_str, aggregate, rate, fee_rate)
+
+def get_chat_date_ledgers(chat_id, date_str):
+    """群组指定日期的账单来源，只保留该日期的记录和汇率设置，体积小、可以传给工作进程"""
+    ledgers = []
+    for ledger in get_chat_ledgers(chat_id, [date_str]):
+        day_ledger = {key: ledger[key] for key in ('rate', 'fixed_rate') if key in ledger}
+        day_ledger['deposits'] = [record for record in ledger.get('deposits', []) if record['time'][:10] == date_str]
+        day_ledger['withdrawals'] = [record for record in ledger.get('withdrawals', []) if record['time'][:10] == date_str]
+        ledgers.append(day_ledger)
+    return ledgers
+
+def render_date_export(chat_title, date_str, ledgers):
+    """在工作线程或进程中生成群组指定日期的导出账单，返回utf-8编码的内容"""
+    aggregate = aggregate_records(ledgers, dates={date_str})
+    rate = ledgers[-1].get('fixed_rate', 1.0)
+    fee_rate = ledgers[-1].get('rate', 0.0)
+    return "".join(iter_group_date_export_lines(chat_title, date_str, aggregate, rate, fee_rate)).encode('utf-8')
+
+def create_export_executor(kind=None, workers=None):
+    """创建打包导出使用的线程池或进程池"""
+    kind = kind or EXPORT_ZIP_EXECUTOR
+    workers = workers or EXPORT_ZIP_WORKERS or os.cpu_count() or 1
+    if kind == 'process':
+        return concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+    return concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+
+def get_export_executor():
+    """获取打包导出共用的工作池，第一次使用时创建"""
+    global export_executor
+    with export_executor_lock:
+        if export_executor is None:
+            export_executor = create_export_executor()
+            atexit.register(export_executor.shutdown)
+        return export_executor
+
+def discard_export_executor(executor):
+    """丢弃已损坏的工作池（例如工作进程被杀死），下次导出时重新创建"""
+    global export_executor
+    with export_executor_lock:
+        if export_executor is executor:
+            export_executor = None
+    executor.shutdown(wait=False)
+
+def write_groups_zip(fileobj, date_str, groups, executor, max_pending, progress=None):
+    """用工作池并行生成各群组指定日期的账单，按群组顺序写入ZIP
+    
+    groups为 (chat_id, chat_title) 列表；同时在处理中的群组不超过max_pending个，生成的账单写入ZIP后即释放。
+    ZIP本身完整写入fileobj后才能上传（sendDocument需要完整的文件），调用方用SpooledTemporaryFile，
+    超过EXPORT_SPOOL_MAX_SIZE时转存到磁盘。progress(已完成数, 总数) 在每个文件写入后调用
+    """
+    total = len(groups)
+    done = 0
+    used_names = set()
+    pending = deque()
+    
+    with zipfile.ZipFile(fileobj, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        def write_next():
+            nonlocal done
+            name, future = pending.popleft()
+            archive.writestr(name, future.result())
+            done += 1
+            if progress:
+                progress(done, total)
+        
+        for chat_id, chat_title in groups:
+            # 群组名中的路径分隔符会在ZIP中变成目录，重名时加上群组ID
+            name = f"{chat_title.replace('/', '_')}_{date_str}_账单.txt"
+            if name in used_names:
+                name = f"{chat_title.replace('/', '_')}_{chat_id}_{date_str}_账单.txt"
+            used_names.add(name)
             
-            # 写入出款明细部分
-            file.write("\n===== 出款明细 =====\n")
-            if withdrawals:
-                for i, withdrawal in enumerate(withdrawals, 1):
-                    file.write(f"{i}. 时间: {withdrawal['time']}, 金额: {withdrawal['amount']:.2f}, ")
-                    file.write(f"用户: {withdrawal['user']}, USD等值: {withdrawal.get('usd_equivalent', 0):.2f}\n")
-            else:
-                file.write("暂无出款记录\n")
+            future = executor.submit(render_date_export, chat_title, date_str, get_chat_date_ledgers(chat_id, date_str))
+            pending.append((name, future))
+            if len(pending) >= max_pending:
+                write_next()
         
-        logger.info(f"已将 {chat_title} 的 {date_str} 账单数据导出到 {file_path}")
-        return file_path
-    except Exception as e:
-        logger.error(f"导出账单数据到TXT文件时出错: {e}", exc_info=True)
-        return None
+        while pending:
+            write_next()
 
+def iter_group_date_export_lines(chat_title, date_str, aggregate, rate, fee_rate):
+    """逐行生成群组指定日期的导出账单：摘要加入款、出款明细"""
+    now = get_current_timestamp()
+    yield f"===== {chat_title} {date_str} 财务账单 =====\n"
+    yield f"导出时间: {now}\n\n"
+    
+    # 下发部分：没有USDT金额的旧记录按出款金额计算
+    user_withdrawals_usdt = {}
+    for withdrawal in aggregate['withdrawals']:
+        username = withdrawal['user']
+        user_withdrawals_usdt[username] = user_withdrawals_usdt.get(username, 0) + withdrawal.get('usd_equivalent', withdrawal['amount'])
+    
+    # 账单摘要 - 使用与详细账单相同的格式
+    yield from iter_bill_summary_lines(chat_title, aggregate, rate, fee_rate, user_withdrawals_usdt)
+    yield "\n"
+    
+    # 入款明细部分
+    yield "===== 入款明细 =====\n"
+    if aggregate['deposits']:
+        for i, deposit in enumerate(aggregate['deposits'], 1):
+            line = f"{i}. 时间: {deposit['time']}, 金额: {deposit['amount']:.2f}, 用户: {deposit['user']}"
+            if 'responder' in deposit and deposit['responder']:
+                responder_display = deposit['responder']
+                if responder_display and responder_display != "None":
+                    line += f", 回复人: {responder_display}"
+            yield line + f", USD等值: {deposit.get('usd_equivalent', 0):.2f}\n"
+    else:
+        yield "暂无入款记录\n"
+    
+    # 出款明细部分
+    yield "\n===== 出款明细 =====\n"
+    if aggregate['withdrawals']:
+        for i, withdrawal in enumerate(aggregate['withdrawals'], 1):
+            yield (f"{i}. 时间: {withdrawal['time']}, 金额: {withdrawal['amount']:.2f}, "
+                   f"用户: {withdrawal['user']}, USD等值: {withdrawal.get('usd_equivalent', 0):.2f}\n")
+    else:
+        yield "暂无出款记录\n"
+
+@timed_route
 def export_yesterday_bill(update, context):
     """导出昨日所有群组的账单数据"""
     logger.info("导出昨日所有群组账单")
     
     # 计算昨天的日期
-    yesterday = (datetime.datetime.now(timezone) - datetime.timedelta(days=1)).strftime('%Y-%m-%d')
+    yesterday = get_date_days_ago(1)
     
     # 获取当前聊天ID
     chat_id = update.effective_chat.id
@@ -3383,15 +4122,8 @@ def export_yesterday_bill(update, context):
         chat = context.bot.get_chat(chat_id)
         chat_title = chat.title if chat.type in ['group', 'supergroup'] else "私聊"
         
-        # 获取该聊天的账单数据
-        chat_data = get_chat_accounting(chat_id)
-        
-        # 筛选指定日期的记录
-        date_deposits = [d for d in chat_data['deposits'] if d['time'].split(' ')[0] == yesterday]
-        date_withdrawals = [w for w in chat_data['withdrawals'] if w['time'].split(' ')[0] == yesterday]
-        
-        # 如果没有记录，通知用户
-        if not date_deposits and not date_withdrawals:
+        # 如果没有记录，通知用户（按日统计已包含当前账单和历史账单中的记录）
+        if chat_id not in get_daily_stats(yesterday)['chats']:
             context.bot.edit_message_text(
                 chat_id=chat_id,
                 message_id=status_message.message_id,
@@ -3399,48 +4131,23 @@ def export_yesterday_bill(update, context):
             )
             return
         
-        # 计算统计数据
-        deposit_total = sum(deposit['amount'] for deposit in date_deposits)
-        deposit_count = len(date_deposits)
-        
-        withdrawal_total_local = sum(withdraw['amount'] for withdraw in date_withdrawals)
-        withdrawal_total_usdt = sum(withdraw.get('usd_equivalent', 0) for withdraw in date_withdrawals)
-        withdrawal_count = len(date_withdrawals)
-        
-        # 汇率和费率部分
-        rate = chat_data.get('fixed_rate', 1.0)
-        fee_rate = chat_data.get('rate', 0.0)
+        # 生成账单并发送给用户，昨日的记录归档后优先使用导出缓存
+        send_report_document(
+            context.bot,
+            chat_id,
+            iter_chat_date_export_lines(chat_id, chat_title, yesterday),
+            filename=f"{chat_title}_{yesterday}_账单.txt",
+            caption=f"{chat_title} {yesterday} 财务账单导出文件",
+            cache_key=get_export_cache_key(chat_id, yesterday, 'date_txt', chat_title)
+        )
+        logger.info(f"已导出 {chat_title} {yesterday} 的账单数据")
         
-        # 生成摘要文本
-        summary_text = f"正在处理 {chat_title} {yesterday} 的账单数据..."
-        
-        # 导出为TXT文件
-        file_path = export_group_date_data_to_txt(chat_title, yesterday, summary_text, date_deposits, date_withdrawals)
-        
-        # 发送文件给用户
-        if file_path:
-            with open(file_path, 'rb') as file:
-                context.bot.send_document(
-                    chat_id=chat_id,
-                    document=file,
-                    filename=f"{chat_title}_{yesterday}_账单.txt",
-                    caption=f"{chat_title} {yesterday} 财务账单导出文件"
-                )
-            logger.info(f"已导出 {chat_title} {yesterday} 的账单数据到 {file_path}")
-            
-            # 更新消息，表示导出成功
-            context.bot.edit_message_text(
-                chat_id=chat_id,
-                message_id=status_message.message_id,
-                text=f"已成功导出 {chat_title} {yesterday} 的账单数据"
-            )
-        else:
-            # 更新消息，表示导出失败
-            context.bot.edit_message_text(
-                chat_id=chat_id,
-                message_id=status_message.message_id,
-                text=f"未能导出 {chat_title} {yesterday} 的账单数据"
-            )
+        # 更新消息，表示导出成功
+        context.bot.edit_message_text(
+            chat_id=chat_id,
+            message_id=status_message.message_id,
+            text=f"已成功导出 {chat_title} {yesterday} 的账单数据"
+        )
     except Exception as e:
         logger.error(f"导出昨日账单时出错: {e}", exc_info=True)
         update.message.reply_text(f"❌ 导出昨日账单时出错: {str(e)}")
@@ -3522,7 +4229,7 @@ def query_trc20_usdt_balance(address):
                 "User-Agent": "Telegram Bot/1.0"
             }
             
-            blockchair_response = requests.get(blockchair_url, headers=blockchair_headers, timeout=15)
+            blockchair_response = provider_get('blockchair', blockchair_url, headers=blockchair_headers, timeout=15)
             
             if blockchair_response.status_code == 200:
                 data = blockchair_response.json()
@@ -3557,7 +4264,7 @@ def query_trc20_usdt_balance(address):
                 "User-Agent": "Telegram Bot/1.0"
             }
             
-            tronscan_response = requests.get(tronscan_url, params=tronscan_params, headers=tronscan_headers, timeout=15)
+            tronscan_response = provider_get('tronscan', tronscan_url, params=tronscan_params, headers=tronscan_headers, timeout=15)
             
             if tronscan_response.status_code == 200:
                 data = tronscan_response.json()
@@ -3587,7 +4294,7 @@ def query_trc20_usdt_balance(address):
                 "User-Agent": "Telegram Bot/1.0"
             }
             
-            trongrid_response = requests.get(trongrid_url, headers=trongrid_headers, timeout=15)
+            trongrid_response = provider_get('trongrid', trongrid_url, headers=trongrid_headers, timeout=15)
             
             if trongrid_response.status_code == 200:
                 data = trongrid_response.json()
@@ -3617,6 +4324,7 @@ def query_trc20_usdt_balance(address):
         logger.error(f"查询TRC20-USDT余额时出错: {e}", exc_info=True)
         return 0
 
+@timed_route
 def handle_usdt_query(update, context):
     """处理USDT地址余额查询请求"""
     reply_to_message = update.message.reply_to_message
@@ -3638,10 +4346,11 @@ def handle_usdt_query(update, context):
         usdt_address = extract_usdt_address(reply_to_message.caption)
     
     # 如果是转发的消息，尝试从转发信息中提取
+    # telegram的Message没有forward_text/forward_caption属性（转发的内容就在text/caption中），用getattr避免AttributeError
     if not usdt_address and hasattr(reply_to_message, 'forward_from_message_id'):
-        if reply_to_message.forward_text:
+        if getattr(reply_to_message, 'forward_text', None):
             usdt_address = extract_usdt_address(reply_to_message.forward_text)
-        elif reply_to_message.forward_caption:
+        elif getattr(reply_to_message, 'forward_caption', None):
             usdt_address = extract_usdt_address(reply_to_message.forward_caption)
     
     # 尝试从实体(entities)中提取
@@ -3681,8 +4390,7 @@ def handle_usdt_query(update, context):
         trc20_balance = query_trc20_usdt_balance(usdt_address)
         
         # 获取当前时间 (简短格式)
-        current_time = datetime.datetime.now(timezone).strftime('%H:%M:%S')
-        current_date = datetime.datetime.now(timezone).strftime('%Y-%m-%d')
+        current_date, current_time = get_current_timestamp().split(' ')
         
         # 完全按照用户要求的简洁模板
         if trc20_balance is not None:
@@ -3711,6 +4419,7 @@ def handle_usdt_query(update, context):
             text=f"❌ 查询USDT余额时出错: {str(e)}"
         )
 
+@timed_route
 def export_current_bill(query, context, chat_id):
     """导出当前账单为文件，包括入款和出款记录"""
     user = query.from_user
@@ -3732,41 +4441,42 @@ def export_current_bill(query, context, chat_id):
         # 获取该聊天的账单数据
         chat_data = get_chat_accounting(chat_id)
         
-        # 生成摘要
-        summary_text = generate_bill_summary(chat_id, chat_title, chat_data)
-        
-        # 导出为文件
-        file_path = export_group_data_to_txt(chat_title, summary_text)
-        
-        if file_path:
-            # 发送文件
-            with open(file_path, 'rb') as f:
-                context.bot.send_document(
-                    chat_id=query.message.chat_id,
-                    document=f,
-                    filename=f"{chat_title}_账单.txt",
-                    caption=f"{chat_title} 账单详情"
-                )
-            # 删除临时文件
-            os.remove(file_path)
-            logger.info(f"已发送群组 {chat_id} 的账单文件")
-            
-            # 更新消息
-            keyboard = [[InlineKeyboardButton("查看历史账单", callback_data=f"view_history_{chat_id}")]]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            query.edit_message_text("账单已导出为文件", reply_markup=reply_markup)
-        else:
-            query.edit_message_text("导出账单时出错")
-            logger.error(f"导出群组 {chat_id} 账单时出错")
+        # 文件头之后接逐行生成的账单明细
+        header = [
+            f"===== {chat_title} 财务账单 =====\n",
+            f"导出时间: {get_current_timestamp()}\n\n",
+        ]
+        send_report_document(
+            context.bot,
+            query.message.chat_id,
+            itertools.chain(header, iter_bill_detail_lines(chat_title, chat_data)),
+            filename=f"{chat_title}_账单.txt",
+            caption=f"{chat_title} 账单详情"
+        )
+        logger.info(f"已发送群组 {chat_id} 的账单文件")
+        
+        # 更新消息
+        keyboard = [[InlineKeyboardButton("查看历史账单", callback_data=f"view_history_{chat_id}")]]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        query.edit_message_text("账单已导出为文件", reply_markup=reply_markup)
     except Exception as e:
         logger.error(f"导出当前账单时出错: {e}", exc_info=True)
         query.edit_message_text(f"导出账单时出错: {str(e)}")
 
-def generate_bill_summary(chat_id, chat_title, chat_data):
-    """生成账单摘要文本"""
+def iter_chat_history_detail_lines(chat_id, chat_title, date_str):
+    """逐行生成群组指定日期的历史账单明细，按需加载历史数据"""
+    historical_data = get_chat_history(chat_id, date_str)
+    if historical_data is None:
+        raise ValueError(f"{chat_title} 没有 {date_str} 的历史账单记录")
+    yield from iter_bill_detail_lines(f"{chat_title} ({date_str})", historical_data)
+
+def iter_bill_detail_lines(chat_title, chat_data):
+    """逐行生成账单明细：汇总信息加按时间倒序的入款、出款记录"""
+    aggregate = aggregate_records([chat_data])
+    
     # 收款部分
-    deposit_total = sum(deposit['amount'] for deposit in chat_data['deposits'])
-    deposit_count = len(chat_data['deposits'])
+    deposit_total = aggregate['deposit_total']
+    deposit_count = aggregate['deposit_count']
     
     # 汇率和费率部分
     rate = chat_data.get('fixed_rate', 1.0)
@@ -3776,36 +4486,33 @@ def generate_bill_summary(chat_id, chat_title, chat_data):
     actual_amount = deposit_total / rate if rate != 0 else 0
     
     # 出款部分
-    withdrawal_total_local = sum(withdraw['amount'] for withdraw in chat_data['withdrawals'])
-    withdrawal_total_usdt = sum(withdraw['usd_equivalent'] for withdraw in chat_data['withdrawals'])
-    withdrawal_count = len(chat_data['withdrawals'])
+    withdrawal_total_usdt = aggregate['withdrawal_usdt']
+    withdrawal_count = aggregate['withdrawal_count']
     
     # 计算应下发金额
     to_be_withdrawn = actual_amount
     already_withdrawn = withdrawal_total_usdt
     not_yet_withdrawn = to_be_withdrawn - already_withdrawn
     
-    # 生成摘要文本
-    summary_text = f"====== {chat_title} 账单明细 ======\n\n"
+    yield f"====== {chat_title} 账单明细 ======\n\n"
     
-    # 添加日期和时间信息
-    current_date = datetime.datetime.now(timezone).strftime('%Y-%m-%d')
-    current_time = datetime.datetime.now(timezone).strftime('%H:%M:%S')
-    summary_text += f"生成时间: {current_date} {current_time}\n\n"
+    # 日期和时间信息
+    current_date, current_time = get_current_timestamp().split(' ')
+    yield f"生成时间: {current_date} {current_time}\n\n"
     
-    # 添加统计信息
-    summary_text += f"费率: {fee_rate}%\n"
-    summary_text += f"固定汇率: {rate}\n"
-    summary_text += f"总入款: {deposit_total:.2f}\n"
-    summary_text += f"应下发: {to_be_withdrawn:.2f}U\n"
-    summary_text += f"已下发: {already_withdrawn:.2f}U\n"
-    summary_text += f"未下发: {not_yet_withdrawn:.2f}U\n\n"
+    # 统计信息
+    yield f"费率: {fee_rate}%\n"
+    yield f"固定汇率: {rate}\n"
+    yield f"总入款: {deposit_total:.2f}\n"
+    yield f"应下发: {to_be_withdrawn:.2f}U\n"
+    yield f"已下发: {already_withdrawn:.2f}U\n"
+    yield f"未下发: {not_yet_withdrawn:.2f}U\n\n"
     
     # 入款明细
-    summary_text += f"===== 入款明细 =====\n"
+    yield f"===== 入款明细 =====\n"
     if deposit_count > 0:
         # 按时间排序
-        sorted_deposits = sorted(chat_data['deposits'], key=lambda x: x.get('time', ''), reverse=True)
+        sorted_deposits = sorted(aggregate['deposits'], key=lambda x: x.get('time', ''), reverse=True)
         
         # 显示每个入款记录
         for i, deposit in enumerate(sorted_deposits, 1):
@@ -3815,15 +4522,15 @@ def generate_bill_summary(chat_id, chat_title, chat_data):
             # 计算美元等值
             usd_equivalent = amount / rate if rate != 0 else 0
             
-            summary_text += f"{i}. 时间: {time_str}, 金额: {amount:.2f}, 用户: {username}, USD等值: {usd_equivalent:.2f}\n"
+            yield f"{i}. 时间: {time_str}, 金额: {amount:.2f}, 用户: {username}, USD等值: {usd_equivalent:.2f}\n"
     else:
-        summary_text += "暂无入款记录\n"
+        yield "暂无入款记录\n"
     
     # 出款明细
-    summary_text += f"\n===== 出款明细 =====\n"
+    yield f"\n===== 出款明细 =====\n"
     if withdrawal_count > 0:
         # 按时间排序
-        sorted_withdrawals = sorted(chat_data['withdrawals'], key=lambda x: x.get('time', ''), reverse=True)
+        sorted_withdrawals = sorted(aggregate['withdrawals'], key=lambda x: x.get('time', ''), reverse=True)
         
         # 显示每个出款记录
         for i, withdrawal in enumerate(sorted_withdrawals, 1):
@@ -3832,16 +4539,19 @@ def generate_bill_summary(chat_id, chat_title, chat_data):
             time_str = withdrawal.get('time', '未知时间')
             usd_equivalent = withdrawal['usd_equivalent']
             
-            summary_text += f"{i}. 时间: {time_str}, 金额: {amount:.2f}, 用户: {username}, USD等值: {usd_equivalent:.2f}\n"
+            yield f"{i}. 时间: {time_str}, 金额: {amount:.2f}, 用户: {username}, USD等值: {usd_equivalent:.2f}\n"
     else:
-        summary_text += "暂无出款记录\n"
-    
-    return summary_text
+        yield "暂无出款记录\n"
 
+@timed_route
 def summary(update: Update, context: CallbackContext) -> None:
     """Show accounting summary."""
     if not is_authorized(update):
         return
+    
+    # 批量处理积压的更新时每个群组只在最后回复一次
+    if defer_catch_up_summary(update, context):
+        return
         
     chat_id = update.effective_chat.id
     chat_type = update.effective_chat.type
@@ -3852,123 +4562,12 @@ def summary(update: Update, context: CallbackContext) -> None:
     # 获取该聊天的账单数据
     chat_data = get_chat_accounting(chat_id)
     
-    # 收款部分
-    deposit_total = sum(deposit['amount'] for deposit in chat_data['deposits'])
-    deposit_count = len(chat_data['deposits'])
-    
-    # 统计每个用户的入款
-    user_deposits = {}
-    for deposit in chat_data['deposits']:
-        username = deposit['user']
-        amount = deposit['amount']
-        if username not in user_deposits:
-            user_deposits[username] = 0
-        user_deposits[username] += amount
-    
-    # 统计以回复用户为分类的入款信息
-    responder_deposits = {}
-    for deposit in chat_data['deposits']:
-        # 只处理有回复者信息的记录
-        if 'responder' in deposit and deposit['responder']:
-            responder = deposit['responder']
-            username = deposit['user']
-            amount = deposit['amount']
-            
-            # 创建或更新此回复者的记录
-            if responder not in responder_deposits:
-                responder_deposits[responder] = {'total': 0, 'users': {}}
-            
-            responder_deposits[responder]['total'] += amount
-            
-            # 记录是哪个用户对这个回复者进行了入款
-            if username not in responder_deposits[responder]['users']:
-                responder_deposits[responder]['users'][username] = 0
-            responder_deposits[responder]['users'][username] += amount
-    
-    # 计算用户分类数量
-    user_count = len(chat_data['users'])
-    responder_count = len(responder_deposits)
-    
     # 汇率和费率部分
     rate = chat_data.get('fixed_rate', 1.0)
     fee_rate = chat_data.get('rate', 0.0)
     
-    # 计算实际金额 - 使用除法计算
-    actual_amount = deposit_total / rate if rate != 0 else 0
-    
-    # 出款部分 - 从withdrawals中提取USDT金额(usd_equivalent)
-    withdrawal_total_local = sum(withdraw['amount'] for withdraw in chat_data['withdrawals'])
-    withdrawal_total_usdt = sum(withdraw['usd_equivalent'] for withdraw in chat_data['withdrawals'])
-    withdrawal_count = len(chat_data['withdrawals'])
-    
-    # 计算应下发金额（USDT）
-    to_be_withdrawn = actual_amount
-    already_withdrawn = withdrawal_total_usdt
-    not_yet_withdrawn = to_be_withdrawn - already_withdrawn
-    
     # 按照用户要求的模板格式生成账单摘要
-    summary_text = f"====== {chat_title} ======\n\n"
-    
-    summary_text += f"入款（{deposit_count}笔）：\n"
-    if deposit_count > 0:
-        # 按时间排序，最新的在前面
-        sorted_deposits = sorted(chat_data['deposits'], key=lambda x: x.get('time', ''), reverse=True)
-        # 获取最新的6笔入款记录
-        latest_deposits = sorted_deposits[:6]
-        
-        # 显示每个入款记录及其回复人
-        for deposit in latest_deposits:
-            amount = deposit['amount']
-            # 计算美元等值：金额除以汇率
-            usd_equivalent = amount / rate if rate != 0 else 0
-            responder = deposit.get('responder', '无回复人')
-            
-            # 提取时间戳中的小时和分钟
-            time_str = deposit.get('time', '')
-            time_parts = time_str.split(' ')
-            if len(time_parts) > 1:
-                time_part = time_parts[1]  # 获取时间部分 (HH:MM:SS)
-                hour_min = ':'.join(time_part.split(':')[:2])  # 只保留小时和分钟
-            else:
-                hour_min = "00:00"  # 默认时间
-                
-            # 使用新的格式: HH:MM 金额/汇率 =美元等值 回复人
-            responder_display = "" if responder is None or responder == "None" else responder
-            summary_text += f"  {hour_min} {amount:.0f}/{rate} ={usd_equivalent:.2f} {responder_display}\n"
-    else:
-        summary_text += "  暂无入金\n"
-    
-    summary_text += f"\n分类（{responder_count}人）：\n"
-    if responder_count > 0:
-        for responder, data in responder_deposits.items():
-            total_amount = data['total']
-            # 简化显示格式，只显示回复者和金额
-            summary_text += f"  {responder} {total_amount:.2f}\n"
-    else:
-        summary_text += "  暂无分类\n"
-    
-    summary_text += f"\n下发（{withdrawal_count}笔）：\n"
-    if withdrawal_count > 0:
-        user_withdrawals = {}
-        for withdrawal in chat_data['withdrawals']:
-            username = withdrawal['user']
-            # 使用USDT金额而不是本地货币
-            amount = withdrawal['usd_equivalent']
-            if username not in user_withdrawals:
-                user_withdrawals[username] = 0
-            user_withdrawals[username] += amount
-        
-        for username, amount in user_withdrawals.items():
-            summary_text += f"  {username}: {amount:.2f}\n"
-    else:
-        summary_text += "  暂无下发\n"
-    
-    summary_text += f"\n费率：{fee_rate}%\n"
-    summary_text += f"固定汇率：{rate}\n"
-    summary_text += f"总入款：{deposit_total:.2f}\n"
-    summary_text += f"应下发：{deposit_total:.2f}｜{to_be_withdrawn:.2f}U\n"
-    summary_text += f"已下发：{withdrawal_total_local:.2f}｜{already_withdrawn:.2f}U\n"
-    summary_text += f"未下发：{deposit_total-withdrawal_total_local:.2f}｜{not_yet_withdrawn:.2f}U\n"
+    summary_text = format_bill_summary(chat_title, aggregate_records([chat_data]), rate, fee_rate)
     
     try:
         # 创建账单和历史记录按钮
@@ -3995,12 +4594,13 @@ def summary(update: Update, context: CallbackContext) -> None:
         except Exception as e2:
             logger.error(f"备选方法发送账单摘要也失败: {e2}", exc_info=True)
 
+@traced
 def button_callback(update: Update, context: CallbackContext) -> None:
     """Handle button callbacks from inline keyboards."""
     query = update.callback_query
     data = query.data
     
-    logger.info(f"收到按钮回调: {data}")
+    logger.info("收到按钮回调: %s", data)
     
     # 确保回调处理后通知Telegram
     query.answer()
@@ -4048,10 +4648,95 @@ def button_callback(update: Update, context: CallbackContext) -> None:
         elif data.startswith("income_statement_"):
             date_str = data.split("_")[2]
             export_all_groups_statistics(query, context, date_str)
+        # 处理特定日期导出按钮 ("导出全部账单"命令的日期选择)
+        elif data.startswith("export_date_"):
+            parts = data.split("_")
+            if parts[2] == "back":
+                # 返回到日期选择
+                send_export_date_selection(query, int(parts[3]))
+            else:
+                export_specific_date_for_chat(query, context, parts[2], int(parts[3]))
+        # 处理菜单的第一页
+        elif data == "first_page":
+            keyboard = [
+                [InlineKeyboardButton("查看所有群组当日统计", callback_data="all_groups_today")],
+                [InlineKeyboardButton("按日期查看所有群组", callback_data="all_groups_by_date")],
+                [InlineKeyboardButton("查看当前群组7天账单", callback_data="current_group_7days")]
+            ]
+            reply_markup = InlineKeyboardMarkup(keyboard)
+            query.edit_message_text("请选择要查看的账单类型:", reply_markup=reply_markup)
+        # 处理"查看所有群组当日统计"按钮
+        elif data == "all_groups_today":
+            export_all_groups_statistics(query, context, get_current_date())
+        # 处理"按日期查看所有群组"按钮
+        elif data == "all_groups_by_date":
+            send_date_selection(query, context)
+        # 处理"查看当前群组7天账单"按钮
+        elif data == "current_group_7days":
+            export_current_group_all_bills(query, context)
+        # 处理日期选择按钮
+        elif data.startswith("date_"):
+            send_group_selection_for_date(query, context, data.split("_")[1])
+        # 处理群组选择按钮
+        elif data.startswith("group_"):
+            parts = data.split("_")
+            group_id = int(parts[1])
+            if len(parts) > 2:
+                # 如果提供了日期，导出该日期的群组账单
+                context.user_data['selected_date'] = parts[2]
+                export_group_by_selected_date(query, context, group_id)
+            else:
+                export_current_bill(query, context, group_id)
+        # 处理对账数据格式导出按钮: data_{格式}_days_{群组ID} / data_{格式}_stats_{日期}
+        elif data.startswith("data_"):
+            _, data_format, scope, target = data.split("_", 3)
+            if scope == "days":
+                export_current_group_records_data(query, context, int(target), data_format)
+            else:
+                export_all_groups_statistics_data(query, context, target, data_format)
+        # 处理"打包导出所有群组"按钮
+        elif data.startswith("zip_groups_"):
+            export_all_groups_zip(query, context, data[len("zip_groups_"):])
+        # 处理返回按钮 (回到群组选择)
+        elif data.startswith("back_to_groups_for_date_"):
+            send_group_selection_for_date(query, context, data.split("_")[-1])
+        # 处理返回按钮 (回到日期选择)
+        elif data == "back_to_dates":
+            send_date_selection(query, context)
+        # 处理返回按钮 (回到日期选择，用于财务查账命令)
+        elif data == "back_to_dates_first":
+            send_date_selection_first(query, context)
+        # 处理一键复制地址按钮
+        elif data.startswith("copy_address_"):
+            usdt_address = data[len("copy_address_"):]
+            logger.info(f"用户请求复制地址: {usdt_address}")
+            
+            # 发送单独的消息，包含完整地址，方便用户复制
+            context.bot.send_message(
+                chat_id=query.message.chat_id,
+                text=f"<code>{usdt_address}</code>\n\n👆 点击上方地址可复制",
+                parse_mode=ParseMode.HTML
+            )
         else:
             logger.warning(f"未知的回调数据: {data}")
             query.edit_message_text("未知的操作")
 
+def send_export_date_selection(query, chat_id):
+    """显示"导出全部账单"的最近7天日期选择"""
+    dates = get_recent_dates(7)
+    
+    # 创建日期选择按钮
+    keyboard = []
+    row = []
+    for i, date in enumerate(dates):
+        row.append(InlineKeyboardButton(date, callback_data=f"export_date_{date}_{chat_id}"))
+        if (i + 1) % 2 == 0 or i == len(dates) - 1:  # 每两个日期一行，或者是最后一个日期
+            keyboard.append(row)
+            row = []
+    
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    query.edit_message_text("请选择要导出的日期:", reply_markup=reply_markup)
+
 def show_history_selection(query, context, chat_id):
     """显示历史账单选择界面"""
     user = query.from_user
@@ -4067,17 +4752,14 @@ def show_history_selection(query, context, chat_id):
         chat = context.bot.get_chat(chat_id)
         chat_title = getattr(chat, 'title', f'Chat {chat_id}')
         
-        # 获取该聊天的账单数据
-        chat_data = get_chat_accounting(chat_id)
+        # 只读取历史日期列表，不加载账单内容
+        dates = get_chat_history_dates(chat_id)
         
         # 检查是否有历史记录
-        if 'history' not in chat_data or not chat_data['history']:
+        if not dates:
             query.edit_message_text(f"{chat_title} 没有历史账单记录")
             return
         
-        # 按日期排序
-        dates = sorted(chat_data['history'].keys(), reverse=True)
-        
         # 创建日期选择按钮
         keyboard = []
         for date in dates:
@@ -4093,6 +4775,7 @@ def show_history_selection(query, context, chat_id):
         logger.error(f"显示历史账单选择界面时出错: {e}", exc_info=True)
         query.edit_message_text(f"显示历史账单选择界面时出错: {str(e)}")
 
+@timed_route
 def view_historical_bill(query, context, chat_id, date_str):
     """查看特定日期的历史账单"""
     user = query.from_user
@@ -4108,97 +4791,259 @@ def view_historical_bill(query, context, chat_id, date_str):
         chat = context.bot.get_chat(chat_id)
         chat_title = getattr(chat, 'title', f'Chat {chat_id}')
         
-        # 获取该聊天的账单数据
-        chat_data = get_chat_accounting(chat_id)
-        
         # 检查是否有该日期的历史记录
-        if 'history' not in chat_data or date_str not in chat_data['history']:
+        if get_chat_history_version(chat_id, date_str) is None:
             query.edit_message_text(f"{chat_title} 没有 {date_str} 的历史账单记录")
             return
         
-        # 获取历史数据
-        historical_data = chat_data['history'][date_str]
-        
-        # 生成摘要
-        summary_text = generate_bill_summary(chat_id, f"{chat_title} ({date_str})", historical_data)
-        
-        # 导出为文件
-        file_path = export_historical_data_to_txt(chat_title, date_str, summary_text)
-        
-        if file_path:
-            # 发送文件
-            with open(file_path, 'rb') as f:
-                context.bot.send_document(
-                    chat_id=query.message.chat_id,
-                    document=f,
-                    filename=f"{chat_title}_{date_str}_历史账单.txt",
-                    caption=f"{chat_title} {date_str} 历史账单详情"
-                )
-            # 删除临时文件
-            os.remove(file_path)
-            logger.info(f"已发送群组 {chat_id} 的 {date_str} 历史账单文件")
-            
-            # 更新消息
-            keyboard = [[InlineKeyboardButton("返回历史选择", callback_data=f"view_history_{chat_id}")]]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            query.edit_message_text(f"{date_str} 历史账单已导出为文件", reply_markup=reply_markup)
-        else:
-            query.edit_message_text("导出历史账单时出错")
-            logger.error(f"导出群组 {chat_id} 的 {date_str} 历史账单时出错")
+        # 发送逐行生成的账单明细，命中导出缓存时不加载历史数据
+        send_report_document(
+            context.bot,
+            query.message.chat_id,
+            iter_chat_history_detail_lines(chat_id, chat_title, date_str),
+            filename=f"{chat_title}_{date_str}_历史账单.txt",
+            caption=f"{chat_title} {date_str} 历史账单详情",
+            cache_key=get_export_cache_key(chat_id, date_str, 'history_txt', chat_title, live_records=False)
+        )
+        logger.info(f"已发送群组 {chat_id} 的 {date_str} 历史账单文件")
+        
+        # 更新消息
+        keyboard = [[InlineKeyboardButton("返回历史选择", callback_data=f"view_history_{chat_id}")]]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        query.edit_message_text(f"{date_str} 历史账单已导出为文件", reply_markup=reply_markup)
     except Exception as e:
         logger.error(f"查看历史账单时出错: {e}", exc_info=True)
         query.edit_message_text(f"查看历史账单时出错: {str(e)}")
 
-def export_historical_data_to_txt(chat_title, date_str, summary_text):
-    """将历史账单数据导出为文本文件"""
-    try:
-        # 创建临时目录（如果不存在）
-        os.makedirs('temp', exist_ok=True)
-        
-        # 创建文件名
-        file_path = os.path.join('temp', f"{chat_title}_{date_str}_history.txt")
-        
-        # 写入文件
-        with open(file_path, 'w', encoding='utf-8') as f:
-            f.write(summary_text)
-        
-        return file_path
-    except Exception as e:
-        logger.error(f"导出历史数据到文本文件时出错: {e}", exc_info=True)
-        return None
-
+@traced
 def save_data():
-    """将账单数据保存到文件"""
+    """将账单数据保存到文件（历史账单单独存储在HISTORY_DIR中）"""
+    # 批量处理积压的更新时只在最后保存一次
+    if catch_up_state is not None:
+        catch_up_state['dirty'] = True
+        return
+    
+    start = time.perf_counter()
     try:
-        with open('bot_data.json', 'w', encoding='utf-8') as f:
+        tmp_path = f"{DATA_FILE}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
             json.dump({
                 'chat_accounting': chat_accounting,
-                'group_operators': group_operators,
-                'authorized_groups': list(authorized_groups)
+                'group_operators': {chat_id: sorted(operators) for chat_id, operators in group_operators.items()},
+                'authorized_groups': list(authorized_groups),
+                'last_reset_date': last_reset_date,
+                'pending_archives': list(pending_archives),
+                'last_update_id': last_update_id,
+                'last_update_time': last_update_time,
             }, f, ensure_ascii=False)
+            size = f.tell()
+        os.replace(tmp_path, DATA_FILE)
+        observe_metric('bot_save_duration_seconds', time.perf_counter() - start)
+        set_metric('bot_save_bytes', size)
         logger.info("账单数据已保存到文件")
     except Exception as e:
         logger.error(f"保存数据时出错: {e}", exc_info=True)
 
 def load_data():
-    """从文件加载账单数据"""
-    global chat_accounting, group_operators, authorized_groups
+    """从文件加载账单数据，历史账单不在启动时加载"""
+    global chat_accounting, group_operators, authorized_groups, last_reset_date, last_update_id, last_update_time
     try:
-        if os.path.exists('bot_data.json'):
-            with open('bot_data.json', 'r', encoding='utf-8') as f:
+        if os.path.exists(DATA_FILE):
+            with open(DATA_FILE, 'r', encoding='utf-8') as f:
                 data = json.load(f)
-                chat_accounting = data['chat_accounting']
-                group_operators = data['group_operators']
-                authorized_groups = set(data['authorized_groups'])
+            
+            # JSON会把聊天ID键变成字符串，这里还原为整数
+            chat_accounting = {}
+            migrated_count = 0
+            for chat_id, chat_data in data['chat_accounting'].items():
+                chat_id = normalize_chat_id(chat_id)
+                
+                # 兼容旧格式：把内嵌在账单中的历史记录迁移到历史存储
+                history = chat_data.pop('history', None) or {}
+                for date_str, day_data in history.items():
+                    if not os.path.exists(get_chat_history_path(chat_id, date_str)):
+                        save_chat_history(chat_id, date_str, day_data)
+                        migrated_count += 1
+                
+                chat_accounting[chat_id] = chat_data
+            
+            group_operators = {normalize_chat_id(chat_id): set(operators) for chat_id, operators in data['group_operators'].items()}
+            authorized_groups = set(normalize_chat_id(chat_id) for chat_id in data['authorized_groups'])
+            last_reset_date = data.get('last_reset_date')
+            last_update_id = data.get('last_update_id')
+            last_update_time = data.get('last_update_time')
+            pending_archives.clear()
+            pending_archives.extend((normalize_chat_id(chat_id), chat_data) for chat_id, chat_data in data.get('pending_archives', []))
+            
+            if migrated_count:
+                logger.info(f"已将 {migrated_count} 份内嵌历史账单迁移到 {HISTORY_DIR}")
+                save_data()
             logger.info("成功从文件加载账单数据")
         else:
             logger.info("未找到数据文件，使用默认空数据")
     except Exception as e:
         logger.error(f"加载数据时出错: {e}", exc_info=True)
 
+class ProfileControl:
+    """放入更新队列的性能分析控制消息，由消息处理线程执行（cProfile只能分析启用它的线程）"""
+    def __init__(self, action, kind=None, seconds=None, chat_ids=None):
+        self.action = action
+        self.kind = kind
+        self.seconds = seconds
+        self.chat_ids = chat_ids
+
+def get_admin_chat_ids():
+    """全局管理员的私聊ID列表"""
+    if isinstance(admin_user_id, list):
+        return list(admin_user_id)
+    return [admin_user_id] if admin_user_id else []
+
+def start_profiling(kind, seconds, chat_ids, job_queue, update_queue):
+    """开始限时采集，到时后把结果发送到chat_ids；已有采集在进行时返回False
+    
+    CPU分析必须在消息处理线程中调用，分析的是处理更新的代码；内存分析跟踪所有线程的分配
+    """
+    with profile_lock:
+        if profile_state['kind'] is not None:
+            return False
+        profile_state.update(kind=kind, chat_ids=chat_ids, started=time.time())
+    
+    # 性能分析模块只在使用时导入，不增加启动耗时
+    if kind == 'cpu':
+        import cProfile
+        profiler = cProfile.Profile()
+        profile_state['profiler'] = profiler
+        profiler.enable()
+        # 停止同样要在消息处理线程中执行，到时后放入停止消息
+        job_queue.run_once(lambda context: update_queue.put(ProfileControl('stop')), seconds)
+    else:
+        import tracemalloc
+        tracemalloc.start()
+        profile_state['snapshot'] = tracemalloc.take_snapshot()
+        job_queue.run_once(lambda context: finish_profiling(context.bot), seconds)
+    
+    logger.info(f"开始{seconds}秒的{'CPU' if kind == 'cpu' else '内存'}分析")
+    return True
+
+def iter_cpu_profile_lines(profiler, elapsed):
+    """逐行生成CPU分析报告：按累计耗时和自身耗时排序的函数"""
+    import pstats
+    
+    yield f"===== CPU分析（消息处理线程，{elapsed:.1f}秒） =====\n\n"
+    for sort_key, title in (('cumulative', '按累计耗时'), ('tottime', '按自身耗时')):
+        output = io.StringIO()
+        pstats.Stats(profiler, stream=output).sort_stats(sort_key).print_stats(PROFILE_TOP_COUNT)
+        yield f"===== {title}排序 =====\n"
+        yield output.getvalue()
+        yield "\n"
+
+def iter_memory_profile_lines(snapshot, start_snapshot, elapsed, current, peak):
+    """逐行生成内存分析报告：当前占用最多的分配位置，以及采集期间增长最多的分配位置"""
+    yield f"===== 内存分析（{elapsed:.1f}秒） =====\n"
+    yield f"跟踪到的内存: 当前 {current / 1024:.1f}KB, 峰值 {peak / 1024:.1f}KB\n\n"
+    
+    yield "===== 占用最多的分配位置 =====\n"
+    for stat in snapshot.statistics('lineno')[:PROFILE_TOP_COUNT]:
+        yield f"{stat}\n"
+    
+    yield "\n===== 采集期间增长最多的分配位置 =====\n"
+    for stat in snapshot.compare_to(start_snapshot, 'lineno')[:PROFILE_TOP_COUNT]:
+        yield f"{stat}\n"
+
+def finish_profiling(bot):
+    """停止当前采集，把报告作为文件发送给发起者"""
+    with profile_lock:
+        state = dict(profile_state)
+        profile_state.update(kind=None, chat_ids=None, profiler=None, snapshot=None, started=None)
+    if state['kind'] is None:
+        return
+    
+    elapsed = time.time() - state['started']
+    timestamp = get_now().strftime('%Y%m%d_%H%M%S')
+    if state['kind'] == 'cpu':
+        state['profiler'].disable()
+        lines = list(iter_cpu_profile_lines(state['profiler'], elapsed))
+        filename = f"cpu_profile_{timestamp}.txt"
+    else:
+        import tracemalloc
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        # 不统计tracemalloc自身的分配
+        filters = [tracemalloc.Filter(False, tracemalloc.__file__)]
+        lines = list(iter_memory_profile_lines(snapshot.filter_traces(filters), state['snapshot'].filter_traces(filters),
+                                               elapsed, current, peak))
+        filename = f"memory_profile_{timestamp}.txt"
+    logger.info(f"性能分析结束，共{elapsed:.1f}秒")
+    
+    for chat_id in state['chat_ids']:
+        try:
+            send_report_document(bot, chat_id, lines, filename=filename, caption=f"性能分析结果（{elapsed:.0f}秒）")
+        except Exception as e:
+            logger.error(f"发送性能分析结果到 {chat_id} 时出错: {e}", exc_info=True)
+
+def handle_profile_control(update, context):
+    """在消息处理线程中执行性能分析控制消息"""
+    if update.action == 'start':
+        if not start_profiling(update.kind, update.seconds, update.chat_ids, context.job_queue, context.dispatcher.update_queue):
+            logger.warning("已有性能分析在进行，忽略新的分析请求")
+    else:
+        finish_profiling(context.bot)
+
+def profile_command(update: Update, context: CallbackContext) -> None:
+    """管理员命令 /profile [cpu|mem] [秒数]：限时性能分析，结果以文件发送到当前聊天"""
+    user = update.effective_user
+    if not is_global_admin(user.id, user.username):
+        logger.warning(f"非全局管理员 {user.id} (@{user.username}) 尝试使用性能分析命令")
+        update.message.reply_text("❌ 只有全局管理员才能执行此命令")
+        return
+    
+    kind = context.args[0] if context.args else 'cpu'
+    if kind not in ('cpu', 'mem'):
+        update.message.reply_text("使用方法: /profile [cpu|mem] [秒数]")
+        return
+    try:
+        seconds = int(context.args[1]) if len(context.args) > 1 else PROFILE_DEFAULT_SECONDS
+    except ValueError:
+        update.message.reply_text("使用方法: /profile [cpu|mem] [秒数]")
+        return
+    seconds = max(1, min(seconds, PROFILE_MAX_SECONDS))
+    
+    if start_profiling(kind, seconds, [update.effective_chat.id], context.job_queue, context.dispatcher.update_queue):
+        update.message.reply_text(f"已开始{seconds}秒的{'CPU' if kind == 'cpu' else '内存'}分析，结束后发送结果")
+    else:
+        update.message.reply_text("已有性能分析在进行，请等待结束")
+
+def profile_signal_handler(signum, frame):
+    """SIGUSR1开始CPU分析、SIGUSR2开始内存分析，结果发送给全局管理员"""
+    if bot_updater is None:
+        return
+    kind = 'cpu' if signum == signal.SIGUSR1 else 'mem'
+    logger.info(f"收到信号 {signum}，请求{kind}分析")
+    # 信号处理函数在主线程中执行，交给消息处理线程开始分析
+    bot_updater.dispatcher.update_queue.put(ProfileControl('start', kind, PROFILE_DEFAULT_SECONDS, get_admin_chat_ids()))
+
 class HealthCheckHandler(BaseHTTPRequestHandler):
-    """健康检查HTTP处理器，防止Render休眠"""
+    """健康检查HTTP处理器，防止Render休眠；/metrics 输出运行指标"""
     def do_GET(self):
+        if self.path.split('?', 1)[0] == '/metrics':
+            body = render_metrics().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        
+        if self.path.split('?', 1)[0] == '/traces':
+            body = render_trace_report().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-type', 'text/plain; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        
         self.send_response(200)
         self.send_header('Content-type', 'text/plain')
         self.end_headers()
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""计算器单次求值耗时：命中编译缓存 vs 每次重新解析 vs 旧实现；以及消息词法分类的耗时
+
+用法: python benchmarks/bench_calculator.py [每个表达式的次数]
+"""
+import sys
+import time
+
+from common import load_bot
+
+EXPRESSIONS = [
+    '1500*7.2-300',
+    '(2000+350)/7.15',
+    '100*3+50*2-20',
+    'round(8888/7.2, 2)',
+    '9**9**9',
+]
+
+# 群组里常见的消息：普通聊天文本、记账快捷指令和算式
+MESSAGES = [
+    '今天的汇率是多少',
+    'ok',
+    '+1000',
+    '计算 1500*7.2-300',
+    '1500*7.2-300',
+]
+
+def legacy_classify(text):
+    """旧的路由判断：多次strip和startswith，数学表达式每次导入re并匹配未预编译的模式"""
+    if text.strip().startswith('+') or text.strip().startswith('-'):
+        return 'sign'
+    if text.strip().startswith('计算') or text.strip().startswith('calc'):
+        return 'calc'
+    import re
+    text = text.strip()
+    if re.match(r'^[\d\s\+\-\*\/\(\)\.\,\^\%]+$', text):
+        if any(op in text for op in ['+', '-', '*', '/', '(', ')', '^', '%']):
+            return 'math'
+    return None
+
+def legacy_calculate(expression):
+    """旧实现：每次调用都导入模块、重建白名单并重新解析，乘方没有上限（仅用于对比，不计算超大乘方）"""
+    import ast
+    import operator
+    import math
+    allowed_names = {'abs': abs, 'round': round, 'min': min, 'max': max, 'pow': pow, 'sum': sum,
+                     'int': int, 'float': float, 'sqrt': math.sqrt, 'pi': math.pi, 'e': math.e}
+    operators = {ast.Add: operator.add, ast.Sub: operator.sub, ast.Mult: operator.mul,
+                 ast.Div: operator.truediv, ast.Pow: operator.pow, ast.USub: operator.neg}
+
+    def safe_eval(node):
+        if isinstance(node, ast.BinOp):
+            return operators[type(node.op)](safe_eval(node.left), safe_eval(node.right))
+        elif isinstance(node, ast.UnaryOp):
+            return operators[type(node.op)](safe_eval(node.operand))
+        elif isinstance(node, ast.Call):
+            return allowed_names[node.func.id](*[safe_eval(arg) for arg in node.args])
+        elif isinstance(node, ast.Name):
+            return allowed_names[node.id]
+        return node.value
+
+    return safe_eval(ast.parse(expression, mode='eval').body)
+
+def per_call(func, expression, count):
+    """平均每次调用的耗时（微秒）"""
+    start = time.perf_counter()
+    for _ in range(count):
+        func(expression)
+    return (time.perf_counter() - start) / count * 1e6
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    bot = load_bot()
+
+    def cached(expression):
+        try:
+            bot.compile_expression(expression)()
+        except ValueError:
+            pass
+
+    def uncached(expression):
+        bot.calculator_cache.clear()
+        cached(expression)
+
+    print(f"{'表达式':<20} {'缓存(us)':>10} {'不缓存(us)':>12} {'旧实现(us)':>12}")
+    for expression in EXPRESSIONS:
+        # 旧实现会真正计算9**9**9，不参与对比
+        legacy = '-' if '**' in expression else f"{per_call(legacy_calculate, expression, count):.2f}"
+        print(f"{expression:<20} {per_call(cached, expression, count):>10.2f} "
+              f"{per_call(uncached, expression, count):>12.2f} {legacy:>12}")
+
+    print()
+    print(f"{'消息':<20} {'分类(us)':>10} {'旧路由(us)':>12}")
+    for message in MESSAGES:
+        print(f"{message:<20} {per_call(bot.classify_message, message, count):>10.2f} "
+              f"{per_call(legacy_classify, message, count):>12.2f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""导出报表的耗时和内存峰值：逐行流式写入有界缓冲 vs 先拼接整份报表
+
+用法: python benchmarks/bench_export.py [每天记录数]
+"""
+import io
+import sys
+import time
+import datetime
+import tracemalloc
+
+from common import load_bot, make_ledger
+
+DAYS = 7
+
+REPEAT = 5
+
+def measure(func):
+    """返回 (耗时秒, 内存峰值字节)；耗时取REPEAT次中最快的一次，单次测量受GC和调度影响很大。
+    tracemalloc本身很慢，耗时和内存分开测量"""
+    elapsed = float('inf')
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        func()
+        elapsed = min(elapsed, time.perf_counter() - start)
+
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+def render_streamed(bot, make_lines):
+    with bot.render_report(make_lines()) as buffer:
+        buffer.seek(0, io.SEEK_END)
+
+def render_concatenated(make_lines):
+    # 旧的做法：整份报表拼接成一个字符串后一次写入
+    content = ""
+    for line in make_lines():
+        content += line
+    with io.BytesIO() as buffer:
+        buffer.write(content.encode('utf-8'))
+
+def main():
+    per_day = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    bot = load_bot()
+
+    today = datetime.datetime.strptime(bot.get_current_date(), '%Y-%m-%d')
+    dates = [(today - datetime.timedelta(days=i)).strftime('%Y-%m-%d') for i in range(DAYS)]
+
+    # 一个群组最近7天、每天per_day条记录
+    ledger = make_ledger(0, dates[0])
+    for i, date_str in enumerate(dates):
+        day = make_ledger(per_day, date_str, seed=i)
+        ledger['deposits'].extend(day['deposits'])
+        ledger['withdrawals'].extend(day['withdrawals'])
+    rate = ledger['fixed_rate']
+    fee_rate = ledger['rate']
+
+    # 聚合结果只引用原有记录，提前计算，只比较报表生成和写入
+    week = bot.aggregate_records([ledger], dates=set(dates), by_date=True)
+    day = bot.aggregate_records([ledger], dates={dates[0]})
+
+    reports = [
+        ('最近7天账单', lambda: bot.iter_chat_all_days_export_lines('测试群组', dates, week, rate, fee_rate)),
+        ('指定日期账单', lambda: bot.iter_group_date_export_lines('测试群组', dates[0], day, rate, fee_rate)),
+        ('账单明细', lambda: bot.iter_bill_detail_lines('测试群组', ledger)),
+    ]
+
+    print(f"每天 {per_day} 条记录，共 {DAYS} 天")
+    print(f"{'报表':<10} {'方式':<6} {'耗时(ms)':>10} {'内存峰值(KB)':>14}")
+    for name, make_lines in reports:
+        for mode, func in (
+            ('流式', lambda: render_streamed(bot, make_lines)),
+            ('拼接', lambda: render_concatenated(make_lines)),
+        ):
+            elapsed, peak = measure(func)
+            print(f"{name:<10} {mode:<6} {elapsed * 1000:>10.1f} {peak / 1024:>14.1f}")
+
+if __name__ == '__main__':
+    main()
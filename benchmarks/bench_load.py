@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+"""多群组负载生成：模拟N个已授权群组、每群M个操作人，按配置的命令比例和目标速率发送消息，
+可在模拟的多天时间跨度内运行，使日期变更检查（归档、重置、clean_old_records）按生产环境的间隔触发。
+按时间窗口输出吞吐量、延迟分布、内存增长和save_data耗时
+
+用法:
+    python benchmarks/bench_load.py [--groups 10] [--operators 3] [--messages 5000]
+                                    [--rate 每秒消息数] [--days 模拟天数] [--mix '+N=50,财务=5,...']
+                                    [--windows 10] [--latency 秒]
+
+--rate 为0时尽快发送；--days 大于0时把模拟时间均匀分布到消息上，各群组的账单会跨天归档。
+"查询" 回复的消息中不包含地址，只走地址提取路径，不会访问外部余额接口。
+"""
+import argparse
+import time
+import random
+from collections import Counter
+
+from common import load_bot, percentile
+from bench_replay import make_user, message_update, callback_update, make_dispatcher, dispatch_update
+
+# 可用的命令：名称 -> (模板, 默认权重)；callback:开头的是按钮回调
+LOAD_MIX = {
+    '+N': ('+{amount}', 45),
+    '+N/rate': ('+{amount}/{rate}', 10),
+    '-N': ('-{amount}', 8),
+    '下发N': ('下发{usdt}', 10),
+    '查询': ('查询', 5),
+    '财务': ('财务', 6),
+    '导出当日': ('callback:export_bill_{chat_id}', 6),
+    '导出7天': ('callback:allbills_{chat_id}', 5),
+    '全部群组统计': ('callback:all_groups_today', 5),
+}
+
+def parse_mix(text):
+    """解析 '+N=50,财务=5' 形式的命令比例，未列出的命令权重为0"""
+    if not text:
+        return {name: weight for name, (_, weight) in LOAD_MIX.items()}
+    mix = {}
+    for item in text.split(','):
+        name, _, weight = item.strip().partition('=')
+        if name not in LOAD_MIX:
+            raise SystemExit(f"未知命令 {name}，可用: {', '.join(LOAD_MIX)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+def setup_groups(bot, dispatcher, group_count, operator_count, admin, start_id):
+    """全局管理员授权每个群组，并回复每个操作人的消息把其设为操作人，返回 ({群组ID: [操作人]}, 下一个消息ID)
+
+    群聊中 "设置操作人 @xxx" 会被当作发给其他机器人的命令忽略，所以使用回复的方式
+    """
+    groups = {}
+    update_id = start_id
+    for g in range(group_count):
+        chat_id = -1001000000000 - g
+        dispatch_update(bot, dispatcher, message_update(update_id, update_id, chat_id, admin, '授权群'))
+        update_id += 1
+        operators = [make_user(2000000 + g * 1000 + m, f"op{g}_{m}") for m in range(operator_count)]
+        for operator in operators:
+            greeting = message_update(update_id, update_id, chat_id, operator, '大家好')
+            dispatch_update(bot, dispatcher, greeting)
+            command = message_update(update_id + 1, update_id + 1, chat_id, admin, '设置操作人')
+            command['message']['reply_to_message'] = greeting['message']
+            dispatch_update(bot, dispatcher, command)
+            update_id += 2
+        groups[chat_id] = operators
+    return groups, update_id
+
+def make_load_update(name, update_id, chat_id, user, rng, date):
+    template = LOAD_MIX[name][0]
+    text = template.format(
+        amount=rng.choice([100, 200, 500, 1000, 2000, 5000]),
+        rate=rng.choice([7.1, 7.2, 7.3]),
+        usdt=rng.choice([10, 50, 100, 500]),
+        chat_id=chat_id,
+    )
+    if text.startswith('callback:'):
+        return callback_update(update_id, update_id, chat_id, user, text[len('callback:'):], date)
+    data = message_update(update_id, update_id, chat_id, user, text, date)
+    if name == '查询':
+        data['message']['reply_to_message'] = {
+            'message_id': update_id - 1,
+            'date': int(date),
+            'chat': data['message']['chat'],
+            'from': user,
+            'text': '老板查一下余额',
+        }
+    return data
+
+def save_stats(bot):
+    """返回save_data累计的 (次数, 总耗时秒)"""
+    histogram = bot.metric_values.get(bot.metric_key('bot_save_duration_seconds', None))
+    return (histogram[2], histogram[1]) if histogram else (0, 0.0)
+
+def main():
+    parser = argparse.ArgumentParser(description="多群组负载生成")
+    parser.add_argument('--groups', type=int, default=10)
+    parser.add_argument('--operators', type=int, default=3)
+    parser.add_argument('--messages', type=int, default=5000)
+    parser.add_argument('--rate', type=float, default=0.0, help="目标消息速率（条/秒），0表示不限速")
+    parser.add_argument('--days', type=float, default=0.0, help="模拟的时间跨度（天），0表示使用真实时间")
+    parser.add_argument('--mix', help="命令比例，如 '+N=50,下发N=10,财务=5'")
+    parser.add_argument('--windows', type=int, default=10, help="报告的时间窗口数")
+    parser.add_argument('--latency', type=float, default=0.0, help="每次Bot API调用的模拟延迟（秒）")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    bot = load_bot()
+    mix = parse_mix(args.mix)
+    names = [name for name in mix if mix[name] > 0]
+    weights = [mix[name] for name in names]
+    rng = random.Random(args.seed)
+
+    clock = None
+    if args.days > 0:
+        clock = bot.FakeClock(bot.get_now())
+        bot.set_clock(clock)
+    step = args.days * 86400 / max(args.messages, 1)  # 每条消息前进的模拟秒数
+
+    dispatcher, request = make_dispatcher(bot, args.latency)
+    admin = make_user(bot.admin_user_id[0] if isinstance(bot.admin_user_id, list) else bot.admin_user_id, 'load_admin')
+    # 与main()中的定时任务一样，启动时先检查一次日期
+    bot.check_date_change(bot.CallbackContext(dispatcher))
+    next_check = time.time() if clock is None else clock.now().timestamp()
+    next_check += bot.RESET_CHECK_INTERVAL
+    groups, update_id = setup_groups(bot, dispatcher, args.groups, args.operators, admin, 1)
+    chat_ids = list(groups)
+
+    window_size = max(1, args.messages // max(args.windows, 1))
+    print(f"{args.groups} 个群组 × {args.operators} 个操作人，{args.messages} 条消息，"
+          f"目标速率 {args.rate or '不限'}，模拟 {args.days or 0} 天")
+    print(f"{'窗口':>4} {'模拟日期':>10} {'条/秒':>8} {'p50(ms)':>8} {'p95(ms)':>8} {'p99(ms)':>8} "
+          f"{'RSS(MB)':>8} {'保存次数':>8} {'保存均值(ms)':>12} {'数据文件(KB)':>12}")
+
+    all_latencies = []
+    window_latencies = []
+    date_checks = []
+    counts = Counter()
+    errors = Counter()
+    window_start = run_start = time.perf_counter()
+    last_saves = save_stats(bot)
+    for i in range(args.messages):
+        if args.rate:
+            delay = run_start + i / args.rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        if clock is not None:
+            clock.advance(step)
+        now = clock.now().timestamp() if clock is not None else time.time()
+        if now >= next_check:
+            check_start = time.perf_counter()
+            bot.check_date_change(bot.CallbackContext(dispatcher))
+            date_checks.append(time.perf_counter() - check_start)
+            next_check = now + bot.RESET_CHECK_INTERVAL
+
+        name = rng.choices(names, weights)[0]
+        chat_id = rng.choice(chat_ids)
+        data = make_load_update(name, update_id, chat_id, rng.choice(groups[chat_id]), rng, now)
+        update_id += 1
+        counts[name] += 1
+
+        handler_start = time.perf_counter()
+        if not dispatch_update(bot, dispatcher, data):
+            errors[name] += 1
+        elapsed = time.perf_counter() - handler_start
+        window_latencies.append(elapsed)
+        all_latencies.append(elapsed)
+
+        if len(window_latencies) == window_size or i == args.messages - 1:
+            window_elapsed = time.perf_counter() - window_start
+            values = sorted(window_latencies)
+            saves = save_stats(bot)
+            save_count = saves[0] - last_saves[0]
+            save_avg = (saves[1] - last_saves[1]) / save_count if save_count else 0.0
+            rss, _ = bot.get_process_memory()
+            data_size = bot.metric_values.get(bot.metric_key('bot_save_bytes', None), 0)
+            print(f"{i // window_size + 1:>4} {bot.get_current_date():>10} {len(values) / window_elapsed:>8.1f} "
+                  f"{percentile(values, 0.5) * 1000:>8.2f} {percentile(values, 0.95) * 1000:>8.2f} "
+                  f"{percentile(values, 0.99) * 1000:>8.2f} {(rss or 0) / 1048576:>8.1f} {save_count:>8} "
+                  f"{save_avg * 1000:>12.2f} {data_size / 1024:>12.1f}")
+            window_latencies = []
+            window_start = time.perf_counter()
+            last_saves = saves
+
+    total = time.perf_counter() - run_start
+    values = sorted(all_latencies)
+    print(f"\n总计: {len(values)} 条，{total:.2f}s，{len(values) / total:.1f} 条/秒，"
+          f"p50={percentile(values, 0.5) * 1000:.2f}ms p95={percentile(values, 0.95) * 1000:.2f}ms "
+          f"p99={percentile(values, 0.99) * 1000:.2f}ms max={values[-1] * 1000:.2f}ms")
+    if date_checks:
+        print(f"日期变更检查: {len(date_checks)} 次，总耗时 {sum(date_checks) * 1000:.1f}ms，"
+              f"最长 {max(date_checks) * 1000:.1f}ms")
+    print("命令分布: " + ", ".join(f"{name}={count}" for name, count in counts.most_common()))
+    if errors:
+        print("处理出错: " + ", ".join(f"{name}={count}" for name, count in errors.most_common()))
+    print("Bot API调用: " + ", ".join(f"{endpoint}={count}" for endpoint, count in request.calls.most_common()))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+"""离线回放：把录制或合成的Update JSON依次交给handle_text_message / button_callback处理，
+统计吞吐量和处理延迟分位数，不需要Telegram账号，出站Bot API调用由FakeRequest记录
+
+用法:
+    python benchmarks/bench_replay.py [更新数]                      合成更新并回放（默认2000）
+    python benchmarks/bench_replay.py --replay updates.jsonl        回放录制的更新，每行一个getUpdates返回的Update对象
+    python benchmarks/bench_replay.py 5000 --dump updates.jsonl     同时保存合成的更新，之后可用--replay对比改动前后
+    python benchmarks/bench_replay.py --latency 0.05                模拟每次Bot API调用50ms的网络延迟
+"""
+import os
+import re
+import json
+import time
+import random
+import argparse
+from queue import Queue
+from collections import Counter, defaultdict
+
+from common import load_bot, FakeRequest, FAKE_TOKEN, percentile
+
+CHAT_ID = -1001000000001
+
+# 合成流量的组成：(模板, 权重)；{amount}等占位符随机填充，callback:开头的是按钮回调
+TRAFFIC_MIX = [
+    ('+{amount}', 40),
+    ('+{amount}/{rate}', 8),
+    ('-{amount}', 8),
+    ('回{usdt}', 8),
+    ('下发{usdt}', 8),
+    ('财务', 5),
+    ('计算 {amount}*{rate}', 5),
+    ('今天汇率多少', 6),
+    ('callback:export_bill_{chat_id}', 4),
+    ('callback:view_history_{chat_id}', 4),
+    ('callback:cancel', 4),
+]
+
+def make_user(user_id, username):
+    return {'id': user_id, 'is_bot': False, 'first_name': username, 'username': username}
+
+def make_chat(chat_id):
+    return {'id': chat_id, 'type': 'supergroup', 'title': f"测试群组{chat_id}"}
+
+def message_update(update_id, message_id, chat_id, user, text, date=None):
+    """构造一条群消息的Update JSON"""
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': message_id,
+            'date': int(date if date is not None else time.time()),
+            'chat': make_chat(chat_id),
+            'from': user,
+            'text': text,
+        },
+    }
+
+def callback_update(update_id, message_id, chat_id, user, data, date=None):
+    """构造一次按钮回调的Update JSON，按钮所在消息为机器人发送的消息"""
+    return {
+        'update_id': update_id,
+        'callback_query': {
+            'id': str(update_id),
+            'from': user,
+            'chat_instance': str(chat_id),
+            'data': data,
+            'message': {
+                'message_id': message_id,
+                'date': int(date if date is not None else time.time()),
+                'chat': make_chat(chat_id),
+                'from': {'id': 1, 'is_bot': True, 'first_name': 'Bench', 'username': 'bench_bot'},
+                'text': '账单',
+            },
+        },
+    }
+
+def fill_template(template, rng, chat_id):
+    return template.format(
+        amount=rng.choice([100, 200, 500, 1000, 2000]),
+        rate=rng.choice([7.1, 7.2, 7.3]),
+        usdt=rng.choice([10, 50, 100]),
+        chat_id=chat_id,
+    )
+
+def make_updates(count, user, chat_id=CHAT_ID, seed=0):
+    """合成count条更新：先授权群组，之后按TRAFFIC_MIX随机抽取"""
+    rng = random.Random(seed)
+    templates = [template for template, _ in TRAFFIC_MIX]
+    weights = [weight for _, weight in TRAFFIC_MIX]
+    updates = [message_update(1, 1, chat_id, user, '授权群')]
+    for update_id in range(2, count + 1):
+        text = fill_template(rng.choices(templates, weights)[0], rng, chat_id)
+        if text.startswith('callback:'):
+            updates.append(callback_update(update_id, update_id, chat_id, user, text[len('callback:'):]))
+        else:
+            updates.append(message_update(update_id, update_id, chat_id, user, text))
+    return updates
+
+def update_label(bot, data):
+    """按命令类型归类，用于分类统计延迟"""
+    if 'callback_query' in data:
+        return 'callback:' + re.sub(r'[-_\d]+$', '', data['callback_query'].get('data') or '')
+    text = ((data.get('message') or {}).get('text') or '').strip()
+    kind, body = bot.classify_message(text)
+    if kind == 'sign':
+        return body + ('N/rate' if '/' in text else 'N')
+    if kind in ('calc', 'math'):
+        return '计算'
+    if len(text) <= 8:
+        return re.sub(r'\d+(\.\d+)?', 'N', text)
+    return '其他'
+
+def make_dispatcher(bot, latency=0.0):
+    """返回 (dispatcher, FakeRequest)；dispatcher只用于构造CallbackContext，不调用start，不会启动工作线程"""
+    from telegram.ext import Dispatcher
+
+    request = FakeRequest(latency)
+    dispatcher = Dispatcher(bot.InstrumentedBot(FAKE_TOKEN, request=request), Queue(), workers=1)
+    return dispatcher, request
+
+def dispatch_update(bot, dispatcher, data):
+    """与Dispatcher相同的方式构造Update和CallbackContext，直接调用对应的处理函数
+
+    处理函数抛出的异常与Dispatcher一样交给handle_update_error记录，返回False
+    """
+    update = bot.Update.de_json(data, dispatcher.bot)
+    context = bot.CallbackContext.from_update(update, dispatcher)
+    try:
+        if update.callback_query:
+            bot.button_callback(update, context)
+        elif update.message:
+            bot.handle_text_message(update, context)
+    except Exception as e:
+        context.error = e
+        bot.handle_update_error(update, context)
+        return False
+    return True
+
+def replay(bot, dispatcher, updates):
+    """依次处理updates，返回 (总耗时秒, {分类: [每条处理耗时秒]}, {分类: 出错次数})"""
+    latencies = defaultdict(list)
+    errors = Counter()
+    start = time.perf_counter()
+    for data in updates:
+        label = update_label(bot, data)
+        handler_start = time.perf_counter()
+        if not dispatch_update(bot, dispatcher, data):
+            errors[label] += 1
+        latencies[label].append(time.perf_counter() - handler_start)
+    return time.perf_counter() - start, latencies, errors
+
+def format_latency_row(name, values):
+    values = sorted(values)
+    return (f"{name:<22} {len(values):>7} {percentile(values, 0.5) * 1000:>9.2f} "
+            f"{percentile(values, 0.95) * 1000:>9.2f} {percentile(values, 0.99) * 1000:>9.2f} "
+            f"{values[-1] * 1000:>9.2f}")
+
+def print_report(elapsed, latencies, errors, request):
+    all_values = [value for values in latencies.values() for value in values]
+    print(f"更新数: {len(all_values)}  总耗时: {elapsed:.2f}s  吞吐量: {len(all_values) / elapsed:.1f} 条/秒")
+    print(f"{'类型':<22} {'数量':>7} {'p50(ms)':>9} {'p95(ms)':>9} {'p99(ms)':>9} {'max(ms)':>9}")
+    for label in sorted(latencies, key=lambda label: -len(latencies[label])):
+        print(format_latency_row(label, latencies[label]))
+    print(format_latency_row('全部', all_values))
+    if errors:
+        print("处理出错: " + ", ".join(f"{label}={count}" for label, count in errors.most_common()))
+    print("Bot API调用: " + ", ".join(f"{endpoint}={count}" for endpoint, count in request.calls.most_common())
+          + f"  上传 {request.sent_bytes / 1024:.1f} KB")
+
+def main():
+    parser = argparse.ArgumentParser(description="离线回放更新，测量处理吞吐量和延迟")
+    parser.add_argument('count', nargs='?', type=int, default=2000, help="合成的更新数")
+    parser.add_argument('--replay', help="回放的更新文件（JSON Lines）")
+    parser.add_argument('--dump', help="把合成的更新保存到该文件")
+    parser.add_argument('--latency', type=float, default=0.0, help="每次Bot API调用的模拟延迟（秒）")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    # load_bot会切换到临时目录，先把文件路径转为绝对路径
+    replay_path = args.replay and os.path.abspath(args.replay)
+    dump_path = args.dump and os.path.abspath(args.dump)
+
+    bot = load_bot()
+    if replay_path:
+        with open(replay_path, encoding='utf-8') as f:
+            updates = [json.loads(line) for line in f if line.strip()]
+    else:
+        admin_id = bot.admin_user_id[0] if isinstance(bot.admin_user_id, list) else bot.admin_user_id
+        updates = make_updates(args.count, make_user(admin_id, 'bench_admin'), seed=args.seed)
+        if dump_path:
+            with open(dump_path, 'w', encoding='utf-8') as f:
+                for data in updates:
+                    f.write(json.dumps(data, ensure_ascii=False) + '\n')
+
+    dispatcher, request = make_dispatcher(bot, args.latency)
+    elapsed, latencies, errors = replay(bot, dispatcher, updates)
+    print_report(elapsed, latencies, errors, request)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+"""账单报表生成耗时随记录数的变化
+
+用法: python benchmarks/bench_reports.py [记录数 ...]
+"""
+import sys
+
+from common import load_bot, make_ledger, best_time
+
+DEFAULT_SIZES = [10, 100, 1000, 10000, 100000]
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or DEFAULT_SIZES
+    bot = load_bot()
+    today = bot.get_current_date()
+
+    print(f"{'记录数':>8} {'聚合(ms)':>10} {'摘要(ms)':>10} {'按日摘要(ms)':>12} {'详细账单(ms)':>12}")
+    for size in sizes:
+        ledger = make_ledger(size, today)
+        dates = [today]
+        rate = ledger['fixed_rate']
+        fee_rate = ledger['rate']
+        repeat = 5 if size <= 10000 else 2
+
+        aggregate_time = best_time(lambda: bot.aggregate_records([ledger]), repeat)
+        summary_time = best_time(
+            lambda: bot.format_bill_summary('测试群组', bot.aggregate_records([ledger]), rate, fee_rate), repeat)
+        daily_time = best_time(
+            lambda: bot.aggregate_records([ledger], dates=set(dates), by_date=True), repeat)
+        bill_time = best_time(lambda: ''.join(bot.iter_bill_detail_lines('测试群组', ledger)), repeat)
+
+        print(f"{size:>8} {aggregate_time * 1000:>10.2f} {summary_time * 1000:>10.2f} "
+              f"{daily_time * 1000:>12.2f} {bill_time * 1000:>12.2f}")
+
+if __name__ == '__main__':
+    main()
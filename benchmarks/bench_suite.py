@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+"""热点函数的微基准测试，可保存基线并与基线对比，用于在合并前发现性能退化
+
+每项测试自动确定循环次数（单次采样至少 --min-time 秒），取多次采样中每次调用耗时的中位数。
+与数据量相关的测试分别在每种记录数下运行（默认 10、1000、100000 条当日记录）。
+
+用法:
+    python benchmarks/bench_suite.py                        运行全部测试
+    python benchmarks/bench_suite.py --save main            运行并保存为基线 benchmarks/baselines/main.json
+    python benchmarks/bench_suite.py --compare main         运行并与基线对比，慢于阈值的项目标记出来，退出码为1
+    python benchmarks/bench_suite.py -k summary --sizes 10 1000
+基线与机器相关，只应与同一台机器上保存的基线对比，benchmarks/baselines/ 不提交到仓库：
+先在改动前的代码上 --save 生成基线，再在改动后的代码上 --compare。基线不存在或没有可对比的项目时退出码为2。
+"""
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import statistics
+
+from common import load_bot, make_ledger
+from bench_replay import make_user, message_update, callback_update, make_dispatcher
+
+DEFAULT_SIZES = [10, 1000, 100000]
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines')
+GROUP_COUNT = 10
+CHAT_ID = -1001000000000
+
+CALCULATOR_EXPRESSIONS = ['计算 1000*7.2', '(100+200)*3/7', '2**10-1', 'round(1234.5678/7.1, 2)']
+USDT_TEXTS = [
+    '请转到 TXYZabcdefghijklmnopqrstuvwxyz12345 谢谢',
+    '地址 0x52908400098527886E0F7030069857D2E4169EE7',
+    '今天的汇率是多少，老板在吗',
+]
+
+class Context:
+    """一次测试的环境：机器人模块、假Bot、管理员、当前数据量"""
+    def __init__(self, bot, size):
+        self.bot = bot
+        self.size = size
+        self.dispatcher, _ = make_dispatcher(bot)
+        admin_id = bot.admin_user_id[0] if isinstance(bot.admin_user_id, list) else bot.admin_user_id
+        self.admin = make_user(admin_id, 'bench_admin')
+        self.next_id = 1
+
+    def callback_context(self, update):
+        return self.bot.CallbackContext.from_update(update, self.dispatcher)
+
+    def message(self, text, chat_id=CHAT_ID):
+        self.next_id += 1
+        data = message_update(self.next_id, self.next_id, chat_id, self.admin, text)
+        return self.bot.Update.de_json(data, self.dispatcher.bot)
+
+    def callback(self, data, chat_id=CHAT_ID):
+        self.next_id += 1
+        update = callback_update(self.next_id, self.next_id, chat_id, self.admin, data)
+        return self.bot.Update.de_json(update, self.dispatcher.bot)
+
+def populate(bot, size):
+    """当日共size条记录：一半在CHAT_ID，其余平均分到另外GROUP_COUNT-1个群组"""
+    today = bot.get_current_date()
+    bot.chat_accounting = {}
+    bot.group_operators = {}
+    bot.authorized_groups = set()
+    counts = [size - size // 2] + [size // 2 // (GROUP_COUNT - 1)] * (GROUP_COUNT - 1)
+    for i, count in enumerate(counts):
+        chat_id = CHAT_ID - i
+        ledger = make_ledger(count, today, rate=7.2, fee_rate=1.0, seed=i)
+        del ledger['operators']
+        ledger['users'] = {}
+        bot.chat_accounting[chat_id] = ledger
+        bot.authorized_groups.add(chat_id)
+    bot.invalidate_live_daily_stats()
+
+# 每项测试：名称 -> (是否与数据量相关, setup)；setup(ctx)返回 (被测函数, 每次采样后的恢复函数或None)
+def setup_add_deposit_record(ctx):
+    bot = ctx.bot
+    update = ctx.message('+100')
+    deposits = bot.chat_accounting[CHAT_ID]['deposits']
+    original_count = len(deposits)
+
+    def reset():
+        del deposits[original_count:]
+        bot.invalidate_live_daily_stats()
+    return lambda: bot.add_deposit_record(update, 100), reset
+
+def setup_summary(ctx):
+    update = ctx.message('财务')
+    context = ctx.callback_context(update)
+    return lambda: ctx.bot.summary(update, context), None
+
+def setup_generate_group_summary(ctx):
+    # 目标群组在最后，需要查询所有群组的信息
+    name = f"测试群组{CHAT_ID - (GROUP_COUNT - 1)}"
+    bot = ctx.dispatcher.bot
+    return lambda: ctx.bot.generate_group_summary(name, bot), None
+
+def setup_export_all_groups_statistics(ctx):
+    update = ctx.callback('all_groups_today')
+    context = ctx.callback_context(update)
+    date_str = ctx.bot.get_current_date()
+    return lambda: ctx.bot.export_all_groups_statistics(update.callback_query, context, date_str), None
+
+def setup_send_date_selection(ctx):
+    update = ctx.callback('all_groups_by_date')
+    context = ctx.callback_context(update)
+    return lambda: ctx.bot.send_date_selection(update.callback_query, context), None
+
+def setup_handle_calculator(ctx):
+    def run():
+        for text in CALCULATOR_EXPRESSIONS:
+            ctx.bot.handle_calculator(text)
+    return run, None
+
+def setup_extract_usdt_address(ctx):
+    def run():
+        for text in USDT_TEXTS:
+            ctx.bot.extract_usdt_address(text)
+    return run, None
+
+def setup_save_data(ctx):
+    return ctx.bot.save_data, None
+
+def setup_load_data(ctx):
+    bot = ctx.bot
+    bot.save_data()
+    state = (bot.chat_accounting, bot.group_operators, bot.authorized_groups)
+
+    def reset():
+        bot.chat_accounting, bot.group_operators, bot.authorized_groups = state
+    return bot.load_data, reset
+
+BENCHMARKS = {
+    'add_deposit_record': (True, setup_add_deposit_record),
+    'summary': (True, setup_summary),
+    'generate_group_summary': (True, setup_generate_group_summary),
+    'export_all_groups_statistics': (True, setup_export_all_groups_statistics),
+    'send_date_selection': (True, setup_send_date_selection),
+    'handle_calculator': (False, setup_handle_calculator),
+    'extract_usdt_address': (False, setup_extract_usdt_address),
+    'save_data': (True, setup_save_data),
+    'load_data': (True, setup_load_data),
+}
+
+def measure(func, reset, samples, min_time):
+    """返回 (每次调用耗时中位数, 标准差, 每次采样的循环次数)"""
+    # 预热一次，首次调用建立的缓存不影响循环次数的确定
+    func()
+    if reset:
+        reset()
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            func()
+        elapsed = time.perf_counter() - start
+        if reset:
+            reset()
+        if elapsed >= min_time or loops >= 1 << 20:
+            break
+        loops *= 2 if elapsed <= 0 else max(2, min(10, int(min_time / elapsed) + 1))
+
+    timings = []
+    for _ in range(samples):
+        start = time.perf_counter()
+        for _ in range(loops):
+            func()
+        timings.append((time.perf_counter() - start) / loops)
+        if reset:
+            reset()
+    return statistics.median(timings), statistics.stdev(timings) if len(timings) > 1 else 0.0, loops
+
+def format_duration(seconds):
+    for unit, scale in (('s', 1), ('ms', 1e-3), ('us', 1e-6)):
+        if seconds >= scale:
+            return f"{seconds / scale:.2f} {unit}"
+    return f"{seconds / 1e-9:.0f} ns"
+
+def baseline_path(name):
+    return os.path.join(BASELINE_DIR, f"{name}.json")
+
+def main():
+    parser = argparse.ArgumentParser(description="热点函数微基准测试")
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help="当日记录数")
+    parser.add_argument('-k', dest='keyword', help="只运行名称包含该字符串的测试")
+    parser.add_argument('--samples', type=int, default=5)
+    parser.add_argument('--min-time', type=float, default=0.1, help="单次采样的最短秒数")
+    parser.add_argument('--save', metavar='NAME', help="保存结果为基线")
+    parser.add_argument('--compare', metavar='NAME', help="与基线对比")
+    parser.add_argument('--threshold', type=float, default=0.10, help="慢于基线该比例时视为退化（默认10%%）")
+    args = parser.parse_args()
+
+    baseline = None
+    if args.compare:
+        path = baseline_path(args.compare)
+        if not os.path.exists(path):
+            # 基线与机器相关，不提交到仓库，需要先在本机用 --save 生成
+            print(f"没有基线 {path}，请先在本机运行 --save {args.compare} 生成基线（例如在合并前的代码上运行）")
+            sys.exit(2)
+        with open(path, encoding='utf-8') as f:
+            baseline = json.load(f)['results']
+
+    bot = load_bot()
+    names = [name for name in BENCHMARKS if not args.keyword or args.keyword in name]
+    results = {}
+    regressions = []
+    missing = []  # 基线中没有的项目，未对比
+    header = f"{'测试':<30} {'记录数':>8} {'耗时/次':>12} {'标准差':>10} {'循环':>7}"
+    print(header + (f" {'基线':>12} {'变化':>8}" if baseline else ''))
+    for size in args.sizes:
+        populate(bot, size)
+        ctx = Context(bot, size)
+        for name in names:
+            sized, setup = BENCHMARKS[name]
+            if not sized and size != args.sizes[0]:
+                continue
+            key = f"{name}@{size}" if sized else name
+            func, reset = setup(ctx)
+            median, stdev, loops = measure(func, reset, args.samples, args.min_time)
+            results[key] = {'median': median, 'stdev': stdev, 'loops': loops}
+
+            line = f"{name:<30} {size if sized else '-':>8} {format_duration(median):>12} {format_duration(stdev):>10} {loops:>7}"
+            if baseline and key in baseline:
+                change = median / baseline[key]['median'] - 1
+                line += f" {format_duration(baseline[key]['median']):>12} {change:>+7.1%}"
+                if change > args.threshold:
+                    line += "  退化"
+                    regressions.append(key)
+            elif baseline is not None:
+                line += f" {'无基线':>12}"
+                missing.append(key)
+            print(line, flush=True)
+
+    if args.save:
+        os.makedirs(BASELINE_DIR, exist_ok=True)
+        with open(baseline_path(args.save), 'w', encoding='utf-8') as f:
+            json.dump({
+                'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'results': results,
+            }, f, ensure_ascii=False, indent=2)
+        print(f"基线已保存到 {baseline_path(args.save)}")
+
+    if baseline is not None:
+        if missing:
+            print(f"{len(missing)} 项在基线中没有数据，未对比: {', '.join(missing)}")
+        if regressions:
+            print(f"{len(regressions)} 项慢于基线超过 {args.threshold:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
+        if len(missing) == len(results):
+            print("没有任何项目可以与基线对比")
+            sys.exit(2)
+        print(f"已对比的 {len(results) - len(missing)} 项没有发现性能退化")
+
+if __name__ == '__main__':
+    main()
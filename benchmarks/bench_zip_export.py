@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+"""打包导出所有群组账单的耗时随工作数的变化：线程池 vs 进程池
+
+用法: python benchmarks/bench_zip_export.py [群组数] [每个群组记录数]
+"""
+import os
+import sys
+import datetime
+import tempfile
+
+from common import load_bot, make_ledger, best_time
+
+def main():
+    group_count = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    per_group = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    bot = load_bot()
+
+    # 昨天的记录已归档到历史账单
+    date_str = (datetime.datetime.strptime(bot.get_current_date(), '%Y-%m-%d')
+                - datetime.timedelta(days=1)).strftime('%Y-%m-%d')
+    groups = []
+    for i in range(group_count):
+        chat_id = -1000 - i
+        ledger = make_ledger(per_group, date_str, seed=i)
+        # 历史账单按JSON保存，不包含集合字段
+        del ledger['operators'], ledger['users']
+        bot.save_chat_history(chat_id, date_str, ledger)
+        groups.append((chat_id, f"测试群组{i}"))
+
+    cpu_count = os.cpu_count() or 1
+    worker_counts = sorted({1, 2, 4, cpu_count})
+
+    def build(kind, workers):
+        with tempfile.SpooledTemporaryFile(max_size=bot.EXPORT_SPOOL_MAX_SIZE) as buffer:
+            with bot.create_export_executor(kind, workers) as executor:
+                bot.write_groups_zip(buffer, date_str, groups, executor, workers * 2)
+
+    print(f"{group_count} 个群组，每个群组 {per_group} 条记录，CPU核数 {cpu_count}")
+    print(f"{'方式':<6} {'工作数':>6} {'耗时(ms)':>10} {'加速比':>8}")
+    for kind in ('thread', 'process'):
+        baseline = None
+        for workers in worker_counts:
+            elapsed = best_time(lambda: build(kind, workers), 3)
+            baseline = baseline or elapsed
+            print(f"{kind:<6} {workers:>6} {elapsed * 1000:>10.1f} {baseline / elapsed:>8.2f}")
+
+if __name__ == '__main__':
+    main()
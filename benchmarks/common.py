@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""性能测试公共工具：加载机器人模块、生成模拟账单记录、不联网的Bot API、计时"""
+import os
+import sys
+import math
+import time
+import random
+import logging
+import datetime
+import tempfile
+from collections import Counter
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def load_bot():
+    """在临时目录中导入机器人模块，避免日志和数据文件写入项目目录；重复调用返回同一模块"""
+    if 'accounting_bot' in sys.modules:
+        return sys.modules['accounting_bot']
+    if ROOT_DIR not in sys.path:
+        sys.path.insert(0, ROOT_DIR)
+    os.chdir(tempfile.mkdtemp(prefix='bot_bench_'))
+    import accounting_bot
+    # 测试时只保留警告以上的日志，避免日志输出影响计时
+    logging.getLogger().setLevel(logging.WARNING)
+    return accounting_bot
+
+def make_ledger(record_count, date_str, rate=7.2, fee_rate=0.0, seed=0):
+    """生成一天的模拟账单：约90%入款、10%出款，时间均匀分布在当天"""
+    rng = random.Random(seed)
+    users = [f"操作人{i}" for i in range(8)]
+    responders = [None] + [f"客户{i}" for i in range(30)]
+    day_start = datetime.datetime.strptime(date_str, '%Y-%m-%d')
+
+    deposits = []
+    withdrawals = []
+    for i in range(record_count):
+        record_time = day_start + datetime.timedelta(seconds=i * 86400 // max(record_count, 1))
+        time_str = record_time.strftime('%Y-%m-%d %H:%M:%S')
+        if rng.random() < 0.9:
+            amount = rng.choice([100, 200, 500, 1000, 2000, -100])
+            deposits.append({
+                'amount': amount,
+                'usd_equivalent': amount / rate,
+                'time': time_str,
+                'user': rng.choice(users),
+                'responder': rng.choice(responders),
+            })
+        else:
+            usdt = rng.choice([100, 500, 1000])
+            withdrawals.append({
+                'amount': usdt * rate,
+                'usd_equivalent': usdt,
+                'time': time_str,
+                'user': rng.choice(users),
+            })
+
+    return {
+        'deposits': deposits,
+        'withdrawals': withdrawals,
+        'operators': set(),
+        'users': set(),
+        'rate': fee_rate,
+        'fixed_rate': rate,
+    }
+
+class FakeRequest:
+    """替代telegram.utils.request.Request：不发送网络请求，记录每次Bot API调用并返回伪造的成功结果
+
+    用法: bot_module.InstrumentedBot(FAKE_TOKEN, request=FakeRequest())
+    """
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = Counter()
+        self.sent_bytes = 0
+        self.next_message_id = 100000
+
+    def post(self, url, data=None, timeout=None):
+        endpoint = url.rsplit('/', 1)[-1]
+        data = data or {}
+        self.calls[endpoint] += 1
+        for value in data.values():
+            content = getattr(value, 'input_file_content', None)
+            self.sent_bytes += len(content) if content is not None else 0
+        if self.latency:
+            time.sleep(self.latency)
+        return self.result(endpoint, data)
+
+    def result(self, endpoint, data):
+        """按接口返回Telegram格式的result字段"""
+        chat_id = int(data.get('chat_id') or 0)
+        if endpoint == 'getMe':
+            return {'id': 1, 'is_bot': True, 'first_name': 'Bench', 'username': 'bench_bot'}
+        if endpoint == 'getChat':
+            return {'id': chat_id, 'type': 'supergroup', 'title': f"测试群组{chat_id}"}
+        if endpoint == 'getUpdates':
+            return []
+        if endpoint in ('sendMessage', 'sendDocument', 'editMessageText'):
+            if endpoint == 'editMessageText' and not chat_id:
+                return True
+            self.next_message_id += 1
+            message = {
+                'message_id': int(data.get('message_id') or self.next_message_id),
+                'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'supergroup'},
+            }
+            if endpoint == 'sendDocument':
+                message['document'] = {'file_id': f"doc{self.next_message_id}", 'file_unique_id': f"u{self.next_message_id}"}
+            else:
+                message['text'] = data.get('text', '')
+            return message
+        return True
+
+    def stop(self):
+        pass
+
+# 格式合法的假令牌，只用于FakeRequest
+FAKE_TOKEN = '123456:benchmark-fake-token'
+
+def percentile(sorted_values, fraction):
+    """已排序列表的分位数（最近秩法）"""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, math.ceil(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+def best_time(func, repeat=5):
+    """重复执行取最短耗时（秒）"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
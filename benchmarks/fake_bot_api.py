@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+"""本地假Telegram Bot API服务器，用于离线测量 轮询 → 处理 → 回复 的端到端性能
+
+支持 getUpdates（长轮询）、sendMessage、editMessageText、sendDocument、getChat、answerCallbackQuery、
+getMe、deleteWebhook，其他方法一律返回成功。可以注入固定延迟、429限流和500错误。
+
+机器人第一次调用getUpdates后，服务器按 --rate 把合成（或 --replay 录制）的更新放入队列；
+--backlog 时服务器启动后立即全部放入，模拟机器人停机期间积压的消息，用于测试启动时的批量处理；
+从更新入队到机器人第一次回复该更新（回复消息的reply_to_message_id或answerCallbackQuery）的时间即端到端延迟。
+全部更新都被回复、或连续 --idle 秒没有新的回复后输出报告并退出。
+
+用法:
+    python benchmarks/fake_bot_api.py [--port 8081] [--updates 2000] [--rate 每秒更新数]
+                                      [--latency 秒] [--rate-limit 比例] [--errors 比例] [--replay 文件] [--backlog]
+然后在另一个目录中以 BOT_API_BASE_URL = "http://127.0.0.1:8081/bot" 启动机器人。
+"""
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+from collections import Counter
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from common import ROOT_DIR, FakeRequest, percentile
+from bench_replay import make_user, make_updates
+
+# 不计入端到端延迟、也不注入故障的方法
+PASSIVE_METHODS = {'getUpdates', 'getMe', 'deleteWebhook'}
+
+class FakeBotAPI:
+    """服务器状态：待发送的更新、每条更新的入队和首次回复时间、调用统计"""
+    def __init__(self, updates, rate=0.0, latency=0.0, rate_limit=0.0, errors=0.0, retry_after=1, seed=0):
+        self.source = updates
+        self.rate = rate
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.errors = errors
+        self.retry_after = retry_after
+        self.rng = random.Random(seed)
+        self.results = FakeRequest()
+        self.condition = threading.Condition()
+        self.pending = []  # 已入队、尚未被确认的更新
+        self.arrivals = {}  # (chat_id, message_id) 或 回调ID -> 入队时间
+        self.latencies = []
+        self.calls = Counter()
+        self.injected = Counter()
+        self.feeder = None
+        self.last_answer = time.monotonic()
+        self.first_arrival = None
+
+    def start_feeding(self):
+        """机器人完成启动（第一次getUpdates）后开始按速率放入更新"""
+        if self.feeder is None:
+            self.feeder = threading.Thread(target=self.feed, daemon=True)
+            self.feeder.start()
+
+    def feed(self):
+        start = time.monotonic()
+        for i, data in enumerate(self.source):
+            if self.rate:
+                delay = start + i / self.rate - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            with self.condition:
+                now = time.monotonic()
+                self.first_arrival = self.first_arrival or now
+                self.arrivals[update_key(data)] = now
+                self.pending.append(data)
+                self.condition.notify_all()
+
+    def get_updates(self, data):
+        self.start_feeding()
+        offset = int(data.get('offset') or 0)
+        limit = int(data.get('limit') or 100)
+        timeout = float(data.get('timeout') or 0)
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            # offset之前的更新已被确认
+            self.pending = [update for update in self.pending if update['update_id'] >= offset]
+            while not self.pending and time.monotonic() < deadline:
+                self.condition.wait(deadline - time.monotonic())
+            return self.pending[:limit]
+
+    def record_answer(self, endpoint, data):
+        """记录某条更新的第一次回复"""
+        if endpoint == 'answerCallbackQuery':
+            key = str(data.get('callback_query_id'))
+        elif data.get('reply_to_message_id'):
+            key = (int(data['chat_id']), int(data['reply_to_message_id']))
+        else:
+            return
+        with self.condition:
+            arrival = self.arrivals.pop(key, None)
+            if arrival is not None:
+                now = time.monotonic()
+                self.latencies.append(now - arrival)
+                self.last_answer = now
+
+    def call(self, endpoint, data):
+        """返回 (HTTP状态码, 响应JSON)"""
+        with self.condition:
+            self.calls[endpoint] += 1
+        if endpoint == 'getUpdates':
+            return 200, {'ok': True, 'result': self.get_updates(data)}
+        if endpoint == 'deleteWebhook' and str(data.get('drop_pending_updates')).lower() == 'true':
+            with self.condition:
+                self.pending.clear()
+
+        if endpoint not in PASSIVE_METHODS:
+            if self.latency:
+                time.sleep(self.latency)
+            with self.condition:
+                roll = self.rng.random()
+            if roll < self.rate_limit:
+                self.injected['429'] += 1
+                return 429, {'ok': False, 'error_code': 429,
+                             'description': f"Too Many Requests: retry after {self.retry_after}",
+                             'parameters': {'retry_after': self.retry_after}}
+            if roll < self.rate_limit + self.errors:
+                self.injected['500'] += 1
+                return 500, {'ok': False, 'error_code': 500, 'description': 'Internal Server Error'}
+            self.record_answer(endpoint, data)
+
+        with self.condition:
+            result = self.results.result(endpoint, data)
+        return 200, {'ok': True, 'result': result}
+
+    def finished(self, idle):
+        """全部更新都已入队，且都被回复或已经idle秒没有新回复"""
+        if self.feeder is None or self.feeder.is_alive():
+            return False
+        with self.condition:
+            if not self.arrivals:
+                return True
+        return time.monotonic() - self.last_answer > idle
+
+    def report(self):
+        values = sorted(self.latencies)
+        total = len(self.source)
+        print(f"更新: {total} 条，已回复 {len(values)} 条，未回复 {len(self.arrivals)} 条")
+        if values:
+            elapsed = self.last_answer - self.first_arrival
+            print(f"吞吐量: {len(values) / elapsed if elapsed > 0 else 0:.1f} 条/秒  端到端延迟: "
+                  f"p50={percentile(values, 0.5) * 1000:.1f}ms p95={percentile(values, 0.95) * 1000:.1f}ms "
+                  f"p99={percentile(values, 0.99) * 1000:.1f}ms max={values[-1] * 1000:.1f}ms")
+        print("API调用: " + ", ".join(f"{endpoint}={count}" for endpoint, count in self.calls.most_common()))
+        if self.injected:
+            print("注入故障: " + ", ".join(f"{kind}={count}" for kind, count in self.injected.items()))
+
+def update_key(data):
+    if 'callback_query' in data:
+        return str(data['callback_query']['id'])
+    message = data['message']
+    return (message['chat']['id'], message['message_id'])
+
+def parse_body(content_type, body):
+    """解析JSON或multipart/form-data请求体，文件字段只保留内容"""
+    if content_type.startswith('application/json'):
+        return json.loads(body or b'{}')
+    if content_type.startswith('multipart/form-data'):
+        message = BytesParser(policy=HTTP).parsebytes(
+            b'Content-Type: ' + content_type.encode('latin-1') + b'\r\n\r\n' + body)
+        data = {}
+        for part in message.iter_parts():
+            name = part.get_param('name', header='content-disposition')
+            payload = part.get_payload(decode=True)
+            data[name] = payload if part.get_filename() else payload.decode('utf-8')
+        return data
+    return {}
+
+class FakeBotAPIHandler(BaseHTTPRequestHandler):
+    """处理 /bot<令牌>/<方法> 请求"""
+    protocol_version = 'HTTP/1.1'
+    # 响应头和响应体分两次写出，不关闭Nagle算法时每个请求会多等一次延迟确认（约40ms）
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        data = parse_body(self.headers.get('Content-Type', ''), self.rfile.read(length))
+        endpoint = self.path.split('?', 1)[0].rsplit('/', 1)[-1]
+        status, response = self.server.api.call(endpoint, data)
+        body = json.dumps(response, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = do_POST
+
+    def log_message(self, format, *args):
+        return
+
+def main():
+    parser = argparse.ArgumentParser(description="本地假Telegram Bot API服务器")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--updates', type=int, default=2000, help="合成的更新数")
+    parser.add_argument('--replay', help="改为发送录制的更新（JSON Lines）")
+    parser.add_argument('--rate', type=float, default=0.0, help="每秒放入的更新数，0表示一次全部放入")
+    parser.add_argument('--latency', type=float, default=0.0, help="每次调用（getUpdates除外）的延迟秒数")
+    parser.add_argument('--rate-limit', type=float, default=0.0, help="返回429的调用比例")
+    parser.add_argument('--errors', type=float, default=0.0, help="返回500的调用比例")
+    parser.add_argument('--retry-after', type=int, default=1, help="429响应中的retry_after秒数")
+    parser.add_argument('--backlog', action='store_true', help="启动后立即放入全部更新，模拟停机期间积压的消息")
+    parser.add_argument('--idle', type=float, default=5.0, help="连续多少秒没有新回复时结束")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if args.replay:
+        with open(args.replay, encoding='utf-8') as f:
+            updates = [json.loads(line) for line in f if line.strip()]
+    else:
+        # 合成的更新由第一个全局管理员发送，与机器人读取的是同一份配置
+        sys.path.insert(0, ROOT_DIR)
+        import config
+        admin_id = config.ADMIN_USER_ID[0] if isinstance(config.ADMIN_USER_ID, list) else config.ADMIN_USER_ID
+        updates = make_updates(args.updates, make_user(admin_id, 'bench_admin'), seed=args.seed)
+
+    api = FakeBotAPI(updates, args.rate, args.latency, args.rate_limit, args.errors, args.retry_after, args.seed)
+    server = ThreadingHTTPServer((args.host, args.port), FakeBotAPIHandler)
+    server.daemon_threads = True
+    server.api = api
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    if args.backlog:
+        api.start_feeding()
+    print(f"假Bot API已启动: http://{args.host}:{args.port}/bot ，等待机器人连接...")
+
+    try:
+        while not api.finished(args.idle):
+            time.sleep(0.2)
+    except KeyboardInterrupt:
+        pass
+    api.report()
+    server.shutdown()
+
+if __name__ == '__main__':
+    main()
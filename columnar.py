@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""账单数据的紧凑列存二进制格式，供对账脚本直接读取，不依赖机器人模块
+
+文件结构（整数均为小端）：
+    b'LDGC' | 版本 u8 | 行数 u32 | 元数据JSON长度 u32 + 元数据JSON | 列数 u16
+    每列：列名长度 u16 + 列名 | 类型 1字节 | 列数据
+列类型：
+    q  int64
+    d  float64
+    t  时间戳 int64，记录时间（当地时间，时区见元数据timezone）距 1970-01-01 00:00:00 的秒数
+    s  字典编码的字符串：字典大小 u32 + 每个值(长度 u32 + utf-8)，之后每行一个 u32 下标，0xFFFFFFFF 表示空值
+"""
+import sys
+import json
+import struct
+import datetime
+from array import array
+
+MAGIC = b'LDGC'
+VERSION = 1
+NULL_INDEX = 0xFFFFFFFF
+EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+
+def _find_typecode(candidates, itemsize):
+    """array的元素大小取决于平台，选出与文件格式宽度一致的类型码"""
+    for typecode in candidates:
+        if array(typecode).itemsize == itemsize:
+            return typecode
+    raise ImportError(f"当前平台没有 {itemsize} 字节的数组类型（候选 {candidates}）")
+
+UINT32 = _find_typecode('IL', 4)
+INT64 = _find_typecode('ql', 8)
+FLOAT64 = _find_typecode('d', 8)
+
+def parse_timestamp(time_str):
+    """把 'YYYY-MM-DD HH:MM:SS' 转为距 1970-01-01 的秒数，比strptime快得多"""
+    days = datetime.date(int(time_str[0:4]), int(time_str[5:7]), int(time_str[8:10])).toordinal() - EPOCH_ORDINAL
+    return days * 86400 + int(time_str[11:13]) * 3600 + int(time_str[14:16]) * 60 + int(time_str[17:19])
+
+def format_timestamp(seconds):
+    """parse_timestamp的逆运算"""
+    return (datetime.datetime(1970, 1, 1) + datetime.timedelta(seconds=seconds)).strftime('%Y-%m-%d %H:%M:%S')
+
+class _StringColumn:
+    """字典编码的字符串列"""
+    def __init__(self):
+        self.values = {}
+        self.indexes = array(UINT32)
+
+    def append(self, value):
+        if value is None:
+            self.indexes.append(NULL_INDEX)
+            return
+        index = self.values.get(value)
+        if index is None:
+            index = self.values[value] = len(self.values)
+        self.indexes.append(index)
+
+    def write(self, fileobj):
+        fileobj.write(struct.pack('<I', len(self.values)))
+        for value in self.values:
+            encoded = value.encode('utf-8')
+            fileobj.write(struct.pack('<I', len(encoded)))
+            fileobj.write(encoded)
+        _write_array(fileobj, self.indexes)
+
+class _NumberColumn:
+    """int64 / float64 / 时间戳列"""
+    def __init__(self, column_type):
+        self.convert = parse_timestamp if column_type == 't' else None
+        self.data = array(FLOAT64 if column_type == 'd' else INT64)
+
+    def append(self, value):
+        if self.convert:
+            value = self.convert(value)
+        self.data.append(value)
+
+    def write(self, fileobj):
+        _write_array(fileobj, self.data)
+
+def _write_array(fileobj, data):
+    if sys.byteorder != 'little':
+        data = array(data.typecode, data)
+        data.byteswap()
+    fileobj.write(data.tobytes())
+
+def _read_array(fileobj, typecode, count):
+    data = array(typecode)
+    data.frombytes(fileobj.read(data.itemsize * count))
+    if sys.byteorder != 'little':
+        data.byteswap()
+    return data
+
+def write_columnar(fileobj, columns, rows, metadata=None):
+    """一次遍历rows按列写入fileobj
+
+    columns为 [(列名, 类型)]，rows为与列顺序一致的元组序列；数值和时间列不允许空值
+    """
+    builders = [_StringColumn() if column_type == 's' else _NumberColumn(column_type) for _, column_type in columns]
+    row_count = 0
+    for row in rows:
+        for builder, value in zip(builders, row):
+            builder.append(value)
+        row_count += 1
+
+    encoded_metadata = json.dumps(metadata or {}, ensure_ascii=False).encode('utf-8')
+    fileobj.write(MAGIC)
+    fileobj.write(struct.pack('<BII', VERSION, row_count, len(encoded_metadata)))
+    fileobj.write(encoded_metadata)
+    fileobj.write(struct.pack('<H', len(columns)))
+    for (name, column_type), builder in zip(columns, builders):
+        encoded_name = name.encode('utf-8')
+        fileobj.write(struct.pack('<H', len(encoded_name)))
+        fileobj.write(encoded_name)
+        fileobj.write(column_type.encode('ascii'))
+        builder.write(fileobj)
+    return row_count
+
+def read_columnar(fileobj):
+    """读取列存文件，返回 (元数据, {列名: 值列表})；时间列返回秒数，可用format_timestamp转换"""
+    if fileobj.read(4) != MAGIC:
+        raise ValueError("不是账单列存文件")
+    version, row_count, metadata_size = struct.unpack('<BII', fileobj.read(9))
+    if version != VERSION:
+        raise ValueError(f"不支持的列存文件版本: {version}")
+    metadata = json.loads(fileobj.read(metadata_size).decode('utf-8'))
+
+    columns = {}
+    (column_count,) = struct.unpack('<H', fileobj.read(2))
+    for _ in range(column_count):
+        (name_size,) = struct.unpack('<H', fileobj.read(2))
+        name = fileobj.read(name_size).decode('utf-8')
+        column_type = fileobj.read(1).decode('ascii')
+        if column_type == 's':
+            (value_count,) = struct.unpack('<I', fileobj.read(4))
+            values = []
+            for _ in range(value_count):
+                (size,) = struct.unpack('<I', fileobj.read(4))
+                values.append(fileobj.read(size).decode('utf-8'))
+            indexes = _read_array(fileobj, UINT32, row_count)
+            columns[name] = [None if index == NULL_INDEX else values[index] for index in indexes]
+        else:
+            columns[name] = _read_array(fileobj, FLOAT64 if column_type == 'd' else INT64, row_count).tolist()
+    return metadata, columns
@@ -22,4 +22,69 @@ INITIAL_OPERATORS = [
 TIMEZONE = "Asia/Shanghai"
 
 # 每日重置检查间隔（秒）
-RESET_CHECK_INTERVAL = 3600  # 每小时检查一次 
\ No newline at end of file
+RESET_CHECK_INTERVAL = 3600  # 结账在结账时间点准时执行，这里是兜底检查的间隔
+
+# 历史账单存储目录（每个群组每天一个文件，查看时才加载）
+HISTORY_DIR = "history"
+
+# 内存中最多缓存的历史账单份数（群组+日期）
+HISTORY_CACHE_SIZE = 64
+
+# 分级保留：原始交易记录保留的天数，超过后压缩为每日每群汇总
+RAW_HISTORY_DAYS = 7
+
+# 每日汇总保留的天数
+ROLLUP_RETENTION_DAYS = 400
+
+# 每日汇总存储目录
+ROLLUP_DIR = "rollups"
+
+# 导出的报表在内存中生成后直接发送，超过该大小（字节）时转存到临时文件
+EXPORT_SPOOL_MAX_SIZE = 4 * 1024 * 1024
+
+# 是否在发送后另存一份导出文件到EXPORT_ARCHIVE_DIR
+EXPORT_ARCHIVE = False
+
+# 导出归档目录，超过保留天数或总大小上限的旧文件会被自动删除
+EXPORT_ARCHIVE_DIR = "exports"
+EXPORT_ARCHIVE_MAX_DAYS = 30
+EXPORT_ARCHIVE_MAX_MB = 200
+
+# 已结束日期的导出文件缓存数量（按LRU淘汰），该日期的记录被修改时自动失效
+EXPORT_CACHE_SIZE = 32
+
+# 打包导出所有群组账单时使用的工作池："thread"（线程池）或 "process"（进程池）
+EXPORT_ZIP_EXECUTOR = "thread"
+# 工作数，0表示使用CPU核数
+EXPORT_ZIP_WORKERS = 0
+
+# 处理单个更新超过该秒数时在日志中记录耗时分解（路由、记账、保存、聚合、报表生成、每次Bot API调用）
+SLOW_UPDATE_THRESHOLD = 1.0
+
+# 性能分析（/profile 命令和 SIGUSR1/SIGUSR2 信号）的默认采集秒数
+PROFILE_DEFAULT_SECONDS = 30
+
+# 日志级别，以及按logger名称单独设置的级别（如需排查网络问题可把urllib3设为"DEBUG"）
+LOG_LEVEL = "INFO"
+LOG_LEVELS = {
+    "telegram.vendor.ptb_urllib3.urllib3": "WARNING",
+    "urllib3": "WARNING",
+    "apscheduler": "WARNING",
+}
+
+# 日志文件超过LOG_MAX_MB后轮转，旧文件压缩为.gz，最多保留LOG_BACKUP_COUNT个
+LOG_FILE = "bot.log"
+LOG_MAX_MB = 10
+LOG_BACKUP_COUNT = 5
+
+# Bot API地址（以/bot结尾），为空时使用官方接口 https://api.telegram.org/bot
+# 离线端到端性能测试时设为本地假接口，如 "http://127.0.0.1:8081/bot"（见 benchmarks/fake_bot_api.py）
+BOT_API_BASE_URL = ""
+
+# 每日结账时间（按TIMEZONE的小时，0表示午夜），到点时归档当前账单并开始新账单
+DAILY_CUTOFF_HOUR = 0
+# 按群组单独设置结账时间，如 {-1001234567890: 4} 表示该群凌晨4点才开始新账单；按日期的报表和历史账单仍以记录时间的日期为准
+GROUP_CUTOFF_HOURS = {}
+
+# 启动时批量处理停机期间积压的消息（处理完后保存一次、每个群组回复一次账单摘要），设为False时启动时丢弃积压的消息
+CATCH_UP_PENDING_UPDATES = True
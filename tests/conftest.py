@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+"""测试公共夹具：在临时目录中导入机器人模块，每个测试使用独立的数据目录和手动控制的时钟"""
+import os
+import sys
+import logging
+import datetime
+import tempfile
+
+import pytest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+@pytest.fixture(scope='session')
+def bot_module():
+    """导入机器人模块；导入时创建的日志和数据文件写入临时目录，不污染项目目录"""
+    if 'accounting_bot' not in sys.modules:
+        if ROOT_DIR not in sys.path:
+            sys.path.insert(0, ROOT_DIR)
+        cwd = os.getcwd()
+        os.chdir(tempfile.mkdtemp(prefix='bot_test_'))
+        try:
+            import accounting_bot  # noqa: F401
+        finally:
+            os.chdir(cwd)
+        logging.getLogger().setLevel(logging.WARNING)
+    return sys.modules['accounting_bot']
+
+@pytest.fixture
+def bot(bot_module, tmp_path, monkeypatch):
+    """清空账单、待归档队列和缓存，历史和汇总文件写入tmp_path，时钟换成FakeClock（bot.clock）"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(bot_module, 'GROUP_CUTOFF_HOURS', {})
+    monkeypatch.setattr(bot_module, 'DAILY_CUTOFF_HOUR', 0)
+    bot_module.chat_accounting.clear()
+    bot_module.pending_archives.clear()
+    bot_module.history_cache.clear()
+    bot_module.export_cache.clear()
+    bot_module.invalidate_live_daily_stats()
+    previous_clock = bot_module.set_clock(bot_module.FakeClock(bot_module.timezone.localize(datetime.datetime(2026, 10, 20, 10))))
+    yield bot_module
+    bot_module.set_clock(previous_clock)
+    bot_module.chat_accounting.clear()
+    bot_module.pending_archives.clear()
+    bot_module.history_cache.clear()
+
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""启动时批量处理积压的更新：时钟按每条更新的时间前进，跨过结账时间的记录计入正确的账单"""
+import datetime
+from types import SimpleNamespace
+
+from telegram import CallbackQuery, Chat, Message, Update, User
+
+CHAT_ID = -1001000000001
+
+class FakeBot:
+    def __init__(self, updates):
+        self.pages = [updates, []]
+
+    def delete_webhook(self):
+        pass
+
+    def get_updates(self, **kwargs):
+        return self.pages.pop(0)
+
+class RecordingDispatcher:
+    """每条更新记一笔入款，记录时间取处理时的时钟"""
+    def __init__(self, bot):
+        self.bot = bot
+
+    def process_update(self, update):
+        self.bot.count_received_update(update, None)
+        self.bot.append_chat_record(CHAT_ID, 'deposits', {
+            'amount': update.update_id, 'usd_equivalent': 0, 'time': self.bot.get_current_timestamp(),
+            'user': '操作人', 'responder': None,
+        })
+
+def test_backlog_crossing_cutoff_uses_each_update_time(bot, monkeypatch):
+    monkeypatch.setattr(bot, 'GROUP_CUTOFF_HOURS', {CHAT_ID: 4})
+    monkeypatch.setattr(bot, 'last_update_id', None)
+    monkeypatch.setattr(bot, 'last_update_time', None)
+    startup = bot.timezone.localize(datetime.datetime(2026, 10, 21, 9))
+    bot.clock.set(startup)
+    
+    def local(hour, minute):
+        return bot.timezone.localize(datetime.datetime(2026, 10, 21, hour, minute))
+    chat = Chat(CHAT_ID, 'supergroup')
+    user = User(1, '操作人', False)
+    button_message = Message(90, local(3, 0), chat)
+    updates = [
+        Update(1, message=Message(101, local(3, 50), chat, from_user=user, text='+1')),
+        # 频道消息、按钮回调和编辑过的消息也按各自的时间计入
+        Update(2, channel_post=Message(102, local(4, 5), chat, text='+2')),
+        Update(3, callback_query=CallbackQuery('q', user, 'c', message=button_message, data='summary')),
+        Update(4, edited_message=Message(103, local(3, 30), chat, from_user=user, text='+4', edit_date=local(4, 20))),
+    ]
+    
+    updater = SimpleNamespace(bot=FakeBot(updates), dispatcher=RecordingDispatcher(bot), last_update_id=0)
+    bot.catch_up_pending_updates(updater)
+    
+    # 结账前的一笔留在前一天的账单中，之后的记入新账单；按钮回调不会让时钟倒退
+    (_, old_ledger), = bot.get_pending_ledgers(CHAT_ID)
+    assert old_ledger['date'] == '2026-10-20'
+    assert [(r['amount'], r['time']) for r in old_ledger['deposits']] == [(1, '2026-10-21 03:50:00')]
+    ledger = bot.chat_accounting[CHAT_ID]
+    assert ledger['date'] == '2026-10-21'
+    assert [(r['amount'], r['time']) for r in ledger['deposits']] == [
+        (2, '2026-10-21 04:05:00'), (3, '2026-10-21 04:05:00'), (4, '2026-10-21 04:20:00'),
+    ]
+    
+    assert bot.last_update_time == int(local(4, 20).timestamp())
+    assert updater.last_update_id == 5
+    assert bot.get_now() == startup
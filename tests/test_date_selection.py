@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+"""财务查账：选择已结账的日期时按每日统计判断是否有记录"""
+import datetime
+from types import SimpleNamespace
+
+CHAT_ID = -1001000000001
+
+class FakeQuery:
+    def __init__(self):
+        self.texts = []
+
+    def edit_message_text(self, text, **kwargs):
+        self.texts.append(text)
+
+def test_archived_date_is_not_reported_empty(bot, monkeypatch):
+    bot.append_chat_record(CHAT_ID, 'deposits', {
+        'amount': 100, 'usd_equivalent': 0, 'time': bot.get_current_timestamp(), 'user': '操作人', 'responder': None,
+    })
+    bot.clock.set(bot.timezone.localize(datetime.datetime(2026, 10, 21, 9)))
+    bot.check_date_change(None)
+    assert not bot.pending_archives
+    
+    exported = []
+    monkeypatch.setattr(bot, 'export_all_groups_statistics',
+                        lambda query, context, date_str, stats=None: exported.append((date_str, stats)))
+    query = FakeQuery()
+    bot.handle_date_selection(query, SimpleNamespace(user_data={}), '2026-10-20')
+    
+    assert query.texts == []
+    assert exported[0][0] == '2026-10-20'
+    assert exported[0][1]['chats'][CHAT_ID]['deposit_total'] == 100
+
+def test_date_without_records_is_reported_empty(bot):
+    query = FakeQuery()
+    bot.handle_date_selection(query, SimpleNamespace(user_data={}), '2026-10-19')
+    assert query.texts == ["在 2026-10-19 没有找到任何群组的记账记录"]
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""结账：旧账单换下后、写入历史存储之前，报表和统计仍然包含其中的记录"""
+import datetime
+
+CHAT_ID = -1001000000001
+OTHER_CHAT_ID = -1001000000002
+
+def set_time(bot, *args):
+    bot.clock.set(bot.timezone.localize(datetime.datetime(*args)))
+
+def deposit(bot, chat_id, amount):
+    bot.append_chat_record(chat_id, 'deposits', {
+        'amount': amount, 'usd_equivalent': 0, 'time': bot.get_current_timestamp(), 'user': '操作人', 'responder': None,
+    })
+
+def date_total(bot, chat_id, date_str):
+    return bot.aggregate_records(bot.get_chat_ledgers(chat_id, [date_str]), dates={date_str})['deposit_total']
+
+def stats_total(bot, chat_id, date_str):
+    rollup = bot.get_daily_stats(date_str)['chats'].get(chat_id)
+    return rollup['deposit_total'] if rollup else 0
+
+def test_swapped_ledger_is_visible_before_archiving(bot):
+    deposit(bot, CHAT_ID, 100)
+    
+    # 处理消息时换下账单，结账任务还没有归档
+    set_time(bot, 2026, 10, 21, 9)
+    assert bot.get_chat_accounting(CHAT_ID)['date'] == '2026-10-21'
+    assert len(bot.pending_archives) == 1
+    
+    assert date_total(bot, CHAT_ID, '2026-10-20') == 100
+    assert "总入款：100.00" in "".join(bot.iter_chat_date_export_lines(CHAT_ID, '群组', '2026-10-20'))
+    assert stats_total(bot, CHAT_ID, '2026-10-20') == 100
+    # 报表内容包含历史账单之外的数据，不能缓存
+    assert bot.get_export_cache_key(CHAT_ID, '2026-10-20', 'date_txt', '群组') is None
+    
+    # 归档后不重复计入
+    assert bot.archive_pending_ledgers() == 1
+    assert date_total(bot, CHAT_ID, '2026-10-20') == 100
+    assert stats_total(bot, CHAT_ID, '2026-10-20') == 100
+    assert bot.get_export_cache_key(CHAT_ID, '2026-10-20', 'date_txt', '群组') is not None
+
+def test_ledger_whose_archive_failed_stays_visible(bot, monkeypatch):
+    deposit(bot, CHAT_ID, 100)
+    deposit(bot, OTHER_CHAT_ID, 30)
+    set_time(bot, 2026, 10, 21, 9)
+    bot.get_chat_accounting(CHAT_ID)
+    bot.get_chat_accounting(OTHER_CHAT_ID)
+    
+    # 只有一个群组写入失败：该日期的汇总文件已经生成，但不包含这个群组
+    save_chat_history = bot.save_chat_history
+    def failing_save(chat_id, date_str, day_data):
+        if chat_id == CHAT_ID:
+            raise OSError("磁盘已满")
+        save_chat_history(chat_id, date_str, day_data)
+    monkeypatch.setattr(bot, 'save_chat_history', failing_save)
+    assert bot.archive_pending_ledgers() == 1
+    assert [chat_id for chat_id, _ in bot.pending_archives] == [CHAT_ID]
+    
+    assert bot.load_daily_stats('2026-10-20') is not None
+    assert stats_total(bot, CHAT_ID, '2026-10-20') == 100
+    assert stats_total(bot, OTHER_CHAT_ID, '2026-10-20') == 30
+    assert date_total(bot, CHAT_ID, '2026-10-20') == 100
+    
+    monkeypatch.setattr(bot, 'save_chat_history', save_chat_history)
+    assert bot.archive_pending_ledgers() == 1
+    assert stats_total(bot, CHAT_ID, '2026-10-20') == 100
+
+def test_records_after_midnight_in_swapped_ledger_count_for_today(bot, monkeypatch):
+    monkeypatch.setattr(bot, 'GROUP_CUTOFF_HOURS', {CHAT_ID: 4})
+    deposit(bot, CHAT_ID, 100)
+    set_time(bot, 2026, 10, 21, 2)
+    deposit(bot, CHAT_ID, 200)
+    
+    # 04:00结账后，零点到结账时间之间的记录属于今天的统计
+    set_time(bot, 2026, 10, 21, 5)
+    bot.get_chat_accounting(CHAT_ID)
+    assert stats_total(bot, CHAT_ID, '2026-10-21') == 200
+    assert date_total(bot, CHAT_ID, '2026-10-21') == 200
+    
+    bot.archive_pending_ledgers()
+    bot.invalidate_live_daily_stats()
+    assert stats_total(bot, CHAT_ID, '2026-10-21') == 200
+    assert date_total(bot, CHAT_ID, '2026-10-21') == 200
+    assert date_total(bot, CHAT_ID, '2026-10-20') == 100